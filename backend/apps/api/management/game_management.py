@@ -1,4 +1,4 @@
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 import json
 from django.views.decorators.csrf import ensure_csrf_cookie
 from rest_framework.decorators import api_view
@@ -6,7 +6,8 @@ from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 import logging
 
-from apps.game.models.game import GameRoom
+from apps.game.models.game import GameRoom, GameResult
+from apps.game.engine.replay import ReplayFile, MAX_SPEED
 
 
 logger = logging.getLogger(__name__)
@@ -103,3 +104,40 @@ def list_game_rooms(request):
 	except Exception as e:
 		return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
+
+@api_view(['GET'])
+def stream_replay(request, result_id):
+	"""
+	Stream the replay of a finished game as recorded: its header, then the
+	records from the last keyframe at or before ?tick=, paced at ?speed=
+	times real time or all at once without it. See ws/replay/ for seeking
+	while playing.
+	"""
+	try:
+		tick = int(request.GET.get('tick', 0))
+		speed = float(request.GET.get('speed', 0))
+		if not 0 <= speed <= MAX_SPEED:
+			raise ValueError(speed)
+	except ValueError:
+		return JsonResponse({'status': 'error', 'message': 'Invalid tick or speed'}, status=400)
+
+	try:
+		result = GameResult.objects.get(id=result_id)
+	except GameResult.DoesNotExist:
+		return JsonResponse({'status': 'error', 'message': 'Game not found'}, status=404)
+
+	if not result.replay:
+		return JsonResponse({'status': 'error', 'message': 'Game was not recorded'}, status=404)
+
+	try:
+		replay = ReplayFile.open(result.replay.path)
+	except (OSError, ValueError) as e:
+		logger.error(f"Replay of game {result_id} unavailable: {str(e)}")
+		return JsonResponse({'status': 'error', 'message': 'Replay unavailable'}, status=404)
+
+	async def records():
+		yield replay.prelude
+		async for _, chunk in replay.stream(replay.seek(tick), speed):
+			yield chunk
+
+	return StreamingHttpResponse(records(), content_type='application/octet-stream')
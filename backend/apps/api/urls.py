@@ -29,6 +29,7 @@ from .management.game_management import (
 	create_game_room,
 	get_config_game_room,
 	list_game_rooms,
+	stream_replay,
 )
 
 # here for API endpoints, pages are routed through templates
@@ -57,6 +58,7 @@ urlpatterns = [
 	path("game/create/", create_game_room, name="create_game_room"),
 	path("game/get/", get_config_game_room, name="get_config_game_room"),
 	path("game/list/", list_game_rooms, name="list_game_rooms"),
+	path("game/replay/<int:result_id>/", stream_replay, name="stream_replay"),
 
 	path('tournament/create/', create_tournament, name="create_tournament"),
 ]
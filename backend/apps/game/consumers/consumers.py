@@ -1,10 +1,15 @@
 import json
-import asyncio
 import logging
+import time
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.core.exceptions import ValidationError
 from channels.db import database_sync_to_async
 from apps.game.models.game import GameRoom
+from apps.game.engine.worker import worker, RemoteRoom
+from apps.game.engine.protocol import negotiate_format, decode_input
+from apps.game.engine.outbound import OutboundQueue
+from apps.game.engine.latency import LatencyProbe
+from apps.game.engine import metrics
 from django.contrib.auth.models import User
 from django.conf import settings
 import jwt
@@ -12,7 +17,19 @@ import jwt
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# WebSocket close codes, the frontend reconnects on both
+SERVICE_RESTART = 1012
+TRY_AGAIN_LATER = 1013
+
 class BaseConsumer(AsyncWebsocketConsumer):
+	"""
+	Shared by the authenticated sockets: resolves the user from the auth
+	cookie, registers the socket with the game worker and measures its
+	latency. Accepted sockets are pinged by a LatencyProbe, whose pongs are
+	consumed here and never reach receive(); self.latency holds the
+	smoothed rtt and clock offset.
+	"""
+
 	@database_sync_to_async
 	def get_user(self):
 		 # Get headers from scope
@@ -44,34 +61,116 @@ class BaseConsumer(AsyncWebsocketConsumer):
 
 	async def connect(self):
 		self.user = await self.get_user()
+		# The first socket of the process starts its game worker, which restores checkpointed rooms
+		await worker.ensure_started()
+		worker.sockets.add(self.channel_name)
+
+	async def accept(self, subprotocol=None):
+		await super().accept(subprotocol)
+		self.latency = LatencyProbe(self.send)
+		self.latency.start()
+
+	async def websocket_receive(self, message):
+		text = message.get('text')
+		# Cheap check first, only pongs are parsed twice
+		if text and '"pong"' in text and hasattr(self, 'latency'):
+			try:
+				data = json.loads(text)
+			except ValueError:
+				data = None
+			if isinstance(data, dict) and data.get('type') == 'pong':
+				self.latency.handle_pong(data)
+				if self.latency.rtt is not None:
+					await self.latency_measured(self.latency.rtt)
+				return
+		await super().websocket_receive(message)
+
+	async def latency_measured(self, rtt):
+		"""Called with the smoothed rtt in ms after each pong"""
+		pass
+
+	async def websocket_disconnect(self, message):
+		worker.sockets.discard(self.channel_name)
+		if hasattr(self, 'latency'):
+			await self.latency.close()
+		await super().websocket_disconnect(message)
+
+	def room_owner(self):
+		"""Command channel of the worker running this socket's room, None without a room"""
+		room = getattr(self, 'room', None)
+		if isinstance(room, RemoteRoom):
+			return room.owner
+		return worker.channel_name if room else None
+
+	async def refuse_draining(self):
+		"""Turn away a socket while this worker drains, the client retries and lands on another one"""
+		logger.info(f"Worker draining, refusing {self.scope['path']}")
+		# Accepted first, a close code cannot be sent during the handshake
+		await self.accept()
+		await self.close(code=TRY_AGAIN_LATER)
+
+	async def server_restart(self, event):
+		"""
+		Sent by a draining worker before it exits, to its sockets and to
+		those of the rooms it handed off, and to the sockets of a room
+		restored by its new owner, except those already talking to it.
+		"""
+		if getattr(self, 'restarting', False):
+			return
+		if event.get('owner') and event['owner'] == self.room_owner():
+			return
+		self.restarting = True
+		await self.close(code=SERVICE_RESTART)
 
 class GameConsumer(BaseConsumer):
-	active_games = {}
+	"""
+	A player's socket to their game room. With ?spectate in the URL, a
+	spectator's instead: no seat in the room and no inputs, just the frames
+	the room sends to its spectate group at a reduced rate.
+	"""
 
 	async def connect(self):
 		await super().connect()
 		self.room_name = self.scope['url_route']['kwargs']['room_name']
 		self.room_group_name = f'room_{self.room_name}'
+		self.spectator = 'spectate' in parse_qs(self.scope.get('query_string', b'').decode(), keep_blank_values=True)
+
+		# Everything sent by group handlers goes through here, so a slow client never holds up the room
+		self.outbound = OutboundQueue(self.send)
 
 		if not self.user:
 			logger.warning(f"Unauthorized connection attempt to room {self.room_name} - closing connection")
 			await self.close()
 			return
 
+		if worker.draining:
+			await self.refuse_draining()
+			return
+
+		if self.spectator:
+			await self.connect_spectator()
+			return
+
 		await self.channel_layer.group_add(
 			self.room_group_name,
 			self.channel_name
 		)
 
-		await self.accept()
-		logger.info(f"User {self.user.username} (ID: {self.user.id}) connected to room {self.room_name}")
+		# State frames come through a separate group per wire format
+		subprotocol, self.frame_format = negotiate_format(self.scope.get('subprotocols'))
+		self.frame_group_name = f'{self.room_group_name}.{self.frame_format}'
+		await self.channel_layer.group_add(
+			self.frame_group_name,
+			self.channel_name
+		)
+
+		await self.accept(subprotocol=subprotocol)
+		self.outbound.start()
+		logger.info(f"User {self.user.username} (ID: {self.user.id}) connected to room {self.room_name} ({self.frame_format} frames)")
 
 		self.player_id = str(self.user.id)
 		self.player_position = None
-
-		self.running = False
-		self.game_state = None
-		self.game_loop = None
+		self.room = None
 
 		try:
 			# Join the game room when connecting
@@ -84,38 +183,21 @@ class GameConsumer(BaseConsumer):
 
 			self.game_room = join_result['room']
 			player_data = join_result['player']
-			self.tournament = join_result['tournament']
 
-			# Initialize game state or get existing one
-			if self.room_name in GameConsumer.active_games:
-				self.game_state = GameConsumer.active_games[self.room_name]
-				logger.info(f"Using existing game state for room {self.room_name}")
-			else:
-				self.game_state = self.create_initial_game_state()
-				GameConsumer.active_games[self.room_name] = self.game_state
-				logger.info(f"Created new game state for room {self.room_name}")
-
-			 # Add player to game state
-			self.add_player(player_data)
-			logger.info(f"Player {player_data['username']} (ID: {self.player_id}) added to game state")
+			# Every consumer of the room talks to the same actor, on the worker owning the room
+			self.room = await worker.open_room(self.room_config())
 
 			 # Store the player's position for easy access
 			self.player_position = player_data['side']
 
-			# Start game loop if game is in progress
-			if self.game_room.status == 'in_progress' and not self.running:
-				self.running = True
-				self.game_loop = asyncio.create_task(self.run_game_loop())
-
 			# Tell client which paddle they control
-			await self.send(text_data=json.dumps({
+			self.outbound.put_event(text_data=json.dumps({
 				'type': 'which_paddle',
 				'position': player_data['side']
 			}))
 
-			# Send initial game state
-			logger.info("Sending initial game state")
-			await self.broadcast_game_state()
+			# Add player to game state, which also sends the initial state
+			await self.room.join(player_data, self.frame_format, self.game_room.status == 'in_progress')
 
 		except Exception as e:
 			import traceback
@@ -127,14 +209,59 @@ class GameConsumer(BaseConsumer):
 			}))
 			await self.close()
 
+	async def latency_measured(self, rtt):
+		# Hits of this player's paddle are checked against the ball they saw
+		if getattr(self, 'room', None) and self.player_position:
+			await self.room.set_latency(self.player_position, rtt)
+
+	async def connect_spectator(self):
+		self.player_position = None
+		self.room = None
+
+		self.game_room = await database_sync_to_async(GameRoom.objects.filter(name=self.room_name).first)()
+		if not self.game_room:
+			logger.warning(f"User {self.user.username} (ID: {self.user.id}) cannot spectate missing room {self.room_name}")
+			await self.close()
+			return
+
+		# Spectators only get the spectate group, events included, never the players' groups
+		subprotocol, self.frame_format = negotiate_format(self.scope.get('subprotocols'))
+		self.spectate_group_name = f'{self.room_group_name}.spectate'
+		await self.channel_layer.group_add(
+			self.spectate_group_name,
+			self.channel_name
+		)
+
+		await self.accept(subprotocol=subprotocol)
+		self.outbound.start()
+		logger.info(f"User {self.user.username} (ID: {self.user.id}) spectating room {self.room_name} ({self.frame_format} frames)")
+
+		self.outbound.put_event(text_data=json.dumps({
+			'type': 'spectating',
+			'room': self.room_name,
+		}))
+		self.room = await worker.open_room(self.room_config())
+		await self.room.spectate(self.frame_format, self.channel_name)
+
+	def room_config(self):
+		return {
+			'room_name': self.room_name,
+			'group_name': self.room_group_name,
+			'map_name': self.game_room.map,
+			'player_count': self.game_room.player_count,
+			'snapshot_rate': self.game_room.snapshot_rate,
+		}
+
 	async def disconnect(self, close_code):
-		if hasattr(self, 'game_room') and hasattr(self, 'user'):
+		# Once the room is handed off, players are expected back on its next owner
+		restarting = worker.stopping or getattr(self, 'restarting', False)
+		if getattr(self, 'room', None) and hasattr(self, 'game_room') and not restarting:
 			try:
-				if self.running:
-					await self.end_game()
+				if self.spectator:
+					await self.room.unspectate(self.frame_format)
 				else:
-					await self.leave()
-
+					# Ends a running game, or leaves the lobby
+					await self.room.leave(self.player_id, self.frame_format)
 			except Exception as e:
 				logger.error(f"Error handling disconnect: {str(e)}")
 
@@ -143,118 +270,23 @@ class GameConsumer(BaseConsumer):
 			logger.info(f"User {self.user.username} (ID: {self.user.id}) disconnected from room {self.room_name}. Code: {close_code}")
 		else:
 			logger.info(f"Anonymous user disconnected from room {self.room_name}. Code: {close_code}")
-		await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
-
-	async def end_game(self):
-		"""Handle ending a game when a player disconnects during gameplay"""
-		logger.info(f"Game in progress during disconnect, recording final scores")
-
-		# Convert position-based scores to player ID-based scores for the database
-		player_id_scores = {}
-		for player in self.game_state['players']:
-			position = player['position']
-			if position in self.game_state['score']:
-				player_id_scores[str(player['id'])] = self.game_state['score'][position]
-
-		result = await self.get_game_result(player_id_scores)
-
-		# Get winner from game result
-		winner = None
-		for player_result in result['players']:
-			if player_result['is_winner']:
-				winner = player_result
-
-		# Send game_over notification
-		await self.channel_layer.group_send(
-			self.room_group_name, {
-			'type': 'game_over',
-			'result': result,
-			'winner': winner,
-			'tournament': await self.get_tournament_info(),
-		})
-		
-		# Cancel game loop
-		self.running = False
-		if hasattr(self, 'game_loop') and self.game_loop:
-			self.game_loop.cancel()
-
-		del GameConsumer.active_games[self.room_name]
-
-	# End the game in the database - this returns the game result
-	@database_sync_to_async
-	def get_game_result(self, player_id_scores):
-		"""End the game in the database and return the game result"""
-		result = None
-
-		if hasattr(self, 'game_room'):
-			result = self.game_room.end(player_id_scores)
-
-		if not result:
-			raise ValidationError("Game result not found")
-		
-		result = result.get_results()
-
-		if not result:
-			raise ValidationError("Game result not found")
-
-		return result
-
-	@database_sync_to_async
-	def get_tournament_info(self):
-		"""Get tournament information if this game is part of a tournament"""
-		try:
-			if self.tournament:
-				logger.info(f"Tournament match found: {self.tournament}")
-				return {
-					'id': self.tournament.id,
-					'name': self.tournament.name,
-				}
-		except Exception as e:
-			logger.error(f"Error getting tournament info: {str(e)}")
-			return None
-
-	async def leave(self):
-		"""Handle a player leaving the game"""
-		await database_sync_to_async(self.game_room.leave)(self.user)
-
-		player = next((p for p in self.game_state['players']
-					if str(p['id']) == self.player_id), None)
-
-		if player:
-			# Clean up references to this player
-			if self.player_position in self.game_state['settings']['paddleLoc']:
-				del self.game_state['settings']['paddleLoc'][self.player_position]
-			if self.player_position in self.game_state['settings']['paddleSize']:
-				del self.game_state['settings']['paddleSize'][self.player_position]
-
-			# Remove player from players list
-			self.game_state['players'].remove(player)
-
-			# Remove player score
-			if self.player_position in self.game_state['score']:
-				del self.game_state['score'][self.player_position]
-
-			# Check if we need to update the host
-			was_host = player.get('is_host', False)
-			if was_host and self.game_state['players']:
-				await self.reassign_host()
-
-			await self.broadcast_game_state()
-
-		await self.close()
+		if hasattr(self, 'spectate_group_name'):
+			await self.channel_layer.group_discard(self.spectate_group_name, self.channel_name)
+		else:
+			await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+		if hasattr(self, 'frame_group_name'):
+			await self.channel_layer.group_discard(self.frame_group_name, self.channel_name)
 
-	async def reassign_host(self):
-		"""Reassign host role after the host leaves"""
-		 # Only proceed if we have players
-		if self.game_state['players']:
-			# Set all players' is_host to False
-			for player in self.game_state['players']:
-				player['is_host'] = False
+		if hasattr(self, 'outbound'):
+			await self.outbound.close()
+			if self.outbound.dropped:
+				logger.info(f"Dropped {self.outbound.dropped} stale frames for {self.channel_name} in room {self.room_name}")
 
-			# Make the first player in the list the new host
-			self.game_state['players'][0]['is_host'] = True
-			new_host_id = self.game_state['players'][0]['id']
-			logger.info(f"Host role reassigned to player {new_host_id}")
+		if hasattr(self, 'latency') and self.latency.rtt is not None:
+			logger.info(
+				f"Latency of {self.channel_name} in room {self.room_name}: rtt {self.latency.rtt:.1f}ms "
+				f"(+/- {self.latency.rtt_var:.1f}), clock offset {self.latency.offset:.1f}ms"
+			)
 
 	@database_sync_to_async
 	def get_player_data(self):
@@ -270,178 +302,61 @@ class GameConsumer(BaseConsumer):
 		except:
 			return None
 
-	def create_initial_game_state(self):
-		return {
-			'score': {},
-			'players': [],
-			'settings': {
-				'paddleSize': {},
-				'paddleLoc': {},
-			},
-			'pongLogic': {
-				'ballPos': {'x': 0, 'y': 0},
-				'ballSpeed': {'x': 0.2, 'y': 0.1},
-				'ballSize': {'x': 1, 'y': 1},
-				'lastWinner': None,
-				'lastLoser': None,
-			}
-		}
-
-	def add_player(self, player_data):
-		logger.info(f"Adding player {player_data['username']} (ID: {player_data['id']}) to game state")
-		player_id = str(player_data['id'])
-		player_position = player_data['side']
-
-		# Only add if not already present
-		if any(str(p['id']) == player_id for p in self.game_state['players']):
+	async def receive(self, text_data=None, bytes_data=None):
+		# Spectators have nothing to say to the room
+		if self.spectator:
 			return
 
-		self.game_state['players'].append({
-			'id': player_data['id'],
-			'username': player_data['username'],
-			'position': player_position,
-			'is_host': len(self.game_state['players']) == 0,
-			'is_ready': True
-		})
-
-		self.game_state['score'][player_position] = 0
-		self.game_state['settings']['paddleLoc'][player_position] = {'position': 0, 'rotation': 0}
-		if player_position in ['left', 'right']:
-			self.game_state['settings']['paddleSize'][player_position] = {'x': 1, 'y': 8}
+		if bytes_data is not None:
+			# Binary protocol only carries hot path inputs
+			data = decode_input(bytes_data)
+			if data is None:
+				logger.warning(f"Malformed binary message from {self.user.username} in room {self.room_name}")
+				return
 		else:
-			self.game_state['settings']['paddleSize'][player_position] = {'x': 8, 'y': 1}
-
-	async def receive(self, text_data):
-		data = json.loads(text_data)
+			data = json.loads(text_data)
 		message_type = data.get('type')
 
-		if message_type == 'paddle_move':
-			await self.handle_paddle_move(data)
-		elif message_type == 'set_ball_velocity':
-			await self.handle_ball_velocity(data)
-		elif message_type == 'update_score':
-			await self.handle_update_score(data)
-		elif message_type == 'reset_round':
-			await self.handle_reset_round(data)
-		elif message_type == 'start_game':
-			await self.handle_start_game()
+		if message_type == 'start_game':
+			logger.info(f"Start game request from {self.user.username} (ID: {self.user.id})")
+			if self.room:
+				await self.room.start_game(self.player_id, self.channel_name)
+		elif message_type == 'paddle_move':
+			# Inputs are applied by the room actor on its next tick
+			if self.room:
+				await self.room.submit(self.player_position, data)
+		elif message_type in ('set_ball_velocity', 'update_score', 'reset_round'):
+			# Ball physics and scoring run on the server, older clients may still send these
+			pass
 		else:
 			logger.warning(f"Unknown message type: {message_type}")
 
-	async def handle_reset_round(self, data):
-		self.game_state['pongLogic']['ballPos'] = {'x': 0, 'y': 0}
-		self.game_state['pongLogic']['ballSpeed'] = {'x': 0, 'y': 0}
-		self.game_state['pongLogic']['lastWinner'] = data.get('lastWinner')
-		self.game_state['pongLogic']['lastLoser'] = data.get('lastLoser')
-
-		await self.channel_layer.group_send(self.room_group_name, {'type': 'reset_round'})
-		await self.broadcast_game_state()
-
-	async def handle_update_score(self, data):
-		scoring_position = data.get('scoring_position')
-		logger.info(f"Updating score for position: {scoring_position}, current score: {self.game_state['score']}")
-		# Directly update score by position
-		if scoring_position in self.game_state['score']:
-			self.game_state['score'][scoring_position] += 1
-
-		# Check if the game is over
-		if (self.game_state['score'][scoring_position]):
-			if self.game_state['score'][scoring_position] == 5:
-				await self.end_game()
-		
-
-	async def handle_ball_velocity(self, data):
-		self.game_state['pongLogic']['ballSpeed'] = {
-			'x': data['x'],
-			'y': data['y']
-		}
-
-	async def handle_paddle_move(self, data):
-		self.game_state['settings']['paddleLoc'][self.player_position] = {
-			'position': float(data['position']),
-			'rotation': float(data['rotation'])
-		}
-		await self.broadcast_game_state()
-
-	async def handle_start_game(self):
-		player = next((p for p in self.game_state['players'] if str(p['id']) == self.player_id), None)
-
-		logger.info(f"Start game request from {self.user.username} (ID: {self.user.id})")
-
-		# Only host can start game
-		if not player or not player.get('is_host'):
-			return
-
-		try:
-			# Verify all players are ready
-			if not all(player['is_ready'] for player in self.game_state['players']):
-				return
-
-			# Set game status to in_progress
-			self.game_room.status = 'in_progress'
-			await database_sync_to_async(self.game_room.save)()
-
-			# Start game loop
-			self.running = True
-			self.game_loop = asyncio.create_task(self.run_game_loop())
-
-			# Broadcast state update
-			await self.broadcast_game_state()
-
-			# Notify all clients the game started
-			await self.channel_layer.group_send(self.room_group_name, {'type': 'started_game'})
-
-		except Exception as e:
-			import traceback
-			await self.send(text_data=json.dumps({
-				'type': 'error',
-				'message': str(e),
-				'traceback': traceback.format_exc()
-			}))
-
-	async def broadcast_game_state(self, extra=None):
-		"""Send game state to all clients in the room"""
-		event = {
-			'type': 'game_state_update',
-			'state': self.game_state
-		}
-		if extra:
-			event.update(extra)
-
-		await self.channel_layer.group_send(
-			self.room_group_name,
-			event
-		)
-
-	async def run_game_loop(self):
-		"""Game physics update loop"""
-		try:
-			while self.running:
-				self.game_state['pongLogic']['ballPos']['x'] += (self.game_state['pongLogic']['ballSpeed']['x'])
-				self.game_state['pongLogic']['ballPos']['y'] += (self.game_state['pongLogic']['ballSpeed']['y'])
-				await self.broadcast_game_state()
-				await asyncio.sleep(1/60)  # 60 FPS
-		except asyncio.CancelledError:
-			# Handle cancellation gracefully
-			pass
-		except Exception as e:
-			import traceback
-			print(f"Game loop error: {str(e)}")
-			print(traceback.format_exc())
-			self.running = False
-
-	async def game_state_update(self, event):
-		await self.send(text_data=json.dumps(event))
+	async def game_state_frame(self, event):
+		# Already encoded by the room actor
+		if 'sent' in event:
+			metrics.frame_delivery.observe(time.time() - event['sent'])
+		messages = []
+		if 'text' in event:
+			messages.append({'text_data': event['text']})
+		if 'bytes' in event:
+			messages.append({'bytes_data': event['bytes']})
+		self.outbound.put_frame(messages, keyframe=event.get('keyframe', False))
+
+	async def spectator_frame(self, event):
+		"""A frame of the spectate group, in every format spectators use"""
+		frame = event['frames'].get(self.frame_format)
+		if frame:
+			await self.game_state_frame(frame)
 
 	async def which_paddle(self, event):
-		await self.send(text_data = json.dumps({
+		self.outbound.put_event(text_data = json.dumps({
 			'type': 'which_paddle',
 			'position': event['position']
 		}))
 		
 	async def game_over(self, event):
 		"""Send game over notification to clients"""
-		await self.send(text_data=json.dumps({
+		self.outbound.put_event(text_data=json.dumps({
 			'type': 'game_over',
 			'result': event['result'],
 			'winner': event['winner'],
@@ -449,13 +364,21 @@ class GameConsumer(BaseConsumer):
 		}))
 
 	async def started_game(self, event):
-		await self.send(text_data = json.dumps({
+		self.outbound.put_event(text_data = json.dumps({
 			'type': 'started_game',
 			'side': self.player_position,
 		}))
 
 	async def failed_to_start_game(self, event):
-		await self.send(text_data = json.dumps(event))
+		self.outbound.put_event(text_data = json.dumps(event))
 
 	async def reset_round(self, event):
-		await self.send(text_data = json.dumps(event))
+		self.outbound.put_event(text_data = json.dumps(event))
+
+	async def game_error(self, event):
+		"""Error from a command this client sent to the room actor"""
+		self.outbound.put_event(text_data=json.dumps({
+			'type': 'error',
+			'message': event['message'],
+			'traceback': event['traceback']
+		}))
@@ -0,0 +1,109 @@
+import json
+import logging
+import asyncio
+from channels.db import database_sync_to_async
+from apps.game.consumers.consumers import BaseConsumer
+from apps.game.models.game import GameResult
+from apps.game.engine.replay import ReplayFile, MAX_SPEED
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+
+class ReplayConsumer(BaseConsumer):
+	"""
+	Streams the replay of a finished game, see ReplayFile.
+
+	The client first gets a replay_info message with the replay header, its
+	tick range and keyframe ticks. Binary messages then carry the replay
+	records as they are in the file, chunk by chunk, at the chosen speed.
+	The first chunk after a seek starts with a keyframe. Clients control
+	playback with {'type': 'seek', 'tick'}, {'type': 'speed', 'speed'},
+	{'type': 'pause'} and {'type': 'play'}, and get replay_end at the end.
+	"""
+
+	async def connect(self):
+		await super().connect()
+		self.task = None
+
+		if not self.user:
+			await self.close()
+			return
+
+		result_id = self.scope['url_route']['kwargs']['result_id']
+		try:
+			self.replay = await self.open_replay(result_id)
+		except (GameResult.DoesNotExist, OSError, ValueError) as e:
+			logger.warning(f"No replay for game {result_id}: {str(e)}")
+			await self.close()
+			return
+
+		await self.accept()
+		# Next chunk to send
+		self.position = 0
+		self.speed = 1.0
+		self.playing = True
+
+		await self.send(text_data=json.dumps({'type': 'replay_info', **self.replay.info()}))
+		self.play()
+
+	async def disconnect(self, close_code):
+		await self.stop()
+
+	@database_sync_to_async
+	def open_replay(self, result_id):
+		result = GameResult.objects.get(id=result_id)
+		if not result.replay:
+			raise FileNotFoundError("Game was not recorded")
+		return ReplayFile.open(result.replay.path)
+
+	def play(self):
+		self.task = asyncio.create_task(self.run(self.position, self.speed))
+
+	async def stop(self):
+		if self.task:
+			self.task.cancel()
+			try:
+				await self.task
+			except asyncio.CancelledError:
+				pass
+			self.task = None
+
+	async def run(self, position, speed):
+		async for index, chunk in self.replay.stream(position, speed):
+			await self.send(bytes_data=chunk)
+			self.position = index + 1
+		self.playing = False
+		await self.send(text_data=json.dumps({'type': 'replay_end'}))
+
+	async def receive(self, text_data=None, bytes_data=None):
+		try:
+			data = json.loads(text_data)
+			message_type = data.get('type')
+
+			if message_type == 'seek':
+				await self.stop()
+				self.position = self.replay.seek(int(data['tick']))
+				self.playing = True
+			elif message_type == 'speed':
+				speed = float(data['speed'])
+				if not 0 < speed <= MAX_SPEED:
+					raise ValueError(speed)
+				await self.stop()
+				self.speed = speed
+			elif message_type == 'pause':
+				await self.stop()
+				self.playing = False
+				return
+			elif message_type == 'play':
+				await self.stop()
+				self.playing = True
+			else:
+				logger.warning(f"Unknown message type: {message_type}")
+				return
+		except (TypeError, KeyError, ValueError, AttributeError):
+			logger.warning(f"Invalid replay message from {self.user.username}: {text_data}")
+			return
+
+		if self.playing:
+			self.play()
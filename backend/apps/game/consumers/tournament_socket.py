@@ -3,6 +3,7 @@ import logging
 from channels.db import database_sync_to_async
 from apps.game.models.tournament import Tournament
 from apps.game.consumers.consumers import BaseConsumer
+from apps.game.engine.worker import worker
 import traceback
 
 # Set up logger
@@ -11,8 +12,6 @@ logger = logging.getLogger(__name__)
 class TournamentConsumer(BaseConsumer):
 	"""WebSocket consumer for tournaments"""
 
-	active_tournaments = {}
-
 	async def connect(self):
 		await super().connect()
 
@@ -26,6 +25,10 @@ class TournamentConsumer(BaseConsumer):
 			await self.close()
 			return
 
+		if worker.draining:
+			await self.refuse_draining()
+			return
+
 		# Join or reconnect to the tournament
 		tournament_data = await self.join_tournament()
 
@@ -87,8 +90,8 @@ class TournamentConsumer(BaseConsumer):
 			logger.warning(f"User {self.user.username} disconnected from tournament {self.tournament_name} but tournament does not exist")
 			return
 
-		# If tournament hasn't started yet, leave the tournament
-		if tournament.status == 'waiting':
+		# If tournament hasn't started yet, leave the tournament, unless the worker is shutting down under the player
+		if tournament.status == 'waiting' and not worker.stopping:
 			logger.info(f"User {self.user.username} leaving tournament {self.tournament_name} on disconnect")
 			if self.connected:
 				await self.leave_tournament()
@@ -0,0 +1,672 @@
+import asyncio
+import logging
+import math
+import time
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from apps.game.models.game import GameRoom
+from apps.game.engine.scheduler import scheduler
+from apps.game.engine.protocol import FrameEncoder
+from apps.game.engine.physics import SIDES, NO_SIDE
+from apps.game.engine.state import GameState
+from apps.game.engine.replay import ReplayRecorder, replay_name
+from apps.game.engine import metrics
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+
+class RoomActor:
+	"""
+	Owns the live state of a single game room.
+
+	Consumers never touch the state directly: they send commands (join,
+	leave, submit, start_game, spectate, set_latency) to the actor and forward the frames it
+	broadcasts. There is exactly one actor per room, on the worker that owns
+	the room, and that worker's shared scheduler ticks it alongside every
+	other live room. Sockets on other workers reach it through RemoteRoom. Ball physics and
+	scoring run on the server, in the scheduler's PhysicsWorld.
+
+	The room is simulated every tick but its state is only sent
+	snapshot_rate times per second, see Room.SNAPSHOT_RATES. While the ball
+	waits for its serve nothing moves but the paddles, so snapshots only go
+	out after an input, and otherwise KEEPALIVE_RATE times per second.
+
+	Spectators get frames from a separate tier: their own encoder and group,
+	at SPECTATOR_RATE, sent in the background. A spectator frame is skipped
+	while the previous one is still being fanned out, so any number of
+	watchers never holds up the tick or the players' frames.
+
+	Running rooms are recorded into a replay file, see replay.py, which is
+	linked from their GameResult.
+
+	A running room can be saved with checkpoint() and rebuilt with
+	restore() after a restart. The restored room stays paused until all its
+	players have reconnected, or ends with its saved score once
+	RECOVERY_TIMEOUT passes without them.
+	"""
+
+	# Live actors by room name
+	active_rooms = {}
+
+	WINNING_SCORE = 5
+
+	# Seconds a restored room waits for its players to come back
+	RECOVERY_TIMEOUT = 60
+
+	# Snapshots per second of a room where nothing moves
+	KEEPALIVE_RATE = 1
+
+	# Snapshots per second sent to spectators
+	SPECTATOR_RATE = 10
+
+	# How far behind the server clients draw the ball, INTERPOLATION_DELAY in websocket.js, in ms
+	INTERPOLATION_DELAY = 100
+
+	# Paddle rotations are angles in radians, websocket.js only ever sends 0
+	MAX_ROTATION = math.pi
+
+	def __init__(self, room_name, group_name, map_name='classic', player_count=2, snapshot_rate=None):
+		self.room_name = room_name
+		self.group_name = group_name
+		self.map_name = map_name
+		self.player_count = player_count
+		self.snapshot_rate = snapshot_rate or scheduler.tick_rate
+		self.channel_layer = get_channel_layer()
+
+		self.state = GameState()
+		# Latest paddle position per side index, applied once per tick
+		self.paddle_inputs = {}
+		# Whether an input was applied since the last broadcast, and the tick of that broadcast
+		self.changed = False
+		self.last_broadcast = 0
+		# Measured round trip time in ms per side index, for lag compensation
+		self.latency = {}
+		self.tick = 0
+
+		# Slot of the room in the scheduler's physics world while it is running
+		self.slot = None
+		# Reliable events to send before the next frame
+		self.pending_events = []
+
+		# Connected clients per frame format, see protocol.SUBPROTOCOLS
+		self.subscribers = {}
+		self.encoder = FrameEncoder()
+		# Frames sent to the room's groups and seconds spent broadcasting, for metrics
+		self.frames_sent = 0
+		self.broadcast_time = 0.0
+
+		# Spectators per frame format, with events waiting for their next frame
+		self.spectators = {}
+		self.spectator_encoder = FrameEncoder()
+		self.spectator_events = []
+		self.spectate_task = None
+		self.spectated_tick = None
+
+		self.started = False
+		self.finished = False
+		self.finish_task = None
+
+		# Set on restored rooms: ids of the players not back yet, and the ball to resume with
+		self.awaiting = None
+		self.saved_ball = None
+		self.abandon_task = None
+
+		# Name of the replay file under MEDIA_ROOT once the game started, and its recorder on this worker
+		self.replay = None
+		self.recorder = None
+
+	@classmethod
+	def for_room(cls, room_name, group_name, map_name='classic', player_count=2, snapshot_rate=None):
+		"""Get the actor of a room, creating it on first use"""
+		actor = cls.active_rooms.get(room_name)
+		if actor is None:
+			actor = cls(room_name, group_name, map_name, player_count, snapshot_rate)
+			cls.active_rooms[room_name] = actor
+			logger.info(f"Created new game state for room {room_name}")
+		else:
+			logger.info(f"Using existing game state for room {room_name}")
+		return actor
+
+	def discard(self):
+		"""Forget this actor so the next join starts a fresh room"""
+		if RoomActor.active_rooms.get(self.room_name) is self:
+			del RoomActor.active_rooms[self.room_name]
+
+	@property
+	def running(self):
+		return self.started and not self.finished
+
+	@property
+	def snapshot_interval(self):
+		"""Ticks between two snapshots"""
+		return max(1, round(scheduler.tick_rate / self.snapshot_rate))
+
+	@property
+	def keepalive_interval(self):
+		"""Ticks between two snapshots of an idle room"""
+		return max(self.snapshot_interval, round(scheduler.tick_rate / self.KEEPALIVE_RATE))
+
+	def frame_group(self, frame_format):
+		return f'{self.group_name}.{frame_format}'
+
+	@property
+	def spectate_group(self):
+		return f'{self.group_name}.spectate'
+
+	@property
+	def spectator_interval(self):
+		"""Ticks between two spectator snapshots"""
+		return max(1, round(scheduler.tick_rate / self.SPECTATOR_RATE))
+
+	def subscribe(self, frame_format):
+		"""Register a client for frames in the given format"""
+		self.subscribers[frame_format] = self.subscribers.get(frame_format, 0) + 1
+		self.encoder.request_keyframe()
+
+	def unsubscribe(self, frame_format):
+		count = self.subscribers.get(frame_format, 0) - 1
+		if count > 0:
+			self.subscribers[frame_format] = count
+		else:
+			self.subscribers.pop(frame_format, None)
+
+	# Roster
+
+	def get_player(self, player_id):
+		return self.state.get_player(player_id)
+
+	def add_player(self, player_data):
+		logger.info(f"Adding player {player_data['username']} (ID: {player_data['id']}) to game state")
+
+		# Only add if not already present
+		if self.state.add_player(player_data['id'], player_data['username'], player_data['side']):
+			self.encoder.request_keyframe()
+
+	def remove_player(self, player_id):
+		"""Remove a player from the state, returns False if they were not in it"""
+		player = self.state.remove_player(player_id)
+		if not player:
+			return False
+		self.encoder.request_keyframe()
+
+		# Check if we need to update the host
+		if player.is_host and self.state.players:
+			self.reassign_host()
+
+		if not self.state.players:
+			self.discard()
+
+		return True
+
+	def reassign_host(self):
+		"""Reassign host role after the host leaves"""
+		# Make the first player in the list the new host
+		host = next(iter(self.state.players.values()))
+		self.state.set_host(host)
+		logger.info(f"Host role reassigned to player {host.id}")
+
+	# Commands, from the consumers of this worker or forwarded by other workers
+
+	async def join(self, player_data, frame_format, in_progress):
+		"""Add a connected player and send everyone the new state"""
+		self.add_player(player_data)
+		self.subscribe(frame_format)
+
+		# A new socket numbers its inputs from 1 again
+		paddle = self.state.paddles[self.get_player(player_data['id']).side]
+		if paddle:
+			paddle.seq = 0
+		logger.info(f"Player {player_data['username']} (ID: {player_data['id']}) added to game state")
+
+		if self.awaiting is not None:
+			self.awaiting.discard(str(player_data['id']))
+
+		# Resume the room tick if game is in progress, restored rooms once everyone is back
+		if in_progress and not self.awaiting:
+			self.start()
+
+		await self.broadcast_state()
+
+	async def leave(self, player_id, frame_format):
+		"""A player's socket closed: a running game ends, a lobby loses the player"""
+		try:
+			if self.running or self.awaiting is not None:
+				await self.finish()
+			elif not self.finished:
+				await self.leave_game_room(player_id)
+				if self.remove_player(player_id):
+					await self.broadcast_state()
+		except Exception as e:
+			logger.error(f"Error handling disconnect: {str(e)}")
+
+		self.unsubscribe(frame_format)
+
+	async def start_game(self, player_id, reply_channel):
+		"""Start the game on the host's request, errors go back to reply_channel"""
+		player = self.get_player(player_id)
+
+		# Only host can start game, and only once
+		if not player or not player.is_host or self.running:
+			return
+
+		try:
+			# Verify all players are ready
+			if not all(player.is_ready for player in self.state.players.values()):
+				return
+
+			await self.set_in_progress()
+
+			# Start the room tick
+			self.start()
+
+			# Broadcast state update
+			await self.broadcast_state()
+
+			# Notify all clients the game started
+			await self.channel_layer.group_send(self.group_name, {'type': 'started_game'})
+			if self.spectators:
+				self.spectator_events.append({'type': 'started_game'})
+
+		except Exception as e:
+			import traceback
+			await self.channel_layer.send(reply_channel, {
+				'type': 'game_error',
+				'message': str(e),
+				'traceback': traceback.format_exc()
+			})
+
+	async def submit(self, side, data):
+		"""
+		Store a paddle_move, it is applied on the next tick and nothing is
+		broadcast until then. Its sequence number, if any, is acknowledged in
+		the following snapshots.
+		"""
+		# Only the latest position matters, older moves are overwritten
+		try:
+			self.paddle_inputs[SIDES.index(side)] = self.read_paddle_move(data)
+		except (KeyError, TypeError, ValueError):
+			logger.warning(f"Invalid paddle_move in room {self.room_name}: {data}")
+
+	def read_paddle_move(self, data):
+		"""
+		Position, rotation and sequence number of a paddle_move, ValueError
+		if any of them is invalid: a move is dropped whole, so its sequence
+		number is never acknowledged for a value the room cannot simulate,
+		record or encode.
+		"""
+		seq = data.get('seq') or 0
+		if isinstance(seq, bool) or not isinstance(seq, int) or not 0 <= seq < 2 ** 32:
+			raise ValueError(seq)
+
+		position, rotation = float(data['position']), float(data['rotation'])
+		# NaN or infinity would poison the physics, the replay and every frame of the room
+		if not (math.isfinite(position) and math.isfinite(rotation)):
+			raise ValueError(data)
+		rotation = min(max(rotation, -self.MAX_ROTATION), self.MAX_ROTATION)
+		return position, rotation, seq
+
+	async def spectate(self, frame_format, reply_channel):
+		"""Add a spectator and send them, alone, what they need to follow the spectator frames"""
+		self.spectators[frame_format] = self.spectators.get(frame_format, 0) + 1
+
+		server_time = scheduler.tick_time if self.running else time.time() * 1000
+		frame = self.spectator_encoder.catch_up(self.state, self.tick, server_time, frame_format)
+		if frame:
+			await self.channel_layer.send(reply_channel, {
+				'type': 'spectator_frame',
+				'frames': {frame_format: frame},
+			})
+
+	async def unspectate(self, frame_format):
+		count = self.spectators.get(frame_format, 0) - 1
+		if count > 0:
+			self.spectators[frame_format] = count
+		else:
+			self.spectators.pop(frame_format, None)
+
+		# A room opened by spectators alone is not kept around
+		if not self.spectators and not self.state.players and not self.started:
+			self.discard()
+
+	async def set_latency(self, side, rtt):
+		"""
+		Lag compensate a side's paddle hits by the player's round trip time
+		in ms: the ball they hit was drawn INTERPOLATION_DELAY plus half the
+		round trip in the past, and their input takes the other half to arrive.
+		"""
+		try:
+			self.latency[SIDES.index(side)] = max(float(rtt), 0.0)
+		except (TypeError, ValueError):
+			logger.warning(f"Invalid latency in room {self.room_name}: {rtt}")
+			return
+		self.apply_latency()
+
+	def apply_latency(self):
+		if self.slot is None:
+			return
+		for side, rtt in self.latency.items():
+			steps = round((rtt + self.INTERPOLATION_DELAY) / 1000 * scheduler.tick_rate)
+			scheduler.world.set_rewind(self.slot, side, steps)
+
+	# Inputs
+
+	def process_inputs(self):
+		"""Apply the inputs received since the last tick"""
+		if self.paddle_inputs:
+			paddle_inputs, self.paddle_inputs = self.paddle_inputs, {}
+			for side, (position, rotation, seq) in paddle_inputs.items():
+				self.handle_paddle_move(side, position, rotation, seq)
+
+	def handle_paddle_move(self, side, position, rotation, seq=0):
+		paddle = self.state.paddles[side]
+		if not paddle:
+			return
+
+		if self.slot is not None:
+			scheduler.world.set_paddle(self.slot, side, position)
+			position = float(scheduler.world.paddle_pos[self.slot, side])
+
+		paddle.position = position
+		paddle.rotation = rotation
+		if seq:
+			paddle.seq = seq
+		self.changed = True
+
+	def score_point(self, winner, loser):
+		"""Apply a point scored in the physics world"""
+		self.state.last_winner = winner
+		self.state.last_loser = loser
+		self.pending_events.append({'type': 'reset_round'})
+
+		paddle = self.state.paddles[winner] if winner != NO_SIDE else None
+		if not paddle:
+			return
+
+		paddle.score += 1
+		if self.recorder:
+			self.recorder.point(self.tick, winner, loser)
+		logger.info(f"Point for {SIDES[winner]} in room {self.room_name}, score: {self.state.scores()}")
+
+		# Check if the game is over, the final score still goes out with this tick
+		if paddle.score >= self.WINNING_SCORE and not self.finish_task:
+			self.finish_task = asyncio.create_task(self.finish())
+
+	# Game loop
+
+	def start(self):
+		"""Start the room tick, calling it again is a no-op"""
+		if self.started:
+			return
+		self.started = True
+
+		# Drop anything sent from the lobby
+		self.paddle_inputs = {}
+		self.awaiting = None
+
+		scheduler.add(self)
+		for side, paddle in enumerate(self.state.paddles):
+			if paddle:
+				scheduler.world.set_paddle(self.slot, side, paddle.position)
+		if self.saved_ball:
+			scheduler.world.load_ball(self.slot, self.saved_ball)
+			self.saved_ball = None
+		self.apply_latency()
+
+		# Restored rooms carry on with the replay they were recording
+		self.replay = self.replay or replay_name(self.room_name, time.time())
+		self.recorder = ReplayRecorder(self.replay, {
+			'room': self.room_name,
+			'map': self.map_name,
+			'player_count': self.player_count,
+			'tick_rate': scheduler.tick_rate,
+			'players': [player.to_dict() for player in self.state.players.values()],
+			'started': time.time(),
+		}, scheduler.tick_rate)
+		self.recorder.start()
+		logger.info(f"Game loop started for room {self.room_name}")
+
+	def step(self, scored=()):
+		"""Read back this room's ball after the world stepped, called by the scheduler"""
+		self.tick += 1
+		if self.finish_task:
+			return
+
+		world = scheduler.world
+		ball_x, ball_y = world.ball_pos[self.slot].tolist()
+		speed_x, speed_y = world.ball_vel[self.slot].tolist()
+		self.state.set_ball(ball_x, ball_y, speed_x, speed_y)
+
+		for winner, loser in scored:
+			self.score_point(winner, loser)
+
+		self.recorder.record(self.state, self.tick)
+
+	def snapshot_due(self):
+		"""Whether the scheduler should broadcast after this tick"""
+		# Points go out right away instead of waiting for the next snapshot
+		if self.pending_events:
+			return True
+		if self.tick % self.snapshot_interval:
+			return False
+
+		# A waiting ball only needs frames for inputs, and a keepalive now and then
+		moving = self.state.speed_x or self.state.speed_y
+		return moving or self.changed or self.tick - self.last_broadcast >= self.keepalive_interval
+
+	async def broadcast_state(self):
+		"""Send game state to all clients in the room"""
+		started = time.perf_counter()
+		self.changed = False
+		self.last_broadcast = self.tick
+		if self.pending_events:
+			events, self.pending_events = self.pending_events, []
+			for event in events:
+				await self.channel_layer.group_send(self.group_name, event)
+			if self.spectators:
+				self.spectator_events.extend(events)
+
+		if self.spectators and (
+			not self.running or self.spectated_tick is None
+			or self.tick - self.spectated_tick >= self.spectator_interval
+		):
+			self.send_spectators()
+
+		server_time = scheduler.tick_time if self.running else time.time() * 1000
+
+		# Encoded here once per frame and format, consumers forward the text untouched
+		frames = self.encoder.encode(self.state, self.tick, server_time, self.subscribers)
+		# Stamped with the wall clock, consumers measure how long the channel layer took to deliver it
+		sent = time.time()
+		await asyncio.gather(*(
+			self.channel_layer.group_send(self.frame_group(frame_format), {
+				'type': 'game_state_frame',
+				'sent': sent,
+				**payload
+			}) for frame_format, payload in frames.items()
+		))
+		if frames:
+			metrics.layer_send.observe(time.time() - sent)
+		self.frames_sent += len(frames)
+		self.broadcast_time += time.perf_counter() - started
+
+	def send_spectators(self):
+		"""Fan out the current state to the spectate group in the background"""
+		if self.spectate_task and not self.spectate_task.done():
+			return
+		self.spectated_tick = self.tick
+		events, self.spectator_events = self.spectator_events, []
+
+		server_time = scheduler.tick_time if self.running else time.time() * 1000
+		# Every format in one message, each spectator picks its own
+		frames = self.spectator_encoder.encode(self.state, self.tick, server_time, self.spectators)
+		self.spectate_task = asyncio.create_task(self.fan_out(events, frames))
+
+	async def fan_out(self, events, frames):
+		try:
+			for event in events:
+				await self.channel_layer.group_send(self.spectate_group, event)
+			if frames:
+				await self.channel_layer.group_send(self.spectate_group, {
+					'type': 'spectator_frame',
+					'frames': frames,
+				})
+		except Exception as e:
+			logger.error(f"Spectator broadcast failed for room {self.room_name}: {str(e)}")
+
+	# Checkpoints
+
+	def checkpoint(self):
+		"""Compact copy of a running room, enough to rebuild it with restore()"""
+		state = self.state.to_dict()
+		return {
+			'room': {
+				'room_name': self.room_name,
+				'group_name': self.group_name,
+				'map_name': self.map_name,
+				'player_count': self.player_count,
+				'snapshot_rate': self.snapshot_rate,
+			},
+			'tick': self.tick,
+			'replay': self.replay,
+			'players': state['players'],
+			'score': state['score'],
+			'settings': state['settings'],
+			# Restored rooms waiting for their players still hold the ball they were saved with
+			'ball': scheduler.world.save_ball(self.slot) if self.slot is not None else self.saved_ball,
+		}
+
+	@classmethod
+	def restore(cls, checkpoint):
+		"""Rebuild a room from its checkpoint, paused until its players reconnect"""
+		actor = cls(**checkpoint['room'])
+		cls.active_rooms[actor.room_name] = actor
+
+		actor.tick = checkpoint['tick']
+		actor.replay = checkpoint.get('replay')
+		actor.state = GameState.from_dict(checkpoint)
+
+		ball = checkpoint['ball']
+		actor.saved_ball = ball
+		actor.state.set_ball(*ball['pos'], *ball['vel'])
+
+		actor.awaiting = set(actor.state.players)
+		actor.abandon_task = asyncio.create_task(actor.abandon_after(cls.RECOVERY_TIMEOUT))
+		logger.info(f"Restored room {actor.room_name} at tick {actor.tick}, score: {actor.state.scores()}")
+		return actor
+
+	async def hand_off(self):
+		"""Stop the room here without ending it, another worker restores it from its checkpoint"""
+		self.finished = True
+		scheduler.remove(self)
+		if self.abandon_task:
+			self.abandon_task.cancel()
+		self.discard()
+		# Written out before the room is released, the next owner appends to the same file
+		if self.recorder:
+			await self.recorder.close()
+		logger.info(f"Handed off room {self.room_name} at tick {self.tick}")
+
+	async def abandon_after(self, timeout):
+		"""End a restored room whose players did not all come back, with the score it had"""
+		await asyncio.sleep(timeout)
+		if self.awaiting and not self.finished:
+			logger.info(f"Players {self.awaiting} did not come back to room {self.room_name}, ending it")
+			await self.finish()
+
+	# End of game
+
+	async def finish(self):
+		"""Record the final scores and tell every client the game is over"""
+		if self.finished:
+			return
+		self.finished = True
+		self.awaiting = None
+		scheduler.remove(self)
+		logger.info(f"Game in room {self.room_name} over, recording final scores")
+
+		# Convert position-based scores to player ID-based scores for the database
+		player_id_scores = {}
+		for player_id, player in self.state.players.items():
+			paddle = self.state.paddles[player.side]
+			if paddle:
+				player_id_scores[player_id] = paddle.score
+
+		try:
+			if self.recorder:
+				await self.recorder.close()
+			result, tournament = await self.end_game_room(player_id_scores)
+
+			# Get winner from game result
+			winner = None
+			for player_result in result['players']:
+				if player_result['is_winner']:
+					winner = player_result
+
+			game_over = {
+				'type': 'game_over',
+				'result': result,
+				'winner': winner,
+				'tournament': tournament,
+			}
+			await self.channel_layer.group_send(self.group_name, game_over)
+			if self.spectators:
+				await self.channel_layer.group_send(self.spectate_group, game_over)
+		finally:
+			self.discard()
+
+	async def abort(self, error):
+		"""
+		End a room whose tick raised: its players are told why, then it ends
+		like any other game so its result is recorded and it leaves the registry.
+		"""
+		try:
+			await self.channel_layer.group_send(self.group_name, {
+				'type': 'game_error',
+				'message': f"Game stopped by a server error: {error}",
+				'traceback': None,
+			})
+		except Exception as e:
+			logger.error(f"Could not notify room {self.room_name} of its error: {str(e)}")
+
+		try:
+			await self.finish()
+		except Exception as e:
+			logger.error(f"Error ending failed room {self.room_name}: {str(e)}")
+
+	@database_sync_to_async
+	def set_in_progress(self):
+		GameRoom.objects.filter(name=self.room_name).update(status='in_progress')
+
+	@database_sync_to_async
+	def leave_game_room(self, player_id):
+		game_room = GameRoom.objects.get(name=self.room_name)
+		game_room.leave(User.objects.get(id=player_id))
+
+	@database_sync_to_async
+	def end_game_room(self, player_id_scores):
+		"""End the game in the database and return the result and tournament info"""
+		try:
+			game_room = GameRoom.objects.select_related('tournament').get(name=self.room_name)
+		except GameRoom.DoesNotExist:
+			raise ValidationError("Game room not found")
+
+		tournament = None
+		if game_room.tournament:
+			logger.info(f"Tournament match found: {game_room.tournament}")
+			tournament = {
+				'id': game_room.tournament.id,
+				'name': game_room.tournament.name,
+			}
+
+		result = game_room.end(player_id_scores, replay=self.replay)
+		if not result:
+			raise ValidationError("Game result not found")
+
+		result = result.get_results()
+		if not result:
+			raise ValidationError("Game result not found")
+
+		return result, tournament
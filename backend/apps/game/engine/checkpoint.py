@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+from django.conf import settings
+from redis.asyncio import Redis
+
+
+def encode(checkpoint):
+	return json.dumps(checkpoint, separators=(',', ':'))
+
+
+class FileCheckpointStore:
+	"""Checkpoints as one JSON file per room in a directory, for a single worker"""
+
+	def __init__(self, path):
+		self.path = path
+
+	def file(self, room_name):
+		return os.path.join(self.path, f'{room_name}.json')
+
+	def write(self, checkpoints):
+		os.makedirs(self.path, exist_ok=True)
+		for room_name, checkpoint in checkpoints.items():
+			# Written aside then renamed, a crash mid-write keeps the previous checkpoint
+			temporary = self.file(room_name) + '.tmp'
+			with open(temporary, 'w') as f:
+				f.write(encode(checkpoint))
+			os.replace(temporary, self.file(room_name))
+
+	def read(self):
+		checkpoints = {}
+		if not os.path.isdir(self.path):
+			return checkpoints
+		for name in os.listdir(self.path):
+			if name.endswith('.json'):
+				with open(os.path.join(self.path, name)) as f:
+					checkpoints[name[:-len('.json')]] = json.load(f)
+		return checkpoints
+
+	def read_room(self, room_name):
+		try:
+			with open(self.file(room_name)) as f:
+				return json.load(f)
+		except FileNotFoundError:
+			return None
+
+	def remove(self, room_name):
+		try:
+			os.remove(self.file(room_name))
+		except FileNotFoundError:
+			pass
+
+	# File access runs in a thread, off the event loop that ticks the rooms
+
+	async def save(self, checkpoints):
+		await asyncio.to_thread(self.write, checkpoints)
+
+	async def load(self, room_name):
+		return await asyncio.to_thread(self.read_room, room_name)
+
+	async def load_all(self):
+		return await asyncio.to_thread(self.read)
+
+	async def delete(self, room_name):
+		await asyncio.to_thread(self.remove, room_name)
+
+
+class RedisCheckpointStore:
+	"""
+	Checkpoints shared by every worker, as one Redis key per room. Keys
+	expire after TTL seconds without a save, so rooms nobody restored in
+	that time are forgotten.
+	"""
+
+	PREFIX = 'game:room:checkpoint:'
+	TTL = 600
+
+	def __init__(self, url):
+		self.url = url
+		self.redis = None
+
+	def connection(self):
+		# Created on first use, inside the worker's event loop
+		if self.redis is None:
+			self.redis = Redis.from_url(self.url, decode_responses=True)
+		return self.redis
+
+	async def save(self, checkpoints):
+		async with self.connection().pipeline(transaction=False) as pipe:
+			for room_name, checkpoint in checkpoints.items():
+				pipe.set(self.PREFIX + room_name, encode(checkpoint), ex=self.TTL)
+			await pipe.execute()
+
+	async def load(self, room_name):
+		value = await self.connection().get(self.PREFIX + room_name)
+		return json.loads(value) if value is not None else None
+
+	async def load_all(self):
+		keys = [key async for key in self.connection().scan_iter(match=self.PREFIX + '*')]
+		if not keys:
+			return {}
+		values = await self.connection().mget(keys)
+		return {
+			key[len(self.PREFIX):]: json.loads(value)
+			for key, value in zip(keys, values) if value is not None
+		}
+
+	async def delete(self, room_name):
+		await self.connection().delete(self.PREFIX + room_name)
+
+
+def make_checkpoint_store():
+	"""Store from the GAME_CHECKPOINTS setting: a redis:// URL, or a directory for a single worker"""
+	location = str(getattr(settings, 'GAME_CHECKPOINTS', os.path.join(settings.BASE_DIR, 'checkpoints')))
+	if location.startswith(('redis://', 'rediss://', 'unix://')):
+		return RedisCheckpointStore(location)
+	return FileCheckpointStore(location)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import math
+import time
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+
+def is_finite_number(value):
+	"""Whether a decoded JSON value is a number a float can hold, neither NaN nor infinite"""
+	if isinstance(value, bool) or not isinstance(value, (int, float)):
+		return False
+	try:
+		return math.isfinite(value)
+	except OverflowError:
+		# An int too large for a float
+		return False
+
+
+def percentile(values, fraction):
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class LatencyProbe:
+	"""
+	Round trip time and clock offset of one connection.
+
+	Every INTERVAL seconds the server sends {'type': 'ping', 'id', 'time'}
+	with its wall clock in ms, plus its current estimates. The client
+	answers {'type': 'pong', 'id', 'client_time'} with its own clock.
+
+	rtt is smoothed like TCP's SRTT (RFC 6298), with rtt_var the smoothed
+	deviation. offset is the client clock minus the server clock, taken at
+	the middle of each round trip and smoothed the same way. Pings left
+	unanswered are forgotten after MAX_IN_FLIGHT newer ones.
+	"""
+
+	INTERVAL = 2
+	ALPHA = 1 / 8
+	BETA = 1 / 4
+	MAX_IN_FLIGHT = 4
+
+	# Probes of the live connections of this process, for metrics
+	active = set()
+
+	def __init__(self, send):
+		self.send = send
+		self.rtt = None
+		self.rtt_var = None
+		self.offset = None
+		self.samples = 0
+
+		# Ping id -> (monotonic, wall clock ms) when it was sent
+		self.in_flight = {}
+		self.next_id = 0
+		self.task = None
+
+	def start(self):
+		if self.task is None:
+			LatencyProbe.active.add(self)
+			self.task = asyncio.create_task(self.run())
+
+	async def close(self):
+		LatencyProbe.active.discard(self)
+		if self.task:
+			self.task.cancel()
+			try:
+				await self.task
+			except asyncio.CancelledError:
+				pass
+			self.task = None
+
+	async def run(self):
+		try:
+			while True:
+				await self.ping()
+				await asyncio.sleep(self.INTERVAL)
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			logger.error(f"Latency probe stopped: {str(e)}")
+
+	async def ping(self):
+		self.next_id += 1
+		server_time = time.time() * 1000
+		self.in_flight[self.next_id] = (time.monotonic(), server_time)
+		if len(self.in_flight) > self.MAX_IN_FLIGHT:
+			del self.in_flight[min(self.in_flight)]
+
+		await self.send(text_data=json.dumps({
+			'type': 'ping',
+			'id': self.next_id,
+			'time': server_time,
+			'rtt': self.rtt,
+			'offset': self.offset,
+		}))
+
+	def handle_pong(self, message):
+		"""Update the estimates from a pong, ignoring unknown or malformed ones"""
+		ping_id = message.get('id')
+		client_time = message.get('client_time')
+		# A NaN would poison the offset, and every ping after it
+		if isinstance(ping_id, bool) or not isinstance(ping_id, int) or not is_finite_number(client_time):
+			return
+		sent = self.in_flight.pop(ping_id, None)
+		if sent is None:
+			return
+
+		sent_at, server_time = sent
+		rtt = (time.monotonic() - sent_at) * 1000
+		offset = client_time - (server_time + rtt / 2)
+
+		if self.rtt is None:
+			self.rtt = rtt
+			self.rtt_var = rtt / 2
+			self.offset = offset
+		else:
+			self.rtt_var += self.BETA * (abs(self.rtt - rtt) - self.rtt_var)
+			self.rtt += self.ALPHA * (rtt - self.rtt)
+			self.offset += self.ALPHA * (offset - self.offset)
+		self.samples += 1
+
+	@classmethod
+	def summary(cls):
+		"""Round trip times over the measured connections of this process, in ms"""
+		rtts = [probe.rtt for probe in cls.active if probe.rtt is not None]
+		if not rtts:
+			return {'connections': len(cls.active), 'measured': 0}
+		return {
+			'connections': len(cls.active),
+			'measured': len(rtts),
+			'rtt_p50': round(percentile(rtts, 0.5), 1),
+			'rtt_p95': round(percentile(rtts, 0.95), 1),
+			'rtt_max': round(max(rtts), 1),
+		}
@@ -0,0 +1,116 @@
+import bisect
+from collections import Counter
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds, from well under a tick to several ticks at 60 Hz
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.0167, 0.025, 0.05, 0.1, 0.25)
+
+
+class Histogram:
+	"""
+	Cumulative Prometheus histogram of one worker. observe() only bumps a
+	bucket, the tick calls it several times per frame.
+	"""
+
+	def __init__(self, name, help, buckets=DURATION_BUCKETS):
+		self.name = name
+		self.help = help
+		self.buckets = buckets
+		# One count per bucket plus +Inf, not cumulative until exported
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def family(self):
+		samples = []
+		cumulative = 0
+		for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+			cumulative += count
+			samples.append(('_bucket', {'le': '+Inf' if bound == float('inf') else repr(bound)}, cumulative))
+		samples.append(('_sum', {}, self.sum))
+		samples.append(('_count', {}, self.count))
+		return family(self.name, 'histogram', self.help, samples)
+
+
+def family(name, kind, help, samples):
+	"""
+	A metric family as plain values, so workers can announce theirs in the
+	room registry. samples are (labels, value) or (suffix, labels, value).
+	"""
+	return {
+		'name': name,
+		'type': kind,
+		'help': help,
+		'samples': [sample if len(sample) == 3 else ('', *sample) for sample in samples],
+	}
+
+
+def escape(value):
+	return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render(workers):
+	"""
+	Prometheus text of the metric families of every worker, given as
+	(worker label, families), each sample labelled with its worker.
+	"""
+	merged = {}
+	for worker, families in workers:
+		for metric in families:
+			entry = merged.setdefault(metric['name'], (metric, []))
+			entry[1].extend(
+				(suffix, {'worker': worker, **labels}, value) for suffix, labels, value in metric['samples']
+			)
+
+	lines = []
+	for name, (metric, samples) in merged.items():
+		lines.append(f"# HELP {name} {metric['help']}")
+		lines.append(f"# TYPE {name} {metric['type']}")
+		for suffix, labels, value in samples:
+			label_text = ','.join(f'{key}="{escape(label)}"' for key, label in labels.items())
+			lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+	return '\n'.join(lines) + '\n'
+
+
+# Game loop, observed by the scheduler and the room actors of this worker
+tick_duration = Histogram(
+	'game_tick_duration_seconds',
+	"Time to step every room of the worker by one tick, broadcasts included",
+)
+tick_lateness = Histogram(
+	'game_tick_lateness_seconds',
+	"How late the scheduler woke up for a frame, its scheduling jitter",
+)
+broadcast_duration = Histogram(
+	'game_broadcast_duration_seconds',
+	"Time to send the frames of every room due after a tick",
+)
+layer_send = Histogram(
+	'game_layer_send_seconds',
+	"Time a room waits on the channel layer to send a frame to its groups",
+)
+frame_delivery = Histogram(
+	'game_frame_delivery_seconds',
+	"Time from a room sending a frame to a player's consumer handling it, through the channel layer",
+)
+
+# Open WebSocket connections of this worker by consumer
+connections = Counter()
+
+
+def track_connections(app, consumer):
+	"""Wrap a consumer's ASGI app to count its open connections under the given name"""
+	async def tracked(scope, receive, send):
+		connections[consumer] += 1
+		try:
+			return await app(scope, receive, send)
+		finally:
+			connections[consumer] -= 1
+	return tracked
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from collections import deque
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+
+class OutboundQueue:
+	"""
+	Messages waiting to be written to one client socket.
+
+	State frames go in a single latest-wins slot: when a new frame arrives
+	before the previous one was written, the old one is dropped and counted,
+	so a stalled client costs at most one frame of memory and gets current
+	state once it catches up. Keyframes, which later frames depend on, have
+	a slot of their own written before it: only the newest one matters, so
+	it replaces an unsent one the same way. Reliable events (game_over,
+	reset_round...) keep a FIFO written before both slots.
+
+	Frames only pile up when the server's send waits for the socket, which
+	depends on the ASGI server's flow control.
+	"""
+
+	# Frames dropped and messages written by every connection of this worker
+	total_dropped = 0
+	total_written = 0
+
+	def __init__(self, send):
+		self.send = send
+		self.reliable = deque()
+		self.keyframe = None
+		self.latest = None
+		self.dropped = 0
+
+		self.wakeup = asyncio.Event()
+		self.task = None
+
+	def start(self):
+		"""Start writing, once the socket was accepted"""
+		if self.task is None:
+			self.task = asyncio.create_task(self.run())
+
+	async def close(self):
+		if self.task:
+			self.task.cancel()
+			try:
+				await self.task
+			except asyncio.CancelledError:
+				pass
+			self.task = None
+
+	def put_event(self, **message):
+		"""Queue a message that must reach the client, takes the arguments of send()"""
+		self.reliable.append([message])
+		self.wakeup.set()
+
+	def put_frame(self, messages, keyframe=False):
+		"""Queue the messages of a state frame, replacing the one still waiting if any"""
+		# A keyframe also supersedes the frames before it
+		replaced = (self.latest, self.keyframe) if keyframe else (self.latest,)
+		for frame in replaced:
+			if frame is not None:
+				self.dropped += 1
+				OutboundQueue.total_dropped += 1
+
+		if keyframe:
+			self.keyframe = messages
+			self.latest = None
+		else:
+			self.latest = messages
+		self.wakeup.set()
+
+	async def run(self):
+		try:
+			while True:
+				await self.wakeup.wait()
+				self.wakeup.clear()
+
+				while self.reliable or self.keyframe is not None or self.latest is not None:
+					if self.reliable:
+						messages = self.reliable.popleft()
+					elif self.keyframe is not None:
+						messages, self.keyframe = self.keyframe, None
+					else:
+						messages, self.latest = self.latest, None
+					for message in messages:
+						await self.send(**message)
+					OutboundQueue.total_written += len(messages)
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			logger.error(f"Outbound queue stopped: {str(e)}")
@@ -0,0 +1,371 @@
+import math
+import numpy as np
+
+# Server side port of the networked game rules in frontend pongLogic/pong.js.
+# Every room of the worker lives in one set of arrays and is stepped at once.
+
+SIDES = ('left', 'right', 'bottom', 'top')
+LEFT, RIGHT, BOTTOM, TOP = range(4)
+NO_SIDE = -1
+
+# Play area constants, same as Pong in pong.js
+PLAY_WIDTH = 100
+PLAY_DEPTH = 60
+BALL_HALF_SIZE = 0.5
+Y_SPEED_CAP = 50
+MULTI_SIDE_PUSH = 0.2
+SERVE_SPEED = 0.5
+
+# Ball speeds are in units per frame at this rate, like on the client
+FRAME_RATE = 60
+
+# Seconds the ball stays in the center before each serve
+SERVE_DELAY = 1.0
+
+# Half width/height of each paddle, left/right paddles stand upright
+PADDLE_HALF_SIZE = np.array([[0.5, 4], [0.5, 4], [4, 0.5], [4, 0.5]])
+# Left/right paddles move along y, bottom/top along x
+MOVES_ALONG_Y = np.array([True, True, False, False])
+# Axis a paddle faces along (0 = x, 1 = y) and the direction of the field from its inner face
+NORMAL_AXIS = np.array([0, 0, 1, 1])
+INNER_DIRECTION = np.array([1, -1, -1, 1])
+# Distance from a paddle's center at which the ball center touches it, across and along the paddle
+PADDLE_REACH = PADDLE_HALF_SIZE[np.arange(4), NORMAL_AXIS] + BALL_HALF_SIZE
+PADDLE_SPAN = PADDLE_HALF_SIZE[np.arange(4), 1 - NORMAL_AXIS] + BALL_HALF_SIZE
+
+# Collision candidates after the 4 paddles: the bottom (+y) and top (-y) walls of 2 player rooms
+WALL_BOTTOM, WALL_TOP = 4, 5
+# Contacts resolved per ball and step, more than this in one step are dropped
+MAX_BOUNCES = 4
+
+# Longest a player's view of the ball is rewound for lag compensation, in seconds
+MAX_REWIND = 0.3
+
+# Distance of the paddles from the center and the ratio applied to bottom/top, posSpawn in loadPadle.js
+MAP_LAYOUTS = {
+	'classic': (40, 0.6),
+	'bath': (40, 0.5),
+	'lava': (35, 1),
+	'beach': (38, 1),
+}
+
+
+def paddle_offsets(map_name):
+	"""Fixed coordinate of each paddle: x for left/right, y for bottom/top"""
+	distance, ratio = MAP_LAYOUTS.get(map_name, MAP_LAYOUTS['classic'])
+	return np.array([-distance, distance, distance * ratio, -distance * ratio])
+
+
+def paddle_limit(side):
+	"""
+	How far from the center a paddle can be moved: it stays inside the play
+	area, the same bound as checkBounderyPadlePos in loadPadle.js
+	"""
+	if MOVES_ALONG_Y[side]:
+		return PLAY_DEPTH / 2 - PADDLE_HALF_SIZE[side][1]
+	return PLAY_WIDTH / 2 - PADDLE_HALF_SIZE[side][0]
+
+
+class PhysicsWorld:
+	"""
+	Ball and paddle state of every live room, as arrays indexed by room slot.
+
+	step() advances all rooms together with vectorised operations, so its
+	cost barely depends on how many rooms are in play. It returns the points
+	scored during the step as (slot, winner side, loser side) tuples, with
+	NO_SIDE as winner when a 4 player ball leaves without any paddle touch.
+
+	Collisions are swept: each step finds the earliest time the ball's path
+	meets a paddle face or wall, moves it there, bounces and carries on with
+	the rest of the step. Fast balls cannot tunnel and the result does not
+	depend on the step length, so rooms can tick at 20-30 Hz. With a fixed
+	dt the same inputs always give the same trajectory.
+
+	Paddle hits are lag compensated. The ball position after each of the
+	last `history` steps is kept in a ring buffer, and each side of a room
+	has a rewind in steps: how far behind the server its player sees the
+	ball (see set_rewind). A ball that went past a paddle's face is still
+	a hit while the crossing is within that rewind and the paddle, as the
+	player has moved it since, covers the point where the ball crossed.
+	The ball then bounces from there, as if the late input had arrived in
+	time.
+	"""
+
+	def __init__(self, capacity=64, seed=None, history=20):
+		self.rng = np.random.default_rng(seed)
+		self.capacity = 0
+		self.free = []
+		self.history_size = history
+		# Steps recorded so far, the next one goes to history_tick % history
+		self.history_tick = 0
+		self.resize(capacity)
+
+	def resize(self, capacity):
+		"""Grow every array to hold capacity rooms, keeping existing slots"""
+		def grow(array, shape, dtype, fill=0):
+			new = np.full((capacity, *shape), fill, dtype=dtype)
+			if array is not None:
+				new[:len(array)] = array
+			return new
+
+		first = self.capacity == 0
+		self.ball_pos = grow(None if first else self.ball_pos, (2,), np.float64)
+		self.ball_vel = grow(None if first else self.ball_vel, (2,), np.float64)
+		self.paddle_pos = grow(None if first else self.paddle_pos, (4,), np.float64)
+		self.paddle_offset = grow(None if first else self.paddle_offset, (4,), np.float64)
+		self.paddle_active = grow(None if first else self.paddle_active, (4,), bool)
+		self.four_player = grow(None if first else self.four_player, (), bool)
+		self.last_contact = grow(None if first else self.last_contact, (), np.int8, NO_SIDE)
+		self.in_play = grow(None if first else self.in_play, (), bool)
+		self.serve_timer = grow(None if first else self.serve_timer, (), np.float64)
+		self.used = grow(None if first else self.used, (), bool)
+		self.rewind = grow(None if first else self.rewind, (4,), np.int32)
+		self.history = grow(None if first else self.history, (self.history_size, 2), np.float64)
+
+		self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+		self.capacity = capacity
+
+	def add_room(self, map_name, player_count, sides):
+		"""Allocate a slot for a room, its first serve comes after SERVE_DELAY"""
+		if not self.free:
+			self.resize(self.capacity * 2)
+		slot = self.free.pop()
+
+		self.used[slot] = True
+		self.four_player[slot] = player_count > 2
+		self.paddle_offset[slot] = paddle_offsets(map_name)
+		self.paddle_pos[slot] = 0
+		self.paddle_active[slot] = [side in sides for side in SIDES]
+		self.rewind[slot] = 0
+		self.reset_ball(slot)
+		return slot
+
+	def remove_room(self, slot):
+		self.used[slot] = False
+		self.in_play[slot] = False
+		self.paddle_active[slot] = False
+		self.rewind[slot] = 0
+		self.serve_timer[slot] = 0
+		self.free.append(slot)
+
+	def set_rewind(self, slot, side, steps):
+		"""How many steps behind the server the player of a side sees the ball, capped to the history kept"""
+		self.rewind[slot, side] = min(max(int(steps), 0), self.history_size - 1)
+
+	def set_paddle(self, slot, side, position):
+		"""Move a paddle, keeping it inside the play area"""
+		limit = paddle_limit(side)
+		self.paddle_pos[slot, side] = min(max(position, -limit), limit)
+
+	def reset_ball(self, slot):
+		"""Put the ball back in the center and wait before serving it"""
+		self.ball_pos[slot] = 0
+		self.ball_vel[slot] = 0
+		self.in_play[slot] = False
+		self.last_contact[slot] = NO_SIDE
+		self.serve_timer[slot] = SERVE_DELAY
+
+	def save_ball(self, slot):
+		"""The ball of a room as plain values, for checkpoints"""
+		return {
+			'pos': self.ball_pos[slot].tolist(),
+			'vel': self.ball_vel[slot].tolist(),
+			'in_play': bool(self.in_play[slot]),
+			'serve_timer': float(self.serve_timer[slot]),
+			'last_contact': int(self.last_contact[slot]),
+		}
+
+	def load_ball(self, slot, ball):
+		"""Put back a ball saved with save_ball"""
+		self.ball_pos[slot] = ball['pos']
+		self.ball_vel[slot] = ball['vel']
+		self.in_play[slot] = ball['in_play']
+		self.serve_timer[slot] = ball['serve_timer']
+		self.last_contact[slot] = ball['last_contact']
+
+	def serve(self, slots):
+		"""Launch the balls of the given slots: sideways in 2 player rooms, any direction with 4"""
+		count = len(slots)
+		angles = self.rng.uniform(0, 2 * math.pi, count)
+		directions = self.rng.choice((-1.0, 1.0), count)
+		four_player = self.four_player[slots]
+
+		self.ball_vel[slots, 0] = np.where(four_player, SERVE_SPEED * np.cos(angles), SERVE_SPEED * directions)
+		self.ball_vel[slots, 1] = np.where(four_player, SERVE_SPEED * np.sin(angles), 0)
+		self.in_play[slots] = True
+		self.serve_timer[slots] = 0
+
+	def step(self, dt):
+		"""Advance every room by dt seconds and return the points scored"""
+		# Serve balls whose countdown ran out
+		waiting = self.used & ~self.in_play
+		self.serve_timer[waiting] -= dt
+		ready = np.flatnonzero(waiting & (self.serve_timer <= 0))
+		if ready.size:
+			self.serve(ready)
+
+		moving = self.in_play.copy()
+		if not moving.any():
+			return []
+
+		# Frames of travel left for each ball in this step
+		remaining = np.where(moving, dt * FRAME_RATE, 0.0)
+		for _ in range(MAX_BOUNCES):
+			active = remaining > 0
+			if not active.any():
+				break
+
+			travel = self.ball_vel * remaining[:, None]
+			hit_time, hit_with = self.time_of_impact(travel, active)
+			hit = np.isfinite(hit_time)
+
+			fraction = np.where(hit, hit_time, 1.0)
+			self.ball_pos[active] += travel[active] * fraction[active, None]
+			remaining = np.where(hit, remaining * (1 - fraction), 0.0)
+
+			rows = np.flatnonzero(hit)
+			if rows.size:
+				self.bounce(rows, hit_with[rows])
+
+		if self.rewind.any():
+			self.compensate(moving, dt * FRAME_RATE)
+		self.history[:, self.history_tick % self.history_size] = self.ball_pos
+		self.history_tick += 1
+
+		return self.collect_points(moving)
+
+	def paddle_centers(self):
+		x = np.where(MOVES_ALONG_Y, self.paddle_offset, self.paddle_pos)
+		y = np.where(MOVES_ALONG_Y, self.paddle_pos, self.paddle_offset)
+		return x, y
+
+	def time_of_impact(self, travel, active):
+		"""
+		Earliest contact along each ball's travel, as a fraction of it, and
+		what it hits: a side index for paddles, WALL_BOTTOM or WALL_TOP.
+		The fraction is inf for balls that hit nothing.
+		"""
+		pos = self.ball_pos
+		times = np.full((self.capacity, 6), np.inf)
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			# Paddles: crossing of the inner face, within the paddle's span at that moment
+			pos_normal = pos[:, NORMAL_AXIS]
+			travel_normal = travel[:, NORMAL_AXIS]
+			face = self.paddle_offset + INNER_DIRECTION * PADDLE_REACH
+			approaching = (travel_normal * INNER_DIRECTION < 0) & ((pos_normal - face) * INNER_DIRECTION >= 0)
+			t = (face - pos_normal) / travel_normal
+			lateral = pos[:, 1 - NORMAL_AXIS] + t * travel[:, 1 - NORMAL_AXIS]
+			touches = (
+				approaching
+				& (t <= 1)
+				& (np.abs(lateral - self.paddle_pos) <= PADDLE_SPAN)
+				& self.paddle_active
+				& active[:, None]
+			)
+			times[:, :4] = np.where(touches, t, np.inf)
+
+			# Walls: 2 player balls bounce when their center reaches the edge
+			walls = active & ~self.four_player
+			for column, edge in ((WALL_BOTTOM, PLAY_DEPTH / 2), (WALL_TOP, -PLAY_DEPTH / 2)):
+				outward = walls & (travel[:, 1] * edge > 0)
+				t = np.maximum((edge - pos[:, 1]) / travel[:, 1], 0)
+				times[:, column] = np.where(outward & (t <= 1), t, np.inf)
+
+		hit_with = np.argmin(times, axis=1)
+		return times[np.arange(self.capacity), hit_with], hit_with
+
+	def bounce(self, rows, hit_with):
+		"""Apply the contacts found by time_of_impact, like Pong.handlePaddleCollision"""
+		pos = self.ball_pos
+		vel = self.ball_vel
+		paddle_x, paddle_y = self.paddle_centers()
+
+		for target in range(6):
+			hit = rows[hit_with == target]
+			if not hit.size:
+				continue
+
+			if target == LEFT:
+				vel[hit, 0] = np.abs(vel[hit, 0])
+				vel[hit, 1] = (pos[hit, 1] - paddle_y[hit, target]) * MULTI_SIDE_PUSH
+			elif target == RIGHT:
+				vel[hit, 0] = -np.abs(vel[hit, 0])
+				vel[hit, 1] += (pos[hit, 1] - paddle_y[hit, target]) * MULTI_SIDE_PUSH
+			elif target == BOTTOM:
+				vel[hit, 1] = -np.abs(vel[hit, 1])
+				vel[hit, 0] += (pos[hit, 0] - paddle_x[hit, target]) * MULTI_SIDE_PUSH
+			elif target == TOP:
+				vel[hit, 1] = np.abs(vel[hit, 1])
+				vel[hit, 0] += (pos[hit, 0] - paddle_x[hit, target]) * MULTI_SIDE_PUSH
+			else:
+				vel[hit, 1] = -vel[hit, 1]
+
+			if target < 4:
+				self.last_contact[hit] = target
+
+		np.clip(vel[rows, 1], -Y_SPEED_CAP, Y_SPEED_CAP, out=vel[rows, 1])
+
+	def compensate(self, moving, frames):
+		"""Turn into hits the misses that lagging players caught on their screen"""
+		face = self.paddle_offset + INNER_DIRECTION * PADDLE_REACH
+		behind = (self.ball_pos[:, NORMAL_AXIS] - face) * INNER_DIRECTION < 0
+		candidates = np.argwhere(behind & self.paddle_active & (self.rewind > 0) & moving[:, None])
+
+		for slot, side in candidates:
+			self.rewound_hit(slot, side, face[slot, side], frames)
+
+	def rewound_hit(self, slot, side, face, frames):
+		"""
+		Walk back the history of a ball past a paddle's face, up to the
+		side's rewind, to where it crossed the face. Bounce it from there if
+		the paddle covers that point, carrying it forward by the time since.
+		"""
+		normal = NORMAL_AXIS[side]
+		depth = min(int(self.rewind[slot, side]), self.history_tick)
+		after = self.ball_pos[slot]
+
+		for back in range(1, depth + 1):
+			before = self.history[slot, (self.history_tick - back) % self.history_size]
+			if (before[normal] - face) * INNER_DIRECTION[side] < 0:
+				after = before
+				continue
+
+			# Crossed between the two positions, check the paddle where it happened
+			fraction = (face - before[normal]) / (after[normal] - before[normal])
+			lateral = before[1 - normal] + fraction * (after[1 - normal] - before[1 - normal])
+			if abs(lateral - self.paddle_pos[slot, side]) > PADDLE_SPAN[side]:
+				return False
+
+			self.ball_pos[slot, normal] = face
+			self.ball_pos[slot, 1 - normal] = lateral
+			self.bounce(np.array([slot]), np.array([side]))
+			self.ball_pos[slot] += self.ball_vel[slot] * (back - fraction) * frames
+			return True
+
+		return False
+
+	def collect_points(self, moving):
+		"""Score and reset the balls that left the play area"""
+		pos = self.ball_pos
+		out_x = np.abs(pos[:, 0]) >= PLAY_WIDTH / 2
+		out_y = self.four_player & (np.abs(pos[:, 1]) >= PLAY_DEPTH / 2)
+		out = np.flatnonzero(moving & (out_x | out_y))
+
+		scored = []
+		for slot in out:
+			x, y = pos[slot]
+			if out_x[slot]:
+				loser = RIGHT if x > 0 else LEFT
+			else:
+				loser = BOTTOM if y > 0 else TOP
+
+			if self.four_player[slot]:
+				# The last paddle to touch the ball gets the point
+				winner = int(self.last_contact[slot])
+			else:
+				winner = LEFT if loser == RIGHT else RIGHT
+
+			scored.append((int(slot), winner, loser))
+			self.reset_ball(slot)
+		return scored
@@ -0,0 +1,242 @@
+import json
+import math
+import struct
+
+# WebSocket subprotocols a game client can ask for, and the frame format they select.
+# Clients that do not ask for one get the original full JSON state every tick.
+SUBPROTOCOLS = {
+	'pong.binary.v3': 'binary',
+	'pong.delta.v1': 'delta',
+}
+DEFAULT_FORMAT = 'json'
+
+# Binary protocol, all little endian. Sides are sent as their index in physics.SIDES.
+NO_SIDE = 0xFF
+
+MSG_STATE = 0x01
+MSG_PADDLE_MOVE = 0x10
+
+# type, tick, server time in ms, mask of sides present, last winner, last loser, ball x/y, ball speed x/y
+STATE_HEADER = struct.Struct('<BIdBBB4f')
+# position, rotation, score, last input applied, once per side present in the mask, in SIDES order
+STATE_PADDLE = struct.Struct('<2fBI')
+# type, then position/rotation/input sequence number for paddle_move
+INPUT = struct.Struct('<B2fI')
+
+# Largest finite float32, struct refuses to pack anything beyond it
+FLOAT32_MAX = struct.unpack('<f', b'\xff\xff\x7f\x7f')[0]
+
+
+def negotiate_format(subprotocols):
+	"""Pick the first supported subprotocol offered by the client"""
+	for subprotocol in subprotocols or []:
+		if subprotocol in SUBPROTOCOLS:
+			return subprotocol, SUBPROTOCOLS[subprotocol]
+	return None, DEFAULT_FORMAT
+
+
+def dumps(message):
+	return json.dumps(message, separators=(',', ':'))
+
+
+def encode_state_update(state, tick, server_time, acks):
+	"""Encode a game_state_update frame once, ready to be sent as is to every client"""
+	return dumps({
+		'type': 'game_state_update',
+		'tick': tick,
+		'time': server_time,
+		'acks': acks,
+		'state': state,
+	})
+
+
+def diff_state(base, state):
+	"""
+	Return the fields of state that differ from base, as a nested dict.
+	Lists and scalars are sent whole. Returns None when keys were added or
+	removed, in which case only a keyframe can describe the new state.
+	"""
+	if base.keys() != state.keys():
+		return None
+
+	delta = {}
+	for key, value in state.items():
+		old = base[key]
+		if isinstance(value, dict):
+			if not isinstance(old, dict):
+				return None
+			sub_delta = diff_state(old, value)
+			if sub_delta is None:
+				return None
+			if sub_delta:
+				delta[key] = sub_delta
+		elif value != old:
+			delta[key] = value
+	return delta
+
+
+def wire_side(side):
+	"""A side index of the GameState as sent, NO_SIDE for none"""
+	return side if side >= 0 else NO_SIDE
+
+
+def wire_float(value):
+	"""A float clamped to the float32 range, so an out of range value cannot break every frame of a room"""
+	return min(max(value, -FLOAT32_MAX), FLOAT32_MAX)
+
+
+def encode_binary_state(state, tick, server_time):
+	"""Pack the per-tick part of a GameState: ball, paddles and scores"""
+	mask = 0
+	body = []
+	for index, paddle in enumerate(state.paddles):
+		if paddle:
+			mask |= 1 << index
+			body.append(STATE_PADDLE.pack(
+				wire_float(paddle.position), wire_float(paddle.rotation), min(paddle.score, 255), paddle.seq
+			))
+
+	header = STATE_HEADER.pack(
+		MSG_STATE, tick, server_time, mask,
+		wire_side(state.last_winner),
+		wire_side(state.last_loser),
+		wire_float(state.ball_x), wire_float(state.ball_y),
+		wire_float(state.speed_x), wire_float(state.speed_y),
+	)
+	return header + b''.join(body)
+
+
+def decode_input(data):
+	"""Decode a binary client input into the same dict as its JSON form, None if malformed"""
+	if len(data) != INPUT.size:
+		return None
+
+	message_type, first, second, seq = INPUT.unpack(data)
+	if not (math.isfinite(first) and math.isfinite(second)):
+		return None
+	if message_type == MSG_PADDLE_MOVE:
+		return {'type': 'paddle_move', 'position': first, 'rotation': second, 'seq': seq}
+	return None
+
+
+class FrameEncoder:
+	"""
+	Builds the frames of one room for every format in use, once per tick.
+
+	Delta clients get a full state_keyframe when they join, when players come
+	or go and every KEYFRAME_INTERVAL ticks. In between they get a state_delta
+	holding only what changed since that keyframe, so a client can rebuild the
+	state from the last keyframe and any later delta, even after skipping some.
+
+	Binary clients get a packed frame every snapshot, plus the full JSON state
+	whenever the roster changes, since names and paddle sizes are not packed.
+
+	Every frame carries its tick and the server time in milliseconds, so
+	clients can interpolate between snapshots sent below the tick rate, and
+	the sequence number of the last input applied for each side ('acks', or
+	per paddle in binary frames), so clients can predict their own paddle
+	and reconcile with the server.
+	"""
+
+	KEYFRAME_INTERVAL = 60
+
+	def __init__(self):
+		self.keyframe = None
+		self.keyframe_tick = None
+		self.keyframe_time = None
+		self.force_keyframe = True
+		self.force_roster = True
+
+	def request_keyframe(self):
+		"""Send full state with the next frame, for instance because a client joined"""
+		self.force_keyframe = True
+		self.force_roster = True
+
+	def encode(self, state, tick, server_time, formats):
+		"""
+		Return {format: payload} for a GameState in the given formats. Payloads
+		hold 'text' and/or 'bytes', and 'keyframe' when later frames depend on
+		this one.
+		"""
+		# The JSON shape is built once, and only if a format sends it
+		data = acks = None
+		if 'json' in formats or 'delta' in formats or ('binary' in formats and self.force_roster):
+			data = state.to_dict()
+			acks = state.acks()
+
+		frames = {}
+		if 'json' in formats:
+			frames['json'] = {'text': encode_state_update(data, tick, server_time, acks)}
+		if 'delta' in formats:
+			frames['delta'] = self.encode_delta(data, tick, server_time, acks)
+		if 'binary' in formats:
+			frames['binary'] = self.encode_binary(state, data, tick, server_time, acks)
+		return frames
+
+	def catch_up(self, state, tick, server_time, frame_format):
+		"""
+		A frame with everything a client joining mid-stream needs to follow
+		the next frames of this encoder, without forcing a keyframe on the
+		clients already there. Delta clients get the keyframe the coming
+		deltas refer to, None before the first one.
+		"""
+		if frame_format == 'delta':
+			if self.keyframe is None:
+				return None
+			return {
+				'text': dumps({
+					'type': 'state_keyframe',
+					'tick': self.keyframe_tick,
+					'time': self.keyframe_time,
+					'acks': state.acks(),
+					'state': self.keyframe,
+				}),
+				'keyframe': True,
+			}
+
+		frame = {'text': encode_state_update(state.to_dict(), tick, server_time, state.acks()), 'keyframe': True}
+		if frame_format == 'binary':
+			frame['bytes'] = encode_binary_state(state, tick, server_time)
+		return frame
+
+	def encode_binary(self, state, data, tick, server_time, acks):
+		frame = {'bytes': encode_binary_state(state, tick, server_time)}
+		if self.force_roster:
+			self.force_roster = False
+			frame['text'] = encode_state_update(data, tick, server_time, acks)
+			frame['keyframe'] = True
+		return frame
+
+	def encode_delta(self, state, tick, server_time, acks):
+		delta = None
+		if not self.force_keyframe and self.keyframe is not None \
+				and tick - self.keyframe_tick < self.KEYFRAME_INTERVAL:
+			delta = diff_state(self.keyframe, state)
+
+		if delta is None:
+			# A fresh dict from GameState.to_dict, nothing else holds it
+			self.keyframe = state
+			self.keyframe_tick = tick
+			self.keyframe_time = server_time
+			self.force_keyframe = False
+			return {
+				'text': dumps({
+					'type': 'state_keyframe',
+					'tick': tick,
+					'time': server_time,
+					'acks': acks,
+					'state': state,
+				}),
+				'keyframe': True,
+			}
+
+		return {
+			'text': dumps({
+				'type': 'state_delta',
+				'tick': tick,
+				'time': server_time,
+				'acks': acks,
+				'keyframe': self.keyframe_tick,
+				'delta': delta,
+			}),
+		}
@@ -0,0 +1,114 @@
+import json
+from django.conf import settings
+from redis.asyncio import Redis
+
+# Claim a room unless another worker owns it, returns the owner either way
+CLAIM_LUA = """
+	if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+		return ARGV[1]
+	end
+	return redis.call('GET', KEYS[1])
+"""
+
+# Extend or drop a claim, only if it is still ours
+REFRESH_LUA = """
+	if redis.call('GET', KEYS[1]) == ARGV[1] then
+		return redis.call('EXPIRE', KEYS[1], ARGV[2])
+	end
+	return 0
+"""
+RELEASE_LUA = """
+	if redis.call('GET', KEYS[1]) == ARGV[1] then
+		return redis.call('DEL', KEYS[1])
+	end
+	return 0
+"""
+
+
+class LocalRoomRegistry:
+	"""Room owners for a single process, every room belongs to the only worker"""
+
+	def __init__(self):
+		self.owners = {}
+		self.statuses = {}
+
+	async def claim(self, room_name, worker):
+		return self.owners.setdefault(room_name, worker)
+
+	async def owner(self, room_name):
+		return self.owners.get(room_name)
+
+	async def refresh(self, room_names, worker):
+		pass
+
+	async def release(self, room_name, worker):
+		if self.owners.get(room_name) == worker:
+			del self.owners[room_name]
+
+	async def announce(self, worker, status):
+		self.statuses[worker] = status
+
+	async def workers(self):
+		return dict(self.statuses)
+
+
+class RedisRoomRegistry:
+	"""
+	Room owners shared by every worker, as Redis keys holding the owner's
+	command channel. Claims expire after TTL seconds unless refreshed, so
+	the rooms of a dead worker can be claimed again.
+
+	Workers also announce their status under WORKER_PREFIX, with the same
+	TTL, so management commands can list the live ones.
+	"""
+
+	PREFIX = 'game:room:owner:'
+	WORKER_PREFIX = 'game:worker:'
+	TTL = 30
+
+	def __init__(self, url):
+		self.url = url
+		self.redis = None
+
+	def connection(self):
+		# Created on first use, inside the worker's event loop
+		if self.redis is None:
+			self.redis = Redis.from_url(self.url, decode_responses=True)
+		return self.redis
+
+	async def claim(self, room_name, worker):
+		return await self.connection().eval(CLAIM_LUA, 1, self.PREFIX + room_name, worker, self.TTL)
+
+	async def owner(self, room_name):
+		return await self.connection().get(self.PREFIX + room_name)
+
+	async def refresh(self, room_names, worker):
+		async with self.connection().pipeline(transaction=False) as pipe:
+			for room_name in room_names:
+				pipe.eval(REFRESH_LUA, 1, self.PREFIX + room_name, worker, self.TTL)
+			await pipe.execute()
+
+	async def release(self, room_name, worker):
+		await self.connection().eval(RELEASE_LUA, 1, self.PREFIX + room_name, worker)
+
+	async def announce(self, worker, status):
+		await self.connection().set(self.WORKER_PREFIX + worker, json.dumps(status), ex=self.TTL)
+
+	async def workers(self):
+		"""Status of every live worker by command channel"""
+		keys = [key async for key in self.connection().scan_iter(match=self.WORKER_PREFIX + '*')]
+		if not keys:
+			return {}
+		values = await self.connection().mget(keys)
+		return {
+			key[len(self.WORKER_PREFIX):]: json.loads(value)
+			for key, value in zip(keys, values) if value is not None
+		}
+
+
+def make_registry():
+	"""Registry from the GAME_ROOM_REGISTRY setting: a redis:// URL, or 'local' for a single worker"""
+	url = getattr(settings, 'GAME_ROOM_REGISTRY', 'local')
+	if url == 'local':
+		return LocalRoomRegistry()
+	return RedisRoomRegistry(url)
@@ -0,0 +1,427 @@
+import asyncio
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Match replays: an append-only binary log per game, recorded by the room actor.
+#
+# The file starts with MAGIC and a length-prefixed JSON header describing the
+# room, then holds records, all little endian. Positions and speeds are
+# quantized to int16. Each record's tick is relative to the previous record,
+# except keyframes which carry it whole:
+#
+#   KEYFRAME  tick, mask of sides present, ball x/y and speed x/y,
+#             then position, rotation and score of each side present.
+#             Written when recording starts or resumes, and every
+#             KEYFRAME_INTERVAL seconds, so a reader can start at any of them.
+#   FRAME     ticks since the previous record, mask of what changed, then the
+#             new ball position, ball speed and paddles in that order.
+#             Written RECORD_RATE times per second when something changed.
+#   POINT     ticks since the previous record, winner and loser side (-1 for none).
+
+MAGIC = b'PONGRPL1'
+HEADER_LENGTH = struct.Struct('<I')
+
+REC_KEYFRAME = 0x01
+REC_FRAME = 0x02
+REC_POINT = 0x03
+
+KEYFRAME = struct.Struct('<BIB4h')
+KEYFRAME_PADDLE = struct.Struct('<2hB')
+FRAME = struct.Struct('<BHB')
+POINT = struct.Struct('<BHbb')
+PAIR = struct.Struct('<2h')
+
+# FRAME mask bits, paddle bits are CHANGED_PADDLE << side
+CHANGED_BALL_POS = 0x01
+CHANGED_BALL_VEL = 0x02
+CHANGED_PADDLE = 0x04
+
+# Quantization steps: 0.01 units for positions, 0.002 units per frame for speeds, 0.001 rad
+POSITION_SCALE = 100
+VELOCITY_SCALE = 500
+ROTATION_SCALE = 1000
+
+RECORD_RATE = 10
+KEYFRAME_INTERVAL = 10
+
+# Fastest a replay is streamed, times real time
+MAX_SPEED = 16
+
+# Under MEDIA_ROOT, the upload_to of GameResult.replay
+REPLAY_DIR = 'replays'
+
+
+def quantize(value, scale):
+	return max(-32768, min(32767, round(value * scale)))
+
+
+def pack_pair(first, second, first_scale, second_scale):
+	"""Two quantized values as a PAIR, clamped to int16 only in the rare case they overflow"""
+	try:
+		return PAIR.pack(round(first * first_scale), round(second * second_scale))
+	except struct.error:
+		return PAIR.pack(quantize(first, first_scale), quantize(second, second_scale))
+
+
+def replay_name(room_name, started):
+	"""Path of a game's replay, relative to MEDIA_ROOT like a FileField name"""
+	return f'{REPLAY_DIR}/{room_name}-{int(started)}.pongreplay'
+
+
+class ReplayRecorder:
+	"""
+	Records one room into its replay file.
+
+	record() is called every tick and only packs a few ints on the ticks
+	where a record is due, into an in-memory buffer. The buffer is appended
+	to the file off the event loop every FLUSH_INTERVAL seconds and on
+	close(). A recording that fails to write is dropped with an error, the
+	game itself never waits on it.
+
+	A room restored on another worker reopens the same file and carries on
+	after a new keyframe.
+	"""
+
+	FLUSH_INTERVAL = 1
+
+	def __init__(self, name, header, tick_rate):
+		self.name = name
+		self.path = os.path.join(settings.MEDIA_ROOT, name)
+		self.header = header
+		self.record_interval = max(1, round(tick_rate / RECORD_RATE))
+		self.keyframe_interval = KEYFRAME_INTERVAL * tick_rate
+
+		self.buffer = bytearray()
+		self.last_tick = None
+		self.last_keyframe = None
+		# Values of the last record: ball position, ball speed and paddle per side
+		self.last_ball_pos = None
+		self.last_ball_vel = None
+		self.last_paddles = [None] * 4
+
+		self.task = None
+		self.failed = False
+
+	def start(self):
+		if self.task is None:
+			self.task = asyncio.create_task(self.run())
+
+	async def close(self):
+		"""Stop recording and write what is left"""
+		if self.task:
+			self.task.cancel()
+			try:
+				await self.task
+			except asyncio.CancelledError:
+				pass
+			self.task = None
+		await self.flush()
+
+	async def run(self):
+		while True:
+			await asyncio.sleep(self.FLUSH_INTERVAL)
+			await self.flush()
+
+	async def flush(self):
+		if not self.buffer or self.failed:
+			return
+		chunk, self.buffer = self.buffer, bytearray()
+		try:
+			await asyncio.to_thread(self.append, bytes(chunk))
+		except OSError as e:
+			self.failed = True
+			logger.error(f"Recording replay {self.name} failed, dropping it: {str(e)}")
+
+	def append(self, chunk):
+		directory = os.path.dirname(self.path)
+		os.makedirs(directory, exist_ok=True)
+		with open(self.path, 'ab') as f:
+			# A new file starts with its header
+			if f.tell() == 0:
+				header = json.dumps(self.header, separators=(',', ':')).encode()
+				f.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+			f.write(chunk)
+
+	# Records
+
+	def since_last(self, tick):
+		"""Ticks since the previous record, None when a keyframe has to be written instead"""
+		if self.last_tick is None or tick - self.last_keyframe >= self.keyframe_interval:
+			return None
+		elapsed = tick - self.last_tick
+		return elapsed if 0 <= elapsed <= 0xFFFF else None
+
+	def record(self, state, tick):
+		"""Record the state after a tick, if a record is due"""
+		if tick % self.record_interval and self.last_tick is not None:
+			return
+
+		# Compared unquantized, only what changed gets packed
+		ball_pos = (state.ball_x, state.ball_y)
+		ball_vel = (state.speed_x, state.speed_y)
+		paddles = [(paddle.position, paddle.rotation) if paddle else None for paddle in state.paddles]
+
+		elapsed = self.since_last(tick)
+		if elapsed is None:
+			self.write_keyframe(state, tick)
+		else:
+			mask = 0
+			body = []
+			if ball_pos != self.last_ball_pos:
+				mask |= CHANGED_BALL_POS
+				body.append(pack_pair(*ball_pos, POSITION_SCALE, POSITION_SCALE))
+			if ball_vel != self.last_ball_vel:
+				mask |= CHANGED_BALL_VEL
+				body.append(pack_pair(*ball_vel, VELOCITY_SCALE, VELOCITY_SCALE))
+			if paddles != self.last_paddles:
+				for side, paddle in enumerate(paddles):
+					if paddle and self.last_paddles[side] and paddle != self.last_paddles[side]:
+						mask |= CHANGED_PADDLE << side
+						body.append(pack_pair(*paddle, POSITION_SCALE, ROTATION_SCALE))
+			if not mask:
+				return
+
+			self.buffer += FRAME.pack(REC_FRAME, elapsed, mask)
+			self.buffer += b''.join(body)
+			self.last_tick = tick
+
+		self.last_ball_pos = ball_pos
+		self.last_ball_vel = ball_vel
+		self.last_paddles = paddles
+
+	def write_keyframe(self, state, tick):
+		mask = 0
+		body = []
+		for side, paddle in enumerate(state.paddles):
+			if paddle:
+				mask |= 1 << side
+				body.append(pack_pair(paddle.position, paddle.rotation, POSITION_SCALE, ROTATION_SCALE))
+				body.append(bytes((min(paddle.score, 255),)))
+
+		self.buffer += KEYFRAME.pack(
+			REC_KEYFRAME, tick, mask,
+			quantize(state.ball_x, POSITION_SCALE), quantize(state.ball_y, POSITION_SCALE),
+			quantize(state.speed_x, VELOCITY_SCALE), quantize(state.speed_y, VELOCITY_SCALE),
+		)
+		self.buffer += b''.join(body)
+		self.last_tick = self.last_keyframe = tick
+
+	def point(self, tick, winner, loser):
+		if self.last_tick is None or not 0 <= tick - self.last_tick <= 0xFFFF:
+			# Nothing to count from, the next record is a keyframe with the score
+			return
+		self.buffer += POINT.pack(REC_POINT, tick - self.last_tick, winner, loser)
+		self.last_tick = tick
+
+
+def read_header(data):
+	"""The JSON header of a replay and the offset of its first record"""
+	if data[:len(MAGIC)] != MAGIC:
+		raise ValueError("Not a game replay")
+	offset = len(MAGIC)
+	(length,) = HEADER_LENGTH.unpack_from(data, offset)
+	offset += HEADER_LENGTH.size
+	return json.loads(bytes(data[offset:offset + length])), offset + length
+
+
+def walk_records(data, offset):
+	"""
+	Yield (kind, tick, start, end) for each record from offset, which must
+	be a keyframe or the first record, with absolute ticks. Stops before a
+	truncated last record, like the one of a game still being recorded.
+	"""
+	tick = 0
+	size = len(data)
+	while offset < size:
+		kind = data[offset]
+		if kind == REC_KEYFRAME:
+			if offset + KEYFRAME.size > size:
+				return
+			_, tick, mask = KEYFRAME.unpack_from(data, offset)[:3]
+			end = offset + KEYFRAME.size + KEYFRAME_PADDLE.size * bin(mask & 0x0F).count('1')
+		elif kind == REC_FRAME:
+			if offset + FRAME.size > size:
+				return
+			_, elapsed, mask = FRAME.unpack_from(data, offset)
+			tick += elapsed
+			end = offset + FRAME.size + PAIR.size * bin(mask).count('1')
+		elif kind == REC_POINT:
+			if offset + POINT.size > size:
+				return
+			tick += POINT.unpack_from(data, offset)[1]
+			end = offset + POINT.size
+		else:
+			raise ValueError(f"Unknown replay record {kind} at offset {offset}")
+
+		if end > size:
+			return
+		yield kind, tick, offset, end
+		offset = end
+
+
+def decode_record(data, kind, tick, offset):
+	"""One record as a dict with its 'type' and absolute 'tick'"""
+	if kind == REC_KEYFRAME:
+		_, _, mask, x, y, speed_x, speed_y = KEYFRAME.unpack_from(data, offset)
+		offset += KEYFRAME.size
+		paddles = {}
+		for side in range(4):
+			if mask & (1 << side):
+				position, rotation, score = KEYFRAME_PADDLE.unpack_from(data, offset)
+				offset += KEYFRAME_PADDLE.size
+				paddles[side] = {
+					'position': position / POSITION_SCALE,
+					'rotation': rotation / ROTATION_SCALE,
+					'score': score,
+				}
+		return {
+			'type': 'keyframe',
+			'tick': tick,
+			'ballPos': {'x': x / POSITION_SCALE, 'y': y / POSITION_SCALE},
+			'ballSpeed': {'x': speed_x / VELOCITY_SCALE, 'y': speed_y / VELOCITY_SCALE},
+			'paddles': paddles,
+		}
+
+	if kind == REC_FRAME:
+		mask = FRAME.unpack_from(data, offset)[2]
+		offset += FRAME.size
+		record = {'type': 'frame', 'tick': tick}
+		if mask & CHANGED_BALL_POS:
+			x, y = PAIR.unpack_from(data, offset)
+			offset += PAIR.size
+			record['ballPos'] = {'x': x / POSITION_SCALE, 'y': y / POSITION_SCALE}
+		if mask & CHANGED_BALL_VEL:
+			x, y = PAIR.unpack_from(data, offset)
+			offset += PAIR.size
+			record['ballSpeed'] = {'x': x / VELOCITY_SCALE, 'y': y / VELOCITY_SCALE}
+		for side in range(4):
+			if mask & (CHANGED_PADDLE << side):
+				position, rotation = PAIR.unpack_from(data, offset)
+				offset += PAIR.size
+				record.setdefault('paddles', {})[side] = {
+					'position': position / POSITION_SCALE,
+					'rotation': rotation / ROTATION_SCALE,
+				}
+		return record
+
+	_, _, winner, loser = POINT.unpack_from(data, offset)
+	return {'type': 'point', 'tick': tick, 'winner': winner, 'loser': loser}
+
+
+def read_replay(data):
+	"""Decode a whole replay into its header and a list of records, see decode_record"""
+	header, offset = read_header(data)
+	return header, [decode_record(data, kind, tick, start) for kind, tick, start, _ in walk_records(data, offset)]
+
+
+class ReplayFile:
+	"""
+	A finished replay, memory mapped and indexed for streaming.
+
+	The index splits the records into chunks of about CHUNK_SECONDS of play,
+	with a new chunk at every keyframe. A viewer is only a chunk position
+	and a speed: it sends slices of the mapping as they are, so the file
+	is read through the page cache once however many viewers it has. Open
+	files are shared through open(), which keeps the last CACHE_SIZE and is
+	called from the threads of both the HTTP views and the replay consumer.
+	"""
+
+	CHUNK_SECONDS = 0.1
+	CACHE_SIZE = 64
+
+	# Open replays by path, least recently used first, guarded by cache_lock
+	cache = OrderedDict()
+	cache_lock = threading.Lock()
+
+	def __init__(self, path):
+		with open(path, 'rb') as f:
+			self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		self.header, offset = read_header(self.data)
+		self.tick_rate = self.header['tick_rate']
+		self.prelude = self.data[:offset]
+
+		# Start tick and offset of each chunk, the last offset is the end of the records
+		self.chunk_ticks = []
+		self.chunk_offsets = []
+		# Indexes of the chunks starting with a keyframe
+		self.keyframes = []
+
+		chunk_ticks = max(1, round(self.CHUNK_SECONDS * self.tick_rate))
+		window = None
+		end = offset
+		self.end_tick = 0
+		for kind, tick, start, end in walk_records(self.data, offset):
+			if kind == REC_KEYFRAME or window is None or tick >= window:
+				if kind == REC_KEYFRAME:
+					self.keyframes.append(len(self.chunk_ticks))
+				self.chunk_ticks.append(tick)
+				self.chunk_offsets.append(start)
+				window = tick + chunk_ticks
+			self.end_tick = tick
+		self.chunk_offsets.append(end)
+
+	@classmethod
+	def open(cls, path):
+		"""The shared ReplayFile of a path, blocking: call it off the event loop"""
+		with cls.cache_lock:
+			replay = cls.cache.get(path)
+			if replay is not None:
+				cls.cache.move_to_end(path)
+				return replay
+
+		# Indexed without the lock, so other replays open meanwhile
+		replay = cls(path)
+		with cls.cache_lock:
+			# Another thread may have opened it first, keep theirs
+			replay = cls.cache.setdefault(path, replay)
+			cls.cache.move_to_end(path)
+			# Dropped mappings close once their last viewer is done
+			while len(cls.cache) > cls.CACHE_SIZE:
+				cls.cache.popitem(last=False)
+		return replay
+
+	@property
+	def start_tick(self):
+		return self.chunk_ticks[0] if self.chunk_ticks else 0
+
+	def info(self):
+		return {
+			'header': self.header,
+			'start_tick': self.start_tick,
+			'end_tick': self.end_tick,
+			'keyframes': [self.chunk_ticks[index] for index in self.keyframes],
+		}
+
+	def seek(self, tick):
+		"""Index of the chunk starting with the last keyframe at or before tick"""
+		position = bisect.bisect_right(self.keyframes, bisect.bisect_right(self.chunk_ticks, tick) - 1) - 1
+		return self.keyframes[max(position, 0)] if self.keyframes else 0
+
+	def chunk(self, index):
+		return self.data[self.chunk_offsets[index]:self.chunk_offsets[index + 1]]
+
+	async def stream(self, index=0, speed=1.0):
+		"""
+		Yield (chunk index, bytes) from the chunk at index, each when its
+		first tick is due at speed times real time. A speed of 0 sends
+		everything at once.
+		"""
+		loop = asyncio.get_running_loop()
+		started = loop.time()
+		for current in range(index, len(self.chunk_ticks)):
+			if speed:
+				due = started + (self.chunk_ticks[current] - self.chunk_ticks[index]) / (self.tick_rate * speed)
+				delay = due - loop.time()
+				if delay > 0:
+					await asyncio.sleep(delay)
+			yield current, self.chunk(current)
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import math
+import time
+from django.conf import settings
+from apps.game.engine.physics import PhysicsWorld, MAX_REWIND
+from apps.game.engine import metrics
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+
+class TickScheduler:
+	"""
+	Steps every live room of this worker in one batch per frame.
+
+	A single task drives all rooms with a fixed timestep: elapsed wall time
+	is added to an accumulator and whole ticks are consumed from it, so rooms
+	never drift apart and a late wakeup is caught up instead of lost. Frames
+	that take longer than one tick are counted and reported as overruns.
+	Tick duration, wakeup lateness and broadcast time go to the worker's
+	metrics, see engine/metrics.py.
+
+	The physics of all rooms live in one PhysicsWorld, stepped in a single
+	batch per tick. Each room is only broadcast on its snapshot ticks.
+	"""
+
+	TICK_RATE = 60
+
+	# Ticks we are willing to replay after a stall before giving up on them
+	MAX_CATCHUP_TICKS = 5
+
+	def __init__(self, tick_rate=TICK_RATE):
+		self.tick_rate = tick_rate
+		self.dt = 1 / tick_rate
+
+		self.rooms = {}
+		self.task = None
+		# Enough ball history to rewind any player by MAX_REWIND
+		self.world = PhysicsWorld(history=math.ceil(MAX_REWIND * tick_rate) + 1)
+
+		self.tick = 0
+		# Server time in ms of the current tick, stamped on the snapshots it sends
+		self.tick_time = 0
+		self.overruns = 0
+		self.skipped_ticks = 0
+		self.last_overrun_log = 0
+
+	def add(self, actor):
+		"""Start stepping a room on the next frame"""
+		actor.slot = self.world.add_room(actor.map_name, actor.player_count, actor.state.sides())
+		self.rooms[actor.room_name] = actor
+		if self.task is None or self.task.done():
+			self.task = asyncio.create_task(self.run())
+
+	def remove(self, actor):
+		if self.rooms.get(actor.room_name) is actor:
+			del self.rooms[actor.room_name]
+		if actor.slot is not None:
+			self.world.remove_room(actor.slot)
+			actor.slot = None
+
+	async def run(self):
+		"""Drive every room until none are left"""
+		loop = asyncio.get_running_loop()
+		accumulator = 0
+		last = loop.time()
+		# When the current sleep should end
+		due = None
+
+		try:
+			while self.rooms:
+				now = loop.time()
+				accumulator += now - last
+				last = now
+				if due is not None:
+					metrics.tick_lateness.observe(max(0, now - due))
+
+				steps = 0
+				while accumulator >= self.dt and steps < self.MAX_CATCHUP_TICKS:
+					started = time.perf_counter()
+					await self.step_rooms()
+					metrics.tick_duration.observe(time.perf_counter() - started)
+					accumulator -= self.dt
+					steps += 1
+
+				# Too far behind to catch up, drop the backlog
+				if accumulator >= self.dt:
+					skipped = int(accumulator // self.dt)
+					self.skipped_ticks += skipped
+					accumulator -= skipped * self.dt
+
+				frame_time = loop.time() - now
+				if frame_time > self.dt:
+					self.report_overrun(frame_time, steps)
+
+				# Sleep until the accumulator holds the next tick
+				delay = max(0, self.dt - accumulator - (loop.time() - last))
+				due = loop.time() + delay
+				await asyncio.sleep(delay)
+		except asyncio.CancelledError:
+			pass
+		except Exception as e:
+			import traceback
+			logger.error(f"Tick scheduler error: {str(e)}\n{traceback.format_exc()}")
+		finally:
+			self.task = None
+
+	async def step_rooms(self):
+		"""Advance every room by one tick, then broadcast all frames together"""
+		self.tick += 1
+		self.tick_time = time.time() * 1000
+		rooms = list(self.rooms.values())
+
+		for actor in rooms:
+			try:
+				actor.process_inputs()
+			except Exception as e:
+				self.fail(actor, e)
+
+		scored = {}
+		for slot, winner, loser in self.world.step(self.dt):
+			scored.setdefault(slot, []).append((winner, loser))
+
+		for actor in rooms:
+			if actor.slot is None:
+				continue
+			try:
+				actor.step(scored.get(actor.slot, ()))
+			except Exception as e:
+				self.fail(actor, e)
+
+		rooms = [
+			actor for actor in rooms
+			if not actor.finished and self.rooms.get(actor.room_name) is actor and actor.snapshot_due()
+		]
+
+		started = time.perf_counter()
+		results = await asyncio.gather(
+			*(actor.broadcast_state() for actor in rooms),
+			return_exceptions=True
+		)
+		if rooms:
+			metrics.broadcast_duration.observe(time.perf_counter() - started)
+		for actor, result in zip(rooms, results):
+			if isinstance(result, Exception):
+				logger.error(f"Broadcast failed for room {actor.room_name}: {result}")
+
+	def fail(self, actor, error):
+		"""Stop stepping a room whose tick raised and end its game, the others keep going"""
+		import traceback
+		logger.error(f"Game loop error in room {actor.room_name}: {str(error)}\n{traceback.format_exc()}")
+		self.remove(actor)
+		if not actor.finish_task:
+			actor.finish_task = asyncio.create_task(actor.abort(error))
+
+	def report_overrun(self, frame_time, steps):
+		self.overruns += 1
+
+		# Log at most once per second, the counter keeps the exact number
+		now = time.monotonic()
+		if now - self.last_overrun_log >= 1:
+			self.last_overrun_log = now
+			logger.warning(
+				f"Tick overrun: frame took {frame_time * 1000:.1f}ms for {steps} tick(s) "
+				f"of {len(self.rooms)} rooms (budget {self.dt * 1000:.1f}ms, "
+				f"{self.overruns} overruns, {self.skipped_ticks} ticks skipped)"
+			)
+
+
+# One scheduler per worker process
+scheduler = TickScheduler(getattr(settings, 'GAME_TICK_RATE', TickScheduler.TICK_RATE))
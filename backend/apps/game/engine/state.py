@@ -0,0 +1,174 @@
+from apps.game.engine.physics import SIDES, NO_SIDE
+
+# Paddle size as {'x', 'y'}: left/right paddles stand upright, bottom/top lie flat
+PADDLE_SIZES = ((1, 8), (1, 8), (8, 1), (8, 1))
+BALL_SIZE = {'x': 1, 'y': 1}
+
+
+class Player:
+	__slots__ = ('id', 'username', 'side', 'is_host', 'is_ready')
+
+	def __init__(self, id, username, side, is_host=False, is_ready=True):
+		self.id = id
+		self.username = username
+		# Index in SIDES
+		self.side = side
+		self.is_host = is_host
+		self.is_ready = is_ready
+
+	@property
+	def position(self):
+		return SIDES[self.side]
+
+	def to_dict(self):
+		return {
+			'id': self.id,
+			'username': self.username,
+			'position': SIDES[self.side],
+			'is_host': self.is_host,
+			'is_ready': self.is_ready,
+		}
+
+
+class Paddle:
+	"""The paddle and score of one side in play"""
+
+	__slots__ = ('position', 'rotation', 'score', 'seq')
+
+	def __init__(self, position=0, rotation=0, score=0):
+		self.position = position
+		self.rotation = rotation
+		self.score = score
+		# Sequence number of the last input applied, 0 before the first numbered one
+		self.seq = 0
+
+
+class GameState:
+	"""
+	Live state of one room.
+
+	Paddles are indexed by side (their index in SIDES, None for sides not in
+	play) and players are keyed by their id as a string, so the tick never
+	searches or walks nested dicts. to_dict() builds the JSON shape clients
+	know, only when a frame or checkpoint needs it. The parts that only
+	change with the roster are built once per roster, so players must be
+	added, removed or made host through the methods here.
+	"""
+
+	__slots__ = (
+		'players', 'paddles',
+		'ball_x', 'ball_y', 'speed_x', 'speed_y',
+		'last_winner', 'last_loser',
+		'roster',
+	)
+
+	def __init__(self):
+		# In joining order, the first player is the host after a reassignment
+		self.players = {}
+		self.paddles = [None] * len(SIDES)
+		self.ball_x = self.ball_y = 0.0
+		self.speed_x = self.speed_y = 0.0
+		self.last_winner = NO_SIDE
+		self.last_loser = NO_SIDE
+		# JSON players and paddleSize of the current roster, None once it changed
+		self.roster = None
+
+	def get_player(self, player_id):
+		return self.players.get(str(player_id))
+
+	def add_player(self, player_id, username, side):
+		"""Add a player and their paddle, None if they were already in"""
+		if str(player_id) in self.players:
+			return None
+
+		player = Player(player_id, username, SIDES.index(side), is_host=not self.players)
+		self.players[str(player_id)] = player
+		self.paddles[player.side] = Paddle()
+		self.roster = None
+		return player
+
+	def remove_player(self, player_id):
+		"""Remove a player and their paddle, None if they were not in"""
+		player = self.players.pop(str(player_id), None)
+		if player:
+			self.paddles[player.side] = None
+			self.roster = None
+		return player
+
+	def set_host(self, host):
+		for player in self.players.values():
+			player.is_host = player is host
+		self.roster = None
+
+	def sides(self):
+		"""Names of the sides in play"""
+		return [side for side, paddle in zip(SIDES, self.paddles) if paddle]
+
+	def scores(self):
+		"""Score per side name, like the 'score' field of the JSON state"""
+		return {side: paddle.score for side, paddle in zip(SIDES, self.paddles) if paddle}
+
+	def acks(self):
+		"""Last input applied per side name, for the sides that sent numbered inputs"""
+		return {side: paddle.seq for side, paddle in zip(SIDES, self.paddles) if paddle and paddle.seq}
+
+	def set_ball(self, x, y, speed_x, speed_y):
+		self.ball_x = x
+		self.ball_y = y
+		self.speed_x = speed_x
+		self.speed_y = speed_y
+
+	def to_dict(self):
+		"""The state in its JSON shape, as sent to clients. Roster parts are shared between calls, do not modify."""
+		if self.roster is None:
+			self.roster = (
+				[player.to_dict() for player in self.players.values()],
+				{
+					SIDES[side]: {'x': PADDLE_SIZES[side][0], 'y': PADDLE_SIZES[side][1]}
+					for side, paddle in enumerate(self.paddles) if paddle
+				},
+			)
+		players, paddle_size = self.roster
+
+		return {
+			'score': self.scores(),
+			'players': players,
+			'settings': {
+				'paddleSize': paddle_size,
+				'paddleLoc': {
+					side: {'position': paddle.position, 'rotation': paddle.rotation}
+					for side, paddle in zip(SIDES, self.paddles) if paddle
+				},
+			},
+			'pongLogic': {
+				'ballPos': {'x': self.ball_x, 'y': self.ball_y},
+				'ballSpeed': {'x': self.speed_x, 'y': self.speed_y},
+				'ballSize': dict(BALL_SIZE),
+				'lastWinner': SIDES[self.last_winner] if self.last_winner != NO_SIDE else None,
+				'lastLoser': SIDES[self.last_loser] if self.last_loser != NO_SIDE else None,
+			},
+		}
+
+	@classmethod
+	def from_dict(cls, data):
+		"""Rebuild a state from its JSON shape, pongLogic may be left out"""
+		state = cls()
+		for player in data['players']:
+			side = SIDES.index(player['position'])
+			state.players[str(player['id'])] = Player(
+				player['id'], player['username'], side, player['is_host'], player['is_ready'],
+			)
+
+		score = data.get('score', {})
+		for side, location in data['settings']['paddleLoc'].items():
+			state.paddles[SIDES.index(side)] = Paddle(location['position'], location['rotation'], score.get(side, 0))
+
+		pong_logic = data.get('pongLogic')
+		if pong_logic:
+			state.set_ball(
+				pong_logic['ballPos']['x'], pong_logic['ballPos']['y'],
+				pong_logic['ballSpeed']['x'], pong_logic['ballSpeed']['y'],
+			)
+			state.last_winner = SIDES.index(pong_logic['lastWinner']) if pong_logic['lastWinner'] else NO_SIDE
+			state.last_loser = SIDES.index(pong_logic['lastLoser']) if pong_logic['lastLoser'] else NO_SIDE
+		return state
@@ -0,0 +1,437 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from apps.game.models.game import GameRoom
+from apps.game.engine.actor import RoomActor
+from apps.game.engine.registry import make_registry
+from apps.game.engine.checkpoint import make_checkpoint_store
+from apps.game.engine.latency import LatencyProbe
+from apps.game.engine.outbound import OutboundQueue
+from apps.game.engine.scheduler import scheduler
+from apps.game.engine import metrics
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# RoomActor methods other workers may call on the rooms this one owns
+ROOM_COMMANDS = ('join', 'leave', 'submit', 'start_game', 'spectate', 'unspectate', 'set_latency')
+
+
+class RemoteRoom:
+	"""
+	A room owned by another worker, with the same commands as RoomActor.
+	Each call is sent to the owner's command channel, its frames come back
+	through the room groups like for local sockets.
+	"""
+
+	def __init__(self, owner, config):
+		self.owner = owner
+		self.config = config
+
+	async def call(self, op, **args):
+		await get_channel_layer().send(self.owner, {
+			'type': 'room.command',
+			'room': self.config,
+			'op': op,
+			'args': args,
+		})
+
+	async def join(self, player_data, frame_format, in_progress):
+		await self.call('join', player_data=player_data, frame_format=frame_format, in_progress=in_progress)
+
+	async def leave(self, player_id, frame_format):
+		await self.call('leave', player_id=player_id, frame_format=frame_format)
+
+	async def submit(self, side, data):
+		await self.call('submit', side=side, data=data)
+
+	async def start_game(self, player_id, reply_channel):
+		await self.call('start_game', player_id=player_id, reply_channel=reply_channel)
+
+	async def spectate(self, frame_format, reply_channel):
+		await self.call('spectate', frame_format=frame_format, reply_channel=reply_channel)
+
+	async def unspectate(self, frame_format):
+		await self.call('unspectate', frame_format=frame_format)
+
+	async def set_latency(self, side, rtt):
+		await self.call('set_latency', side=side, rtt=rtt)
+
+
+class GameWorker:
+	"""
+	This process as one shard of the live game rooms.
+
+	A room is owned by the worker that claimed it first in the room
+	registry, and only the owner runs its actor. Sockets of the room that
+	land on another worker get a RemoteRoom, which forwards their commands
+	to the owner's command channel. Rooms are spread over the workers by
+	wherever their first player connects, so capacity grows with the number
+	of daphne processes.
+
+	Claims are refreshed every HEARTBEAT seconds and released once the
+	room's actor is gone.
+
+	Running rooms are checkpointed every CHECKPOINT_INTERVAL seconds. On
+	start and on every heartbeat the worker claims the checkpointed rooms
+	nobody owns anymore, those of a crashed or redeployed worker, and
+	restores them.
+
+	A draining worker (SIGUSR1 or `manage.py drain`) refuses new game and
+	tournament sockets and keeps ticking its rooms until they end or
+	DRAIN_TIMEOUT passes. The rooms still running then are checkpointed
+	and handed off, every socket is closed with 1012 so clients reconnect
+	to another worker, and the process exits. Its status, with drain
+	progress and metrics, is announced in the registry every heartbeat.
+	"""
+
+	HEARTBEAT = 10
+	CHECKPOINT_INTERVAL = 1
+	DRAIN_TIMEOUT = 300
+
+	def __init__(self):
+		self.registry = make_registry()
+		self.checkpoints = make_checkpoint_store()
+		self.channel_layer = None
+		# Command channel, also the worker's id in the registry
+		self.channel_name = None
+		self.started = None
+		self.tasks = []
+
+		# Rooms claimed by this worker
+		self.owned = set()
+		# Last command task per room, commands of a room run one after the other
+		self.room_tasks = {}
+
+		# Channels of every socket connected to this process
+		self.sockets = set()
+
+		self.draining = False
+		self.drain_deadline = None
+		# Set once the rooms are handed off, sockets closing from then on are not players leaving
+		self.stopping = False
+
+	def start_with_server(self):
+		"""
+		Start along with the daphne server of this process, so checkpointed
+		rooms are recovered without waiting for a socket. Without daphne,
+		like under the test client, the first socket starts the worker.
+		"""
+		reactor = sys.modules.get('twisted.internet.reactor')
+		if reactor is not None:
+			reactor.callWhenRunning(self.start_in_background)
+
+	def start_in_background(self):
+		def done(task):
+			if not task.cancelled() and task.exception():
+				logger.error(f"Game worker failed to start: {task.exception()}")
+
+		# daphne made the reactor's loop the current one
+		asyncio.ensure_future(self.ensure_started()).add_done_callback(done)
+
+	async def ensure_started(self):
+		if self.started is None:
+			self.started = asyncio.ensure_future(self.start())
+		await asyncio.shield(self.started)
+
+	async def start(self):
+		self.channel_layer = get_channel_layer()
+		self.channel_name = await self.channel_layer.new_channel()
+		self.tasks = [
+			asyncio.create_task(self.serve()),
+			asyncio.create_task(self.heartbeat()),
+			asyncio.create_task(self.save_checkpoints()),
+		]
+		try:
+			asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.drain)
+		except (NotImplementedError, RuntimeError, ValueError):
+			logger.warning("Cannot install the SIGUSR1 drain handler, use manage.py drain")
+		logger.info(f"Game worker listening on {self.channel_name}")
+		await self.announce()
+		await self.recover()
+
+	async def open_room(self, config):
+		"""The room's actor if this worker owns it or could claim it, a RemoteRoom otherwise"""
+		await self.ensure_started()
+
+		owner = await self.registry.claim(config['room_name'], self.channel_name)
+		if owner == self.channel_name:
+			self.owned.add(config['room_name'])
+			return await self.create_room(config)
+
+		logger.info(f"Room {config['room_name']} is owned by {owner}, forwarding")
+		return RemoteRoom(owner, config)
+
+	async def serve(self):
+		"""Run the commands other workers forward to our rooms"""
+		while True:
+			try:
+				message = await self.channel_layer.receive(self.channel_name)
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				logger.error(f"Game worker receive failed: {str(e)}")
+				await asyncio.sleep(1)
+				continue
+
+			if message.get('type') == 'worker.drain':
+				self.drain(message.get('timeout'))
+				continue
+
+			if message.get('op') not in ROOM_COMMANDS:
+				logger.warning(f"Unknown room command: {message.get('op')}")
+				continue
+			self.run_in_order(message['room']['room_name'], self.run_command(message))
+
+	def run_in_order(self, room_name, command):
+		previous = self.room_tasks.get(room_name)
+
+		async def run():
+			if previous:
+				await asyncio.wait([previous])
+			await command
+
+		task = asyncio.create_task(run())
+		self.room_tasks[room_name] = task
+
+		def done(task):
+			if self.room_tasks.get(room_name) is task:
+				del self.room_tasks[room_name]
+			if not task.cancelled() and task.exception():
+				logger.error(f"Room command failed in {room_name}: {task.exception()}")
+
+		task.add_done_callback(done)
+
+	async def run_command(self, message):
+		config = message['room']
+		room_name = config['room_name']
+
+		actor = RoomActor.active_rooms.get(room_name)
+		if actor is None:
+			# Commands for a room that already ended have nothing left to do
+			if message['op'] != 'join':
+				return
+
+			owner = await self.registry.claim(room_name, self.channel_name)
+			if owner != self.channel_name:
+				# The room changed hands while the command was on its way
+				await self.channel_layer.send(owner, message)
+				return
+			self.owned.add(room_name)
+			actor = await self.create_room(config)
+
+		await getattr(actor, message['op'])(**message['args'])
+
+	async def create_room(self, config):
+		"""Actor of a room we own, restored if another worker handed it off"""
+		room_name = config['room_name']
+		if room_name not in RoomActor.active_rooms:
+			checkpoint = await self.checkpoints.load(room_name)
+			if checkpoint and await self.in_progress(room_name):
+				actor = RoomActor.restore(checkpoint)
+				await self.restart_room(actor, self.channel_name)
+				return actor
+		return RoomActor.for_room(**config)
+
+	async def heartbeat(self):
+		"""Keep our claims alive and give up the rooms whose actor is gone"""
+		while True:
+			await asyncio.sleep(self.HEARTBEAT)
+			try:
+				for room_name in [name for name in self.owned if name not in RoomActor.active_rooms]:
+					self.owned.discard(room_name)
+					await self.checkpoints.delete(room_name)
+					await self.registry.release(room_name, self.channel_name)
+				if self.owned:
+					await self.registry.refresh(self.owned, self.channel_name)
+			except Exception as e:
+				logger.error(f"Room registry heartbeat failed: {str(e)}")
+			await self.announce()
+			if not self.draining:
+				await self.recover()
+
+	def live_rooms(self):
+		"""Owned rooms with a game in progress, running or restored and waiting for its players"""
+		return [
+			actor for room_name, actor in list(RoomActor.active_rooms.items())
+			if room_name in self.owned and (actor.running or actor.awaiting is not None)
+		]
+
+	def status(self):
+		return {
+			'host': socket.gethostname(),
+			'pid': os.getpid(),
+			'rooms': len(self.live_rooms()),
+			'sockets': len(self.sockets),
+			'draining': self.draining,
+			'drain_deadline': self.drain_deadline,
+			'stopping': self.stopping,
+			'latency': LatencyProbe.summary(),
+			'metrics': self.metrics(),
+		}
+
+	def metrics(self):
+		"""Metric families of this worker and of the rooms it runs, see engine/metrics.py"""
+		rooms = list(RoomActor.active_rooms.values())
+		latency = LatencyProbe.summary()
+		return [
+			metrics.tick_duration.family(),
+			metrics.tick_lateness.family(),
+			metrics.broadcast_duration.family(),
+			metrics.layer_send.family(),
+			metrics.frame_delivery.family(),
+			metrics.family('game_ticks_total', 'counter', "Ticks stepped by the scheduler", [({}, scheduler.tick)]),
+			metrics.family('game_tick_overruns_total', 'counter', "Frames that took longer than a tick", [({}, scheduler.overruns)]),
+			metrics.family('game_ticks_skipped_total', 'counter', "Ticks dropped after a stall", [({}, scheduler.skipped_ticks)]),
+			metrics.family('game_rooms', 'gauge', "Room actors of the worker, lobbies included", [({}, len(rooms))]),
+			metrics.family('game_live_rooms', 'gauge', "Owned rooms with a game in progress", [({}, len(self.live_rooms()))]),
+			metrics.family('game_connections', 'gauge', "Open WebSocket connections by consumer", [
+				({'consumer': consumer}, count) for consumer, count in sorted(metrics.connections.items())
+			]),
+			metrics.family('game_outbound_messages_total', 'counter', "Messages written to game sockets, frames and events", [({}, OutboundQueue.total_written)]),
+			metrics.family('game_frames_dropped_total', 'counter', "Stale frames dropped for slow game sockets", [({}, OutboundQueue.total_dropped)]),
+			metrics.family('game_client_rtt_milliseconds', 'gauge', "Smoothed round trip time of the measured connections", [
+				({'quantile': quantile}, latency[key]) for quantile, key in (('0.5', 'rtt_p50'), ('0.95', 'rtt_p95'), ('1', 'rtt_max'))
+				if key in latency
+			]),
+			metrics.family('game_draining', 'gauge', "1 while the worker drains", [({}, int(self.draining))]),
+			metrics.family('process_cpu_seconds_total', 'counter', "CPU time used by the worker process", [({}, time.process_time())]),
+			# Per room, only while its actor lives on this worker
+			metrics.family('game_room_players', 'gauge', "Players in the room", [
+				({'room': actor.room_name}, len(actor.state.players)) for actor in rooms
+			]),
+			metrics.family('game_room_spectators', 'gauge', "Spectators of the room", [
+				({'room': actor.room_name}, sum(actor.spectators.values())) for actor in rooms
+			]),
+			metrics.family('game_room_frames_total', 'counter', "Frames the room sent to its groups, one per format", [
+				({'room': actor.room_name}, actor.frames_sent) for actor in rooms
+			]),
+			metrics.family('game_room_broadcast_seconds_total', 'counter', "Time the room spent broadcasting its frames", [
+				({'room': actor.room_name}, actor.broadcast_time) for actor in rooms
+			]),
+		]
+
+	async def announce(self):
+		try:
+			await self.registry.announce(self.channel_name, self.status())
+		except Exception as e:
+			logger.error(f"Announcing worker status failed: {str(e)}")
+
+	# Drain
+
+	def drain(self, timeout=None):
+		"""Stop taking new players and leave once the rooms of this worker are done or handed off"""
+		if self.draining:
+			return
+		self.draining = True
+		self.drain_deadline = time.time() + (timeout or self.DRAIN_TIMEOUT)
+		self.tasks.append(asyncio.create_task(self.run_drain()))
+
+	async def run_drain(self):
+		logger.info(f"Draining game worker {self.channel_name}, {len(self.live_rooms())} rooms in progress")
+		while self.live_rooms() and time.time() < self.drain_deadline:
+			await self.announce()
+			await asyncio.sleep(1)
+
+		self.stopping = True
+		try:
+			await self.hand_off()
+		except Exception as e:
+			logger.error(f"Handing off rooms failed: {str(e)}")
+		await self.announce()
+
+		# Clients reconnect on 1012 and land on another worker
+		for channel_name in list(self.sockets):
+			await self.channel_layer.send(channel_name, {'type': 'server.restart'})
+		await asyncio.sleep(1)
+
+		logger.info(f"Game worker {self.channel_name} drained, exiting")
+		os.kill(os.getpid(), signal.SIGTERM)
+
+	async def hand_off(self):
+		"""Checkpoint the rooms still in progress and give them up for other workers to restore"""
+		actors = [actor for actor in self.live_rooms() if not actor.finish_task]
+		# Given up first, the heartbeat would otherwise delete the checkpoints of rooms without actor
+		owned, self.owned = self.owned, set()
+
+		if actors:
+			await self.checkpoints.save({actor.room_name: actor.checkpoint() for actor in actors})
+		for actor in actors:
+			await actor.hand_off()
+
+		for room_name in owned:
+			await self.registry.release(room_name, self.channel_name)
+
+		# Their sockets on other workers still forward to us, they reconnect like ours
+		for actor in actors:
+			await self.restart_room(actor)
+		logger.info(f"Handed off {len(actors)} rooms")
+
+	async def restart_room(self, actor, owner=None):
+		"""
+		Close the sockets of a room that changed owner with 1012, wherever
+		they are, so they reconnect to its new owner. Players join it again
+		and spectators spectate again. Sockets already talking to owner, if
+		given, are kept.
+		"""
+		for group in (actor.group_name, actor.spectate_group):
+			await self.channel_layer.group_send(group, {'type': 'server.restart', 'owner': owner})
+
+	# Checkpoints
+
+	async def save_checkpoints(self):
+		"""Save the running rooms of this worker"""
+		while True:
+			await asyncio.sleep(self.CHECKPOINT_INTERVAL)
+			checkpoints = {
+				room_name: actor.checkpoint()
+				for room_name, actor in list(RoomActor.active_rooms.items())
+				if room_name in self.owned and actor.running and actor.slot is not None
+			}
+			if not checkpoints:
+				continue
+			try:
+				await self.checkpoints.save(checkpoints)
+			except Exception as e:
+				logger.error(f"Saving room checkpoints failed: {str(e)}")
+
+	async def recover(self):
+		"""Restore the checkpointed rooms no live worker owns"""
+		try:
+			checkpoints = await self.checkpoints.load_all()
+		except Exception as e:
+			logger.error(f"Loading room checkpoints failed: {str(e)}")
+			return
+
+		for room_name, checkpoint in checkpoints.items():
+			if room_name in RoomActor.active_rooms:
+				continue
+			try:
+				owner = await self.registry.claim(room_name, self.channel_name)
+				if owner != self.channel_name:
+					continue
+				self.owned.add(room_name)
+
+				# The game may have ended before its checkpoint was removed
+				if not await self.in_progress(room_name):
+					await self.checkpoints.delete(room_name)
+					continue
+				actor = RoomActor.restore(checkpoint)
+				# Sockets on the other workers still forward to the previous owner
+				await self.restart_room(actor, self.channel_name)
+			except Exception as e:
+				logger.error(f"Restoring room {room_name} failed: {str(e)}")
+
+	@database_sync_to_async
+	def in_progress(self, room_name):
+		return GameRoom.objects.filter(name=room_name, status='in_progress').exists()
+
+
+# One worker per process
+worker = GameWorker()
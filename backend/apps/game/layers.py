@@ -0,0 +1,219 @@
+import asyncio
+import collections
+import logging
+import time
+from channels_redis.core import RedisChannelLayer
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Same script as RedisChannelLayer.group_send: push one message per channel key, skipping full channels
+GROUP_SEND_LUA = """
+	local over_capacity = 0
+	local current_time = ARGV[#ARGV - 1]
+	local expiry = ARGV[#ARGV]
+	for i=1,#KEYS do
+		if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+			redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+			redis.call('EXPIRE', KEYS[i], expiry)
+		else
+			over_capacity = over_capacity + 1
+		end
+	end
+	return over_capacity
+"""
+
+
+class HybridChannelLayer(RedisChannelLayer):
+	"""
+	Redis channel layer that delivers group messages to members living in
+	this process straight from memory.
+
+	Group membership is still stored in Redis, so other processes see every
+	member and keep sending to ours through Redis as usual. Sending to a
+	group puts the message in the receive buffer of each local member and
+	only goes through Redis for the members of other processes: a room whose
+	sockets all sit on one worker costs a single Redis round trip per send,
+	to read the member list, instead of three.
+
+	Messages that do come through Redis for this process are popped in
+	batches by one reader task and sorted into the same buffers, so
+	receivers only ever wait on their buffer and see local and remote
+	messages alike. The Redis key of a process is shared by all its
+	channels, so it may queue PROCESS_CAPACITY messages before senders
+	start dropping them.
+
+	Local delivery relies on consumers leaving their groups on disconnect,
+	like every consumer of this project does.
+	"""
+
+	# Messages the reader takes from Redis per round trip
+	READ_BATCH = 500
+	# Messages a process channel can queue in Redis, it holds those of every channel of the process
+	PROCESS_CAPACITY = 10000
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		# Members of each group that receive through this layer instance
+		self.local_groups = collections.defaultdict(set)
+		# Loop the local channels receive on, their buffers are not thread safe
+		self.local_loop = None
+		# Reader task per process channel
+		self.readers = {}
+
+	def is_local(self, channel):
+		return '!' in channel and self.non_local_name(channel).endswith(self.client_prefix + '!')
+
+	def get_capacity(self, channel):
+		capacity = super().get_capacity(channel)
+		if '!' in channel:
+			return max(capacity, self.PROCESS_CAPACITY)
+		return capacity
+
+	def deliver(self, channel, message):
+		self.receive_buffer[channel].put_nowait(message)
+
+	async def send(self, channel, message):
+		if self.is_local(channel) and asyncio.get_running_loop() is self.local_loop:
+			self.deliver(channel, message)
+			return
+		await super().send(channel, message)
+
+	async def receive(self, channel):
+		if not self.is_local(channel):
+			return await super().receive(channel)
+
+		self.local_loop = asyncio.get_running_loop()
+		self.start_reader(self.non_local_name(channel))
+
+		queue = self.receive_buffer[channel]
+		try:
+			message = await queue.get()
+		except asyncio.CancelledError:
+			# The consumer is gone, forget its buffer
+			if self.receive_buffer.get(channel) is queue:
+				del self.receive_buffer[channel]
+			raise
+
+		if queue.empty() and self.receive_buffer.get(channel) is queue:
+			del self.receive_buffer[channel]
+		return message
+
+	def start_reader(self, real_channel):
+		reader = self.readers.get(real_channel)
+		if reader is None or reader.done():
+			self.readers[real_channel] = asyncio.create_task(self.read(real_channel))
+
+	async def read(self, real_channel):
+		"""Sort the messages sent to this process through Redis into the receive buffers"""
+		while True:
+			try:
+				messages = await self.receive_batch(real_channel)
+			except asyncio.CancelledError:
+				raise
+			except RedisTimeoutError:
+				# Nothing arrived before the connection timed out, poll again
+				continue
+			except Exception as e:
+				logger.error(f"Channel layer reader for {real_channel} failed: {str(e)}")
+				await asyncio.sleep(1)
+				continue
+
+			for message in messages:
+				message_channel = message.pop('__asgi_channel__', real_channel)
+				if isinstance(message_channel, list):
+					for channel in message_channel:
+						self.deliver(channel, message)
+				else:
+					self.deliver(message_channel, message)
+
+	async def receive_batch(self, real_channel):
+		"""
+		Wait for the next message of a process channel and take up to
+		READ_BATCH queued behind it, in two round trips. receive_single()
+		costs four per message, so a busy process fell behind and its Redis
+		key filled up until senders dropped messages.
+
+		Unlike receive_single() there is no backup queue: the reader is only
+		cancelled when the layer closes, and what it holds then has no receiver.
+		"""
+		key = self.prefix + real_channel
+		connection = self.connection(self.consistent_hash(real_channel))
+		result = await connection.bzpopmin(key, timeout=self.brpop_timeout)
+		if result is None:
+			return []
+
+		members = [result[1]]
+		members.extend(member for member, _ in await connection.zpopmin(key, self.READ_BATCH - 1))
+		return [self.deserialize(member) for member in members]
+
+	async def close_pools(self):
+		for reader in self.readers.values():
+			reader.cancel()
+		await asyncio.gather(*self.readers.values(), return_exceptions=True)
+		self.readers = {}
+		await super().close_pools()
+
+	async def group_add(self, group, channel):
+		await super().group_add(group, channel)
+		if self.is_local(channel):
+			self.local_groups[group].add(channel)
+
+	async def group_discard(self, group, channel):
+		await super().group_discard(group, channel)
+		members = self.local_groups.get(group)
+		if members is not None:
+			members.discard(channel)
+			if not members:
+				del self.local_groups[group]
+
+	async def group_send(self, group, message):
+		assert self.valid_group_name(group), "Group name not valid"
+
+		# Called from another loop (async_to_sync in a thread), let Redis deliver to everyone
+		if asyncio.get_running_loop() is not self.local_loop:
+			return await super().group_send(group, message)
+
+		local = self.local_groups.get(group, ())
+		for channel in local:
+			self.deliver(channel, message)
+
+		# Read the members and drop expired ones in one round trip
+		key = self._group_key(group)
+		connection = self.connection(self.consistent_hash(group))
+		async with connection.pipeline(transaction=False) as pipe:
+			pipe.zremrangebyscore(key, min=0, max=int(time.time()) - self.group_expiry)
+			pipe.zrange(key, 0, -1)
+			_, members = await pipe.execute()
+
+		remote = [name for name in (member.decode('utf8') for member in members) if name not in local]
+		if remote:
+			await self.send_to_channels(group, remote, message)
+
+	async def send_to_channels(self, group, channel_names, message):
+		"""Push a message to channels of other processes, the way RedisChannelLayer.group_send does"""
+		(
+			connection_to_channel_keys,
+			channel_keys_to_message,
+			channel_keys_to_capacity,
+		) = self._map_channel_keys_to_connection(channel_names, message)
+
+		for connection_index, channel_redis_keys in connection_to_channel_keys.items():
+			connection = self.connection(connection_index)
+
+			# Discard old messages based on expiry
+			async with connection.pipeline(transaction=False) as pipe:
+				for key in channel_redis_keys:
+					pipe.zremrangebyscore(key, min=0, max=int(time.time()) - int(self.expiry))
+				await pipe.execute()
+
+			args = [channel_keys_to_message[key] for key in channel_redis_keys]
+			args += [channel_keys_to_capacity[key] for key in channel_redis_keys]
+			args += [time.time(), self.expiry]
+
+			over_capacity = await connection.eval(
+				GROUP_SEND_LUA, len(channel_redis_keys), *channel_redis_keys, *args
+			)
+			if over_capacity > 0:
+				logger.info(f"{over_capacity} of {len(channel_names)} channels over capacity in group {group}")
@@ -0,0 +1,124 @@
+import asyncio
+import statistics
+import time
+from channels_redis.utils import create_pool, decode_hosts
+from redis.asyncio import Redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+# Channel layers the benchmark can compare, same names as the CHANNEL_LAYER env var
+LAYERS = settings.CHANNEL_LAYER_BACKENDS
+
+
+def percentile(values, fraction):
+	if not values:
+		return 0
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+	help = (
+		"Measure group_send delivery latency and Redis load of channel layers against the "
+		"configured Redis, with game-like traffic: N rooms sending a frame to their members "
+		"R times per second"
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--layers', nargs='+', choices=LAYERS, default=list(LAYERS))
+		parser.add_argument('--rooms', type=int, default=50)
+		parser.add_argument('--clients', type=int, default=2, help="Members per room")
+		parser.add_argument('--workers', type=int, default=1, help="Layer instances the members are spread over, like daphne processes")
+		parser.add_argument('--rate', type=int, default=60, help="Frames per room and second")
+		parser.add_argument('--duration', type=float, default=10)
+		parser.add_argument('--size', type=int, default=200, help="Frame payload in bytes")
+
+	def handle(self, *args, **options):
+		for name in options['layers']:
+			result = asyncio.run(self.run_layer(LAYERS[name], options))
+			self.stdout.write(
+				f"{name:>8}: p50 {result['p50']:.2f}ms  p99 {result['p99']:.2f}ms  "
+				f"delivered {result['received']}/{result['expected']}  "
+				f"redis {result['ops']:.0f} ops/s, {result['cpu']:.1f}% cpu"
+			)
+
+	def layer_config(self):
+		config = dict(settings.CHANNEL_LAYERS['default'].get('CONFIG', {}))
+		# Own key prefix so flush() only removes what the benchmark created
+		config['prefix'] = 'bench'
+		return config
+
+	def make_layer(self, path):
+		return import_string(path)(**self.layer_config())
+
+	async def redis_stats(self, redis):
+		"""Commands processed and CPU seconds used by Redis so far"""
+		stats = await redis.info('stats')
+		cpu = await redis.info('cpu')
+		return stats['total_commands_processed'], cpu['used_cpu_sys'] + cpu['used_cpu_user']
+
+	async def run_layer(self, path, options):
+		layers = [self.make_layer(path) for _ in range(options['workers'])]
+		latencies = []
+		received = 0
+
+		members = []
+		for room in range(options['rooms']):
+			group = f'bench_{room}'
+			for client in range(options['clients']):
+				layer = layers[(room * options['clients'] + client) % len(layers)]
+				channel = await layer.new_channel()
+				await layer.group_add(group, channel)
+				members.append((layer, group, channel))
+
+		async def receive(layer, channel):
+			nonlocal received
+			while True:
+				message = await layer.receive(channel)
+				latencies.append((time.perf_counter() - message['sent']) * 1000)
+				received += 1
+
+		receivers = [asyncio.create_task(receive(layer, channel)) for layer, _, channel in members]
+
+		redis = Redis(connection_pool=create_pool(decode_hosts(self.layer_config().get('hosts'))[0]))
+		ops_before, cpu_before = await self.redis_stats(redis)
+		started = time.perf_counter()
+
+		payload = 'x' * options['size']
+		dt = 1 / options['rate']
+		ticks = int(options['duration'] * options['rate'])
+		for tick in range(ticks):
+			sent = time.perf_counter()
+			await asyncio.gather(*(
+				layers[room % len(layers)].group_send(f'bench_{room}', {
+					'type': 'bench.frame',
+					'sent': sent,
+					'payload': payload,
+				}) for room in range(options['rooms'])
+			))
+			await asyncio.sleep(max(0, started + (tick + 1) * dt - time.perf_counter()))
+
+		# Let the last frames arrive
+		await asyncio.sleep(0.5)
+		elapsed = time.perf_counter() - started
+		ops_after, cpu_after = await self.redis_stats(redis)
+		await redis.aclose()
+
+		for task in receivers:
+			task.cancel()
+		await asyncio.gather(*receivers, return_exceptions=True)
+		for layer, group, channel in members:
+			await layer.group_discard(group, channel)
+		# Also closes the connections of every layer
+		for layer in layers:
+			await layer.flush()
+
+		return {
+			'p50': statistics.median(latencies) if latencies else 0,
+			'p99': percentile(latencies, 0.99),
+			'received': received,
+			'expected': ticks * len(members),
+			'ops': (ops_after - ops_before) / elapsed,
+			'cpu': (cpu_after - cpu_before) / elapsed * 100,
+		}
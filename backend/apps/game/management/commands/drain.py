@@ -0,0 +1,72 @@
+import asyncio
+import time
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+from apps.game.engine.registry import LocalRoomRegistry, make_registry
+
+
+class Command(BaseCommand):
+	help = (
+		"Drain game workers before taking them out of rotation: they refuse new game and "
+		"tournament sockets, let their rooms finish and hand off the rest after the timeout, "
+		"then exit. Without arguments, list the workers and their drain progress."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('workers', nargs='*', help="Command channels, host:pid or pids of the workers to drain")
+		parser.add_argument('--all', action='store_true', help="Drain every worker")
+		parser.add_argument('--timeout', type=float, help="Seconds left to the rooms before they are handed off")
+		parser.add_argument('--wait', action='store_true', help="Report progress until the workers are drained")
+
+	def handle(self, *args, **options):
+		asyncio.run(self.run(options))
+
+	async def run(self, options):
+		registry = make_registry()
+		if isinstance(registry, LocalRoomRegistry):
+			raise CommandError(
+				"GAME_ROOM_REGISTRY is 'local', workers cannot be reached from here: "
+				"send SIGUSR1 to the daphne process instead"
+			)
+
+		workers = await registry.workers()
+		if options['all']:
+			selected = list(workers)
+		else:
+			selected = [self.find(workers, name) for name in options['workers']]
+
+		for channel in selected:
+			await get_channel_layer().send(channel, {'type': 'worker.drain', 'timeout': options['timeout']})
+			self.stdout.write(f"Draining {channel}")
+
+		if not selected or not options['wait']:
+			self.report(workers if not selected else await registry.workers())
+			return
+
+		while True:
+			workers = await registry.workers()
+			self.report({channel: workers[channel] for channel in selected if channel in workers})
+			if all(channel not in workers or workers[channel]['stopping'] for channel in selected):
+				break
+			await asyncio.sleep(2)
+
+	def find(self, workers, name):
+		for channel, status in workers.items():
+			if name in (channel, str(status['pid']), f"{status['host']}:{status['pid']}"):
+				return channel
+		raise CommandError(f"No live worker matches {name}")
+
+	def report(self, workers):
+		for channel, status in sorted(workers.items(), key=lambda item: (item[1]['host'], item[1]['pid'])):
+			if status['stopping']:
+				state = 'drained'
+			elif status['draining']:
+				state = f"draining, {max(0, status['drain_deadline'] - time.time()):.0f}s to hand-off"
+			else:
+				state = 'serving'
+			latency = status.get('latency', {})
+			rtt = f"rtt p50 {latency['rtt_p50']}ms p95 {latency['rtt_p95']}ms  " if latency.get('measured') else ''
+			self.stdout.write(
+				f"{status['host']}:{status['pid']}  {channel}  "
+				f"{status['rooms']} rooms  {status['sockets']} sockets  {rtt}{state}"
+			)
@@ -0,0 +1,596 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import ssl
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from autobahn.asyncio.websocket import WebSocketClientFactory, WebSocketClientProtocol
+from django.core.management.base import BaseCommand, CommandError
+from apps.game.engine.latency import percentile
+from apps.game.engine.physics import SIDES, MOVES_ALONG_Y, paddle_limit
+from apps.game.engine.protocol import SUBPROTOCOLS, STATE_HEADER, INPUT, MSG_STATE, MSG_PADDLE_MOVE
+from apps.game.engine.registry import LocalRoomRegistry, make_registry
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Frame format -> subprotocol the bots ask for, json needs none
+FORMATS = {'json': None, **{frame_format: subprotocol for subprotocol, frame_format in SUBPROTOCOLS.items()}}
+
+# Paddle moved per input and distance to the target under which it stays put, like a held key in control.js
+PADDLE_STEP = 0.8
+DEAD_ZONE = 1.0
+
+# Registrations and logins hash passwords on the server, a few at a time per bot process
+HTTP_CONCURRENCY = 4
+
+
+def cpu_seconds(pid):
+	"""CPU time used so far by a local process, from /proc"""
+	with open(f'/proc/{pid}/stat') as f:
+		fields = f.read().rsplit(')', 1)[1].split()
+	return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class Stats:
+	"""What the bots of one process measured since the last reset"""
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		# Frame arrival minus its server time, in ms
+		self.latencies = []
+		# Difference between the arrival interval and the server time interval of consecutive frames, in ms
+		self.jitters = []
+		# Tick gaps between consecutive frames while the ball moved, lost frames show as multiples
+		self.gaps = Counter()
+		self.frames = 0
+		self.inputs = 0
+		self.games = 0
+		self.errors = 0
+		self.cpu = time.process_time()
+		self.started = time.monotonic()
+
+	def to_dict(self):
+		elapsed = time.monotonic() - self.started
+		return {
+			'latencies': self.latencies,
+			'jitters': self.jitters,
+			'gaps': self.gaps,
+			'frames': self.frames,
+			'inputs': self.inputs,
+			'games': self.games,
+			'errors': self.errors,
+			'cpu': (time.process_time() - self.cpu) / elapsed * 100 if elapsed else 0,
+		}
+
+
+class BotProtocol(WebSocketClientProtocol):
+	"""Hands the socket events of a bot's connection to the Bot"""
+
+	def onOpen(self):
+		self.factory.bot.on_open(self)
+
+	def onMessage(self, payload, isBinary):
+		self.factory.bot.on_message(payload, isBinary)
+
+	def onClose(self, wasClean, code, reason):
+		self.factory.bot.on_close(reason or code)
+
+
+class Bot:
+	"""
+	One simulated player: joins its room's socket with the auth cookie,
+	answers latency pings, starts the game when it is the host and the room
+	is full, then chases the ball with paddle_move inputs at the input rate,
+	like a player holding a key.
+	"""
+
+	def __init__(self, room, user_id, token):
+		self.room = room
+		self.load = room.load
+		self.user_id = user_id
+		self.token = token
+
+		self.protocol = None
+		self.opened = asyncio.get_running_loop().create_future()
+		self.side = None
+		self.position = None
+		self.seq = 0
+		# Offset from the ball this player aims at, redrawn every round
+		self.error = 0
+		self.start_sent = False
+		self.task = None
+
+		# Ball position and whether it moves, from the latest frame
+		self.ball = None
+		self.moving = False
+		# Last delta keyframe, delta frames are relative to it
+		self.keyframe = None
+		# Client clock minus server clock as estimated by the server's pings
+		self.offset = None
+
+		self.last_tick = -1
+		self.last_time = None
+		self.last_arrival = None
+		self.last_moving = False
+
+	async def connect(self):
+		load = self.load
+		subprotocol = FORMATS[load.options['format']]
+		factory = WebSocketClientFactory(
+			f"{load.ws_url}/ws/game/{self.room.name}/",
+			protocols=[subprotocol] if subprotocol else None,
+			headers={'Cookie': f'auth-token={self.token}'},
+		)
+		factory.protocol = BotProtocol
+		# A loaded server can take a while to answer a close
+		factory.setProtocolOptions(closeHandshakeTimeout=5)
+		factory.bot = self
+		await asyncio.get_running_loop().create_connection(factory, load.host, load.port, ssl=load.ssl_context)
+		await self.opened
+		self.task = asyncio.create_task(self.play())
+
+	def close(self):
+		if self.task:
+			self.task.cancel()
+		if self.protocol:
+			self.protocol.sendClose()
+			# Messages still on their way are not answered
+			self.protocol = None
+
+	def send(self, message, binary=False):
+		if self.protocol:
+			self.protocol.sendMessage(message if binary else json.dumps(message).encode(), isBinary=binary)
+
+	# Socket events, from BotProtocol
+
+	def on_open(self, protocol):
+		self.protocol = protocol
+		if not self.opened.done():
+			self.opened.set_result(None)
+
+	def on_close(self, reason):
+		self.protocol = None
+		if self.task:
+			self.task.cancel()
+		if not self.opened.done():
+			self.opened.set_exception(ConnectionError(f"Socket to room {self.room.name} refused: {reason}"))
+		self.room.end(error=f"Socket closed: {reason}")
+
+	def on_message(self, payload, is_binary):
+		if is_binary:
+			self.on_binary(payload)
+			return
+
+		data = json.loads(payload)
+		message_type = data.get('type')
+		if message_type == 'ping':
+			self.offset = data.get('offset')
+			self.send({'type': 'pong', 'id': data['id'], 'client_time': time.time() * 1000})
+		elif message_type == 'game_state_update':
+			self.on_state(data['state'])
+			self.on_frame(data['tick'], data['time'])
+		elif message_type == 'state_keyframe':
+			self.keyframe = data['state']
+			self.on_state(self.keyframe)
+			self.on_frame(data['tick'], data['time'])
+		elif message_type == 'state_delta':
+			self.on_delta(data['delta'])
+			self.on_frame(data['tick'], data['time'])
+		elif message_type == 'which_paddle':
+			self.side = SIDES.index(data['position'])
+		elif message_type == 'started_game':
+			self.room.started.set()
+		elif message_type == 'reset_round':
+			self.aim()
+		elif message_type == 'failed_to_start_game':
+			self.start_sent = False
+		elif message_type == 'game_over':
+			self.room.end(game_over=True)
+		elif message_type == 'error':
+			self.room.end(error=data.get('message'))
+
+	def on_binary(self, data):
+		message_type, tick, server_time, _, _, _, ball_x, ball_y, speed_x, speed_y = STATE_HEADER.unpack_from(data)
+		if message_type != MSG_STATE:
+			return
+		self.ball = (ball_x, ball_y)
+		self.moving = bool(speed_x or speed_y)
+		self.on_frame(tick, server_time)
+
+	def on_state(self, state):
+		logic = state['pongLogic']
+		self.ball = (logic['ballPos']['x'], logic['ballPos']['y'])
+		self.moving = bool(logic['ballSpeed']['x'] or logic['ballSpeed']['y'])
+		self.on_roster(state['players'], state['settings']['paddleLoc'])
+
+	def on_delta(self, delta):
+		base = self.keyframe['pongLogic']
+		logic = delta.get('pongLogic', {})
+		position = {**base['ballPos'], **logic.get('ballPos', {})}
+		speed = {**base['ballSpeed'], **logic.get('ballSpeed', {})}
+		self.ball = (position['x'], position['y'])
+		self.moving = bool(speed['x'] or speed['y'])
+		if 'players' in delta:
+			self.on_roster(delta['players'], self.keyframe['settings']['paddleLoc'])
+
+	def on_roster(self, players, paddles):
+		if self.position is None and self.side is not None and SIDES[self.side] in paddles:
+			self.position = paddles[SIDES[self.side]]['position']
+			self.aim()
+
+		# The host starts the game once everyone is in
+		me = next((player for player in players if player['id'] == self.user_id), None)
+		if me and me['is_host'] and not self.start_sent and len(players) == self.room.player_count:
+			self.start_sent = True
+			self.send({'type': 'start_game'})
+
+	def on_frame(self, tick, server_time):
+		# Binary clients get the roster as JSON with the packed frame of the same tick
+		if tick <= self.last_tick:
+			return
+		arrival = time.time() * 1000
+		stats = self.load.stats
+		stats.frames += 1
+		if self.room.started.is_set():
+			stats.latencies.append(arrival - (self.offset or 0) - server_time)
+			if self.last_time is not None:
+				stats.jitters.append(abs((arrival - self.last_arrival) - (server_time - self.last_time)))
+				# A waiting ball is only sent now and then, gaps after it are not losses
+				if self.last_moving:
+					stats.gaps[tick - self.last_tick] += 1
+		self.last_tick = tick
+		self.last_time = server_time
+		self.last_arrival = arrival
+		self.last_moving = self.moving
+
+	# Inputs
+
+	def aim(self):
+		"""Pick how far off this player hits the next rally, so games end now and then"""
+		self.error = random.gauss(0, self.load.options['aim_error'])
+
+	async def play(self):
+		interval = 1 / self.load.options['input_rate']
+		binary = self.load.options['format'] == 'binary'
+		while True:
+			await asyncio.sleep(interval)
+			if self.ball is None or self.position is None or not self.room.started.is_set():
+				continue
+
+			target = self.ball[1 if MOVES_ALONG_Y[self.side] else 0] + self.error
+			if abs(target - self.position) < DEAD_ZONE:
+				continue
+			limit = paddle_limit(self.side)
+			step = PADDLE_STEP if target > self.position else -PADDLE_STEP
+			self.position = min(max(self.position + step, -limit), limit)
+
+			self.seq += 1
+			self.load.stats.inputs += 1
+			if binary:
+				self.send(INPUT.pack(MSG_PADDLE_MOVE, self.position, 0, self.seq), binary=True)
+			else:
+				self.send({'type': 'paddle_move', 'position': self.position, 'rotation': 0, 'seq': self.seq})
+
+
+class RoomLoad:
+	"""One room slot: creates a room, fills it with bots, and does it again when the game ends"""
+
+	def __init__(self, load, slot):
+		self.load = load
+		self.slot = slot
+		self.player_count = load.options['players']
+		self.name = None
+		self.bots = []
+		# Set once the first game of this slot started, the sweep waits for it
+		self.started = asyncio.Event()
+		self.over = asyncio.Event()
+		# Whether the last game ended on an error rather than a game_over
+		self.failed = False
+		self.stopping = False
+		self.task = None
+
+	def end(self, game_over=False, error=None):
+		if self.over.is_set():
+			return
+		if game_over:
+			self.load.stats.games += 1
+		elif error and not self.stopping:
+			self.failed = True
+			self.load.stats.errors += 1
+			self.load.log(f"Room {self.name}: {error}")
+		self.over.set()
+
+	def stop(self):
+		self.stopping = True
+		self.over.set()
+
+	async def run(self, delay):
+		await asyncio.sleep(delay)
+		while not self.stopping:
+			self.over.clear()
+			self.failed = False
+			try:
+				await self.play()
+			except Exception as e:
+				self.failed = True
+				self.load.stats.errors += 1
+				self.load.log(f"Room slot {self.slot}: {str(e)}")
+			finally:
+				for bot in self.bots:
+					bot.close()
+				self.bots = []
+			# Do not hammer a server that turns rooms away
+			if self.failed:
+				await asyncio.sleep(1)
+
+	async def play(self):
+		users = await asyncio.gather(*(self.load.user(self.slot, index) for index in range(self.player_count)))
+		room = await self.load.api('POST', '/api/game/create/', {
+			'config': {'map': self.load.options['map'], 'players': self.player_count},
+		}, token=users[0][1])
+		self.name = room['room_name']
+
+		for user_id, token in users:
+			bot = Bot(self, user_id, token)
+			self.bots.append(bot)
+			await bot.connect()
+		await self.over.wait()
+
+
+class BotProcess:
+	"""The bots of one load generator process, driven by the sweep in the parent"""
+
+	def __init__(self, options, index, processes):
+		self.options = options
+		self.index = index
+		self.processes = processes
+		self.stats = Stats()
+		self.rooms = []
+		# Room slots of the sweep so far, over every process
+		self.total = 0
+		self.users = {}
+		self.http = asyncio.Semaphore(HTTP_CONCURRENCY)
+
+		url = urllib.parse.urlsplit(options['url'])
+		self.base_url = f"{url.scheme}://{url.netloc}"
+		self.ws_url = f"{'wss' if url.scheme == 'https' else 'ws'}://{url.netloc}"
+		self.host = url.hostname
+		self.port = url.port or (443 if url.scheme == 'https' else 80)
+		self.ssl_context = None
+		if url.scheme == 'https':
+			self.ssl_context = ssl.create_default_context()
+			if options['insecure']:
+				self.ssl_context.check_hostname = False
+				self.ssl_context.verify_mode = ssl.CERT_NONE
+
+	def log(self, message):
+		logger.info(f"[bots {self.index}] {message}")
+
+	def request(self, method, path, data=None, token=None, form=False):
+		headers = {}
+		body = None
+		if token:
+			headers['Authorization'] = f'Bearer {token}'
+		if data is not None:
+			if form:
+				body = urllib.parse.urlencode(data).encode()
+				headers['Content-Type'] = 'application/x-www-form-urlencoded'
+			else:
+				body = json.dumps(data).encode()
+				headers['Content-Type'] = 'application/json'
+
+		request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+		try:
+			with urllib.request.urlopen(request, timeout=30, context=self.ssl_context) as response:
+				return response.status, json.loads(response.read())
+		except urllib.error.HTTPError as e:
+			try:
+				return e.code, json.loads(e.read())
+			except ValueError:
+				return e.code, {'message': e.reason}
+
+	async def api(self, method, path, data=None, token=None, form=False):
+		async with self.http:
+			status, body = await asyncio.to_thread(self.request, method, path, data, token, form)
+		if status >= 400:
+			raise RuntimeError(f"{method} {path} failed ({status}): {body.get('message')}")
+		return body
+
+	async def user(self, slot, index):
+		"""Id and token of a bot account, registered the first time it is used"""
+		username = f"{self.options['prefix']}{slot}p{index}"
+		if username not in self.users:
+			credentials = {'username': username, 'password': self.options['password']}
+			async with self.http:
+				status, body = await asyncio.to_thread(self.request, 'POST', '/api/register/', credentials, form=True)
+			if status >= 400:
+				body = await self.api('POST', '/api/login/', credentials)
+			self.users[username] = (body['user']['id'], body['token'])
+		return self.users[username]
+
+	async def scale(self, total):
+		"""Run this process's share of total rooms, and wait until their games started"""
+		slots = [slot for slot in range(self.total, total) if slot % self.processes == self.index]
+		self.total = max(self.total, total)
+
+		# Accounts first, password hashing would otherwise hold up the rooms being started
+		await asyncio.gather(*(
+			self.user(slot, index) for slot in slots for index in range(self.options['players'])
+		))
+
+		for order, slot in enumerate(slots):
+			room = RoomLoad(self, slot)
+			room.task = asyncio.create_task(room.run(order * self.processes / self.options['ramp']))
+			self.rooms.append(room)
+
+		timeout = self.options['start_timeout'] + len(slots) * self.processes / self.options['ramp']
+		try:
+			await asyncio.wait_for(asyncio.gather(*(room.started.wait() for room in self.rooms)), timeout)
+		except asyncio.TimeoutError:
+			pass
+		return sum(room.started.is_set() for room in self.rooms)
+
+	async def stop(self):
+		for room in self.rooms:
+			room.stop()
+		await asyncio.gather(*(room.task for room in self.rooms), return_exceptions=True)
+		# Let the close handshakes go out
+		await asyncio.sleep(0.5)
+
+	async def serve(self, connection):
+		loop = asyncio.get_running_loop()
+		while True:
+			command, argument = await loop.run_in_executor(None, connection.recv)
+			if command == 'scale':
+				connection.send(await self.scale(argument))
+			elif command == 'reset':
+				self.stats.reset()
+				connection.send(None)
+			elif command == 'collect':
+				connection.send(self.stats.to_dict())
+			elif command == 'stop':
+				await self.stop()
+				connection.send(None)
+				return
+
+
+def run_bots(options, index, processes, connection):
+	# Ctrl-C stops the sweep in the parent, which then stops the bots cleanly
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	# Room errors of the bots go to stdout from --verbosity 2, next to the command's output
+	logger.addHandler(logging.StreamHandler(sys.stdout))
+	logger.setLevel(logging.INFO if options['verbosity'] > 1 else logging.WARNING)
+	logger.propagate = False
+	asyncio.run(BotProcess(options, index, processes).serve(connection))
+
+
+class Command(BaseCommand):
+	help = (
+		"Load test a running server with bot players: create users and rooms through the API, "
+		"fill each room with bots playing over ws/game/<room>/, and report frame latency, jitter, "
+		"dropped frames and server CPU for each room count of the sweep"
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--url', default='http://localhost:8000', help="Server the bots connect to, without path")
+		parser.add_argument('--rooms', type=int, nargs='+', default=[10, 25, 50, 100], help="Room counts of the sweep, in order")
+		parser.add_argument('--players', type=int, choices=(2, 3, 4), default=2, help="Bots per room")
+		parser.add_argument('--map', default='classic')
+		parser.add_argument('--format', choices=FORMATS, default='binary', help="Frame format the bots ask for")
+		parser.add_argument('--duration', type=float, default=20, help="Seconds measured at each room count")
+		parser.add_argument('--warmup', type=float, default=3, help="Seconds before measuring, once the games started")
+		parser.add_argument('--ramp', type=float, default=20, help="Rooms created per second")
+		parser.add_argument('--start-timeout', type=float, default=30, help="Seconds left to the rooms to start their game")
+		parser.add_argument('--input-rate', type=float, default=60, help="Inputs per second of a bot chasing the ball")
+		parser.add_argument('--aim-error', type=float, default=3, help="Standard deviation of where bots hit the ball")
+		parser.add_argument('--processes', type=int, default=1, help="Processes the bots are spread over")
+		parser.add_argument('--pid', type=int, nargs='*', default=[], help="Server processes whose CPU is measured, the local workers in GAME_ROOM_REGISTRY by default")
+		parser.add_argument('--prefix', default='bot', help="Start of the bot usernames")
+		parser.add_argument('--password', default='Pong-loadtest-42')
+		parser.add_argument('--insecure', action='store_true', help="Do not verify the certificate of an https url")
+
+	def handle(self, *args, **options):
+		if not options['prefix'].isalnum():
+			raise CommandError("--prefix must be alphanumeric, like usernames")
+		if len(f"{options['prefix']}{max(options['rooms']) - 1}p{options['players'] - 1}") > 12:
+			raise CommandError("Bot usernames would be longer than 12 characters, use a shorter --prefix")
+		processes = []
+		for index in range(options['processes']):
+			parent, child = multiprocessing.Pipe()
+			process = multiprocessing.Process(target=run_bots, args=(options, index, options['processes'], child), daemon=True)
+			process.start()
+			processes.append((process, parent))
+
+		def call(command, argument=None):
+			for _, connection in processes:
+				connection.send((command, argument))
+			return [connection.recv() for _, connection in processes]
+
+		try:
+			for rooms in options['rooms']:
+				started = sum(call('scale', rooms))
+				if started < rooms:
+					self.stderr.write(f"Only {started} of {rooms} rooms started their game")
+				time.sleep(options['warmup'])
+
+				pids = options['pid'] or self.server_pids()
+				cpu_before = self.server_cpu(pids)
+				call('reset')
+				time.sleep(options['duration'])
+				results = call('collect')
+				cpu_after = self.server_cpu(pids)
+
+				self.report(rooms, options, results, cpu_before, cpu_after)
+		finally:
+			call('stop')
+			for process, _ in processes:
+				process.join(5)
+
+	def server_pids(self):
+		"""Pids of the game workers running on this host, from the room registry"""
+		registry = make_registry()
+		if isinstance(registry, LocalRoomRegistry):
+			return []
+		workers = asyncio.run(registry.workers())
+		host = socket.gethostname()
+		return [status['pid'] for status in workers.values() if status['host'] == host]
+
+	def server_cpu(self, pids):
+		cpu = {}
+		for pid in pids:
+			try:
+				cpu[pid] = (cpu_seconds(pid), time.monotonic())
+			except OSError:
+				pass
+		return cpu
+
+	def report(self, rooms, options, results, cpu_before, cpu_after):
+		latencies = [value for result in results for value in result['latencies']]
+		jitters = [value for result in results for value in result['jitters']]
+		gaps = sum((result['gaps'] for result in results), Counter())
+
+		# Frames are sent every few ticks, the usual gap, bigger ones hold lost frames
+		expected = dropped = 0
+		if gaps:
+			step = gaps.most_common(1)[0][0]
+			expected = sum(gap // step * count for gap, count in gaps.items())
+			dropped = sum(max(0, gap // step - 1) * count for gap, count in gaps.items())
+
+		line = f"{rooms:>5} rooms, {rooms * options['players']} bots: "
+		if latencies:
+			line += (
+				f"latency p50 {percentile(latencies, 0.5):.1f}ms p95 {percentile(latencies, 0.95):.1f}ms "
+				f"p99 {percentile(latencies, 0.99):.1f}ms  "
+			)
+		if jitters:
+			line += f"jitter p50 {percentile(jitters, 0.5):.1f}ms p95 {percentile(jitters, 0.95):.1f}ms  "
+		line += f"dropped {dropped}/{expected} ({dropped / expected * 100 if expected else 0:.2f}%)  "
+		line += f"{sum(result['frames'] for result in results) / options['duration']:.0f} frames/s  "
+
+		usage = [
+			(cpu_after[pid][0] - cpu_before[pid][0]) / (cpu_after[pid][1] - cpu_before[pid][1]) * 100
+			for pid in cpu_after if pid in cpu_before
+		]
+		if usage:
+			line += f"server cpu {sum(usage):.0f}% (busiest worker {max(usage):.0f}%)  "
+		else:
+			line += "server cpu n/a  "
+
+		bots_cpu = max(result['cpu'] for result in results)
+		line += f"bots cpu {bots_cpu:.0f}%  games {sum(result['games'] for result in results)}  errors {sum(result['errors'] for result in results)}"
+		self.stdout.write(line)
+		if bots_cpu > 80:
+			self.stderr.write("Bot processes are near a full core, measurements may be bound by them: raise --processes")
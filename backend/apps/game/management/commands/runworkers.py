@@ -0,0 +1,75 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+	help = (
+		"Run several daphne workers accepting connections on one shared socket. "
+		"Game rooms are sharded between them through GAME_ROOM_REGISTRY. "
+		"SIGUSR1 drains every worker and exits once they are done, see manage.py drain."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+		parser.add_argument('--bind', default='0.0.0.0')
+		parser.add_argument('--port', type=int, default=8000)
+		parser.add_argument('application', nargs='?', default='config.asgi:application')
+
+	def handle(self, *args, **options):
+		# Sockets of a room are spread over the workers, so most frames cross processes
+		if options['workers'] > 1 and settings.CHANNEL_LAYERS['default']['BACKEND'] != settings.CHANNEL_LAYER_BACKENDS['hybrid']:
+			self.stderr.write(self.style.WARNING(
+				"Rooms shared by several workers need the hybrid channel layer, "
+				"other layers drop frames between workers under load"
+			))
+
+		# Bound once here, every worker accepts from the same socket
+		listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		listener.bind((options['bind'], options['port']))
+		listener.listen(1024)
+		listener.set_inheritable(True)
+		command = [
+			sys.executable, '-m', 'daphne',
+			'--fd', str(listener.fileno()),
+			options['application'],
+		]
+
+		def spawn():
+			return subprocess.Popen(command, pass_fds=(listener.fileno(),))
+
+		workers = [spawn() for _ in range(options['workers'])]
+		self.stdout.write(f"Started {len(workers)} workers on {options['bind']}:{options['port']}")
+
+		stopping = False
+
+		def stop(signum, frame):
+			nonlocal stopping
+			stopping = True
+			for process in workers:
+				if process.poll() is None:
+					process.send_signal(signum)
+
+		signal.signal(signal.SIGTERM, stop)
+		signal.signal(signal.SIGINT, stop)
+		# Workers hand off their rooms and exit on their own when drained
+		signal.signal(signal.SIGUSR1, stop)
+
+		# Restart workers that die or were drained alone, until we are told to stop
+		while True:
+			if stopping:
+				for process in workers:
+					process.wait()
+				return
+
+			for index, process in enumerate(workers):
+				if process.poll() is not None and not stopping:
+					self.stderr.write(f"Worker {process.pid} exited with {process.returncode}, restarting")
+					workers[index] = spawn()
+			time.sleep(1)
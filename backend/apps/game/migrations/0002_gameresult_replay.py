@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameresult',
+            name='replay',
+            field=models.FileField(blank=True, upload_to='replays/'),
+        ),
+    ]
@@ -23,6 +23,16 @@ class Room(models.Model):
 	)
 
 	map = models.CharField(max_length=20, choices=MAPS, default='classic')
+
+	# Game state snapshots sent to clients per second on each map, the
+	# simulation itself runs at GAME_TICK_RATE and clients interpolate between
+	DEFAULT_SNAPSHOT_RATE = 20
+	SNAPSHOT_RATES = {
+		'classic': 20,
+		'bath': 20,
+		'lava': 20,
+		'beach': 20,
+	}
 	player_count = models.IntegerField(validators=[MinValueValidator(2), MaxValueValidator(4)], default=2)
 
 	STATUS_CHOICES = (
@@ -35,6 +45,10 @@ class Room(models.Model):
 	class Meta:
 		abstract = True
 
+	@property
+	def snapshot_rate(self):
+		return self.SNAPSHOT_RATES.get(self.map, self.DEFAULT_SNAPSHOT_RATE)
+
 
 class GameRoom(Room):
 	"""
@@ -94,11 +108,7 @@ class GameRoom(Room):
 	def join(self, user):
 		"""Player joins the game room"""
 		with transaction.atomic():
-			# Check if room is joinable
-			if self.status != 'waiting':
-				raise ValidationError("Game has already started")
-
-			# Check if player is already in the game
+			# Check if player is already in the game, they may reconnect to a started one
 			if self.players.filter(user=user).exists():
 				player = self.players.get(user=user)
 				player.save()
@@ -108,6 +118,10 @@ class GameRoom(Room):
 					'side': player.side,
 				}
 
+			# Check if room is joinable
+			if self.status != 'waiting':
+				raise ValidationError("Game has already started")
+
 			# Check if room is full
 			if self.players.count() >= self.player_count:
 				raise ValidationError("Game room is full")
@@ -151,8 +165,8 @@ class GameRoom(Room):
 				return None
 
 
-	def end(self, scores):
-		"""Save game results and create a permanent record"""
+	def end(self, scores, replay=None):
+		"""Save game results and create a permanent record, linking the replay file if one was recorded"""
 		try:
 			with transaction.atomic():
 				# Make sure game was in progress
@@ -169,7 +183,7 @@ class GameRoom(Room):
 					raise ValidationError("No winners found, cannot save results")
 
 				# Create the permanent game record
-				game_record = GameResult.objects.create()
+				game_record = GameResult.objects.create(replay=replay or '')
 
 				# Save player scores
 				for player in self.players.all():
@@ -216,6 +230,8 @@ class GameResult(models.Model):
 	Permanent record of a completed game
 	"""
 	date = models.DateTimeField(auto_now_add=True)
+	# Recording of the match, see engine/replay.py
+	replay = models.FileField(upload_to='replays/', blank=True)
 
 	class Meta:
 		ordering = ['-date']
@@ -235,6 +251,7 @@ class GameResult(models.Model):
 		return {
 			'id': self.id,
 			'date': self.date.isoformat(),
+			'replay': self.replay.url if self.replay else None,
 			'players': [
 				{
 					'user_id': result.user.id,
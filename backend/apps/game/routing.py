@@ -4,11 +4,15 @@ from .consumers.chat_consumer import ChatConsumer
 from .consumers.presence_consumer import PresenceConsumer
 from .consumers.tournament_socket import TournamentConsumer
 from .consumers.matchmaking import MatchmakingConsumer
+from .consumers.replay_consumer import ReplayConsumer
+from .engine.metrics import track_connections
 
+# Open connections are counted per consumer for the metrics endpoint
 websocket_urlpatterns = [
-    re_path(r'ws/presence/$', PresenceConsumer.as_asgi()),
-    re_path(r'ws/matchmaking/$', MatchmakingConsumer.as_asgi()),
-    re_path(r'ws/game/(?P<room_name>[\w-]+)/$', GameConsumer.as_asgi()),
-    re_path(r"ws/chat/(?P<chat_id>[\w-]+)/$", ChatConsumer.as_asgi()),
-    re_path(r"ws/tournament/(?P<tournament_name>[\w-]+)/$", TournamentConsumer.as_asgi()),
+    re_path(r'ws/presence/$', track_connections(PresenceConsumer.as_asgi(), 'presence')),
+    re_path(r'ws/matchmaking/$', track_connections(MatchmakingConsumer.as_asgi(), 'matchmaking')),
+    re_path(r'ws/game/(?P<room_name>[\w-]+)/$', track_connections(GameConsumer.as_asgi(), 'game')),
+    re_path(r"ws/chat/(?P<chat_id>[\w-]+)/$", track_connections(ChatConsumer.as_asgi(), 'chat')),
+    re_path(r"ws/tournament/(?P<tournament_name>[\w-]+)/$", track_connections(TournamentConsumer.as_asgi(), 'tournament')),
+    re_path(r'ws/replay/(?P<result_id>\d+)/$', track_connections(ReplayConsumer.as_asgi(), 'replay')),
 ]
@@ -0,0 +1,65 @@
+import asyncio
+import tempfile
+from channels.layers import get_channel_layer
+from django.test import override_settings
+from apps.game.engine.actor import RoomActor
+from apps.game.engine.scheduler import scheduler
+from apps.game.engine.worker import GameWorker
+
+# Rooms under test talk to each other through an in-memory layer and record their replays in a temporary directory
+engine_settings = override_settings(
+	CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+	MEDIA_ROOT=tempfile.mkdtemp(prefix='game-tests-'),
+)
+
+
+async def make_room(room_name, sides=('left', 'right')):
+	"""A room with one player per side and a channel in its group, not started"""
+	actor = RoomActor.for_room(room_name, f'game_{room_name}')
+	for player_id, side in enumerate(sides, 1):
+		actor.add_player({'id': player_id, 'username': f'player{player_id}', 'side': side})
+
+	layer = get_channel_layer()
+	channel = await layer.new_channel()
+	await layer.group_add(actor.group_name, channel)
+	return actor, channel
+
+
+async def receive_type(channel, message_type, timeout=2):
+	"""Next message of the given type sent to a channel, skipping the others"""
+	layer = get_channel_layer()
+	while True:
+		message = await asyncio.wait_for(layer.receive(channel), timeout)
+		if message['type'] == message_type:
+			return message
+
+
+def discard_room(actor):
+	scheduler.remove(actor)
+	actor.discard()
+
+
+async def stop_room(actor):
+	"""Stop a room started by a test, with its replay recorder"""
+	if actor.recorder:
+		await actor.recorder.close()
+	discard_room(actor)
+
+
+async def wait_ticks(actor, ticks):
+	"""Let the scheduler step a running room the given number of times"""
+	target = actor.tick + ticks
+	while actor.tick < target:
+		await asyncio.sleep(scheduler.dt)
+
+
+async def make_worker(registry, checkpoints):
+	"""A worker sharing a registry and checkpoints with others, as if in another process, without its background tasks"""
+	worker = GameWorker()
+	worker.registry = registry
+	worker.checkpoints = checkpoints
+	worker.channel_layer = get_channel_layer()
+	worker.channel_name = await worker.channel_layer.new_channel()
+	worker.started = asyncio.get_running_loop().create_future()
+	worker.started.set_result(None)
+	return worker
@@ -0,0 +1,96 @@
+import json
+import math
+from django.test import SimpleTestCase
+from apps.game.engine.actor import RoomActor
+from apps.game.engine.checkpoint import encode
+from apps.game.engine.physics import LEFT, RIGHT
+from apps.game.engine.scheduler import scheduler
+from apps.game.tests.helpers import engine_settings, make_room, stop_room, wait_ticks, discard_room
+
+
+@engine_settings
+class PaddleInputTests(SimpleTestCase):
+	async def test_non_finite_paddle_move_is_dropped(self):
+		actor, _ = await make_room('actor-non-finite')
+		actor.start()
+		try:
+			for position, rotation in ((math.nan, 0), (0, math.inf), ('-inf', 0), (1, 'nan')):
+				await actor.submit('left', {'position': position, 'rotation': rotation, 'seq': 1})
+				self.assertEqual(actor.paddle_inputs, {})
+
+			await wait_ticks(actor, 3)
+			paddle = actor.state.paddles[LEFT]
+			self.assertEqual((paddle.position, paddle.rotation, paddle.seq), (0, 0, 0))
+			self.assertIs(scheduler.rooms.get(actor.room_name), actor)
+			self.assertTrue(actor.running)
+
+			await actor.submit('left', {'position': 2, 'rotation': 0, 'seq': 2})
+			await wait_ticks(actor, 1)
+			self.assertEqual((paddle.position, paddle.seq), (2, 2))
+		finally:
+			await stop_room(actor)
+
+	async def test_rotation_is_clamped(self):
+		actor, _ = await make_room('actor-rotation')
+		actor.start()
+		try:
+			await actor.submit('left', {'position': 0, 'rotation': 1e300, 'seq': 1})
+			await wait_ticks(actor, 1)
+			self.assertEqual(actor.state.paddles[LEFT].rotation, actor.MAX_ROTATION)
+		finally:
+			await stop_room(actor)
+
+	async def test_invalid_move_is_not_acknowledged(self):
+		actor, _ = await make_room('actor-seq')
+		actor.start()
+		try:
+			await actor.submit('left', {'position': 1, 'rotation': 0, 'seq': 1})
+			await wait_ticks(actor, 1)
+
+			for move in (
+				{'position': math.nan, 'rotation': 0, 'seq': 2},
+				{'position': 2, 'rotation': 0, 'seq': 2.5},
+				{'position': 2, 'rotation': 0, 'seq': '3'},
+				{'position': 2, 'rotation': 0, 'seq': 2 ** 32},
+				{'position': 2, 'seq': 2},
+			):
+				await actor.submit('left', move)
+			await wait_ticks(actor, 2)
+
+			self.assertEqual(actor.state.paddles[LEFT].position, 1)
+			self.assertEqual(actor.state.acks(), {'left': 1})
+		finally:
+			await stop_room(actor)
+
+
+@engine_settings
+class CheckpointTests(SimpleTestCase):
+	async def test_restore_rebuilds_the_checkpointed_room(self):
+		actor, _ = await make_room('actor-checkpoint')
+		actor.start()
+		try:
+			await actor.submit('left', {'position': 3, 'rotation': 0.5, 'seq': 4})
+			await wait_ticks(actor, 2)
+			actor.state.paddles[RIGHT].score = 2
+
+			# Through JSON like both stores, nothing may await between the checkpoint and the expected state
+			checkpoint = json.loads(encode(actor.checkpoint()))
+			expected, tick = actor.state.to_dict(), actor.tick
+		finally:
+			await stop_room(actor)
+
+		restored = RoomActor.restore(checkpoint)
+		try:
+			self.assertEqual(restored.state.to_dict(), expected)
+			self.assertEqual(restored.tick, tick)
+			self.assertEqual(restored.replay, actor.replay)
+			self.assertEqual((restored.map_name, restored.player_count), (actor.map_name, actor.player_count))
+			self.assertEqual(restored.state.paddles[LEFT].position, 3)
+			self.assertEqual(restored.state.scores(), {'left': 0, 'right': 2})
+
+			# Paused until both players are back
+			self.assertEqual(restored.awaiting, {'1', '2'})
+			self.assertFalse(restored.running)
+		finally:
+			restored.abandon_task.cancel()
+			discard_room(restored)
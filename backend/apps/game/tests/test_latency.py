@@ -0,0 +1,63 @@
+import json
+import math
+from django.test import SimpleTestCase
+from apps.game.engine.latency import LatencyProbe
+
+
+def reject_constant(name):
+	raise ValueError(f"{name} sent in a ping")
+
+
+class LatencyProbeTests(SimpleTestCase):
+	def setUp(self):
+		self.sent = []
+
+		async def send(text_data):
+			self.sent.append(json.loads(text_data, parse_constant=reject_constant))
+
+		self.probe = LatencyProbe(send)
+
+	async def ping(self):
+		await self.probe.ping()
+		return self.sent[-1]
+
+	async def test_pong_updates_the_estimates(self):
+		ping = await self.ping()
+		self.probe.handle_pong({'type': 'pong', 'id': ping['id'], 'client_time': ping['time'] + 1000})
+
+		self.assertEqual(self.probe.samples, 1)
+		self.assertGreaterEqual(self.probe.rtt, 0)
+		self.assertAlmostEqual(self.probe.offset, 1000, delta=100)
+		self.assertEqual(self.probe.in_flight, {})
+
+	async def test_malformed_pongs_are_ignored(self):
+		ping = await self.ping()
+		for pong in (
+			{'id': [ping['id']], 'client_time': ping['time']},
+			{'id': {'id': ping['id']}, 'client_time': ping['time']},
+			{'id': str(ping['id']), 'client_time': ping['time']},
+			{'id': float(ping['id']), 'client_time': ping['time']},
+			{'id': True, 'client_time': ping['time']},
+			{'id': ping['id'], 'client_time': math.nan},
+			{'id': ping['id'], 'client_time': -math.inf},
+			{'id': ping['id'], 'client_time': 10 ** 400},
+			{'id': ping['id'], 'client_time': True},
+			{'id': ping['id'], 'client_time': str(ping['time'])},
+			{'id': ping['id']},
+			{},
+		):
+			with self.subTest(pong=pong):
+				self.probe.handle_pong({'type': 'pong', **pong})
+				self.assertEqual(self.probe.samples, 0)
+		self.assertIn(ping['id'], self.probe.in_flight)
+
+	async def test_nan_pong_after_a_sample_leaves_the_offset_finite(self):
+		ping = await self.ping()
+		self.probe.handle_pong({'type': 'pong', 'id': ping['id'], 'client_time': ping['time']})
+		ping = await self.ping()
+		self.probe.handle_pong({'type': 'pong', 'id': ping['id'], 'client_time': math.nan})
+
+		self.assertTrue(math.isfinite(self.probe.offset))
+		# Sent without NaN, reject_constant would raise
+		ping = await self.ping()
+		self.assertEqual(ping['offset'], self.probe.offset)
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import uuid
+from django.test import SimpleTestCase
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from apps.game.layers import HybridChannelLayer
+
+# Tests needing Redis are skipped when it does not answer there
+REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://127.0.0.1:6390')
+
+
+class HybridChannelLayerTests(SimpleTestCase):
+	async def make_layers(self):
+		"""Two layers sharing a Redis prefix, like two worker processes, each with a channel receiving"""
+		client = aioredis.from_url(REDIS_URL, socket_connect_timeout=1)
+		try:
+			await client.ping()
+		except (OSError, RedisError):
+			self.skipTest(f"Redis unavailable at {REDIS_URL}")
+		finally:
+			await client.aclose()
+
+		prefix = f'test-{uuid.uuid4().hex}'
+		layers = [HybridChannelLayer(hosts=[REDIS_URL], prefix=prefix) for _ in range(2)]
+		channels = [await layer.new_channel() for layer in layers]
+		for layer, channel in zip(layers, channels):
+			await layer.group_add('room', channel)
+			# Receiving sets the loop of local delivery and starts the Redis reader
+			await self.assert_nothing(layer, channel, timeout=0.1)
+		return layers, channels
+
+	async def close_layers(self, layers):
+		await layers[0].flush()
+		for layer in layers:
+			await layer.close_pools()
+
+	async def assert_nothing(self, layer, channel, timeout=0.5):
+		with self.assertRaises(asyncio.TimeoutError):
+			await asyncio.wait_for(layer.receive(channel), timeout)
+
+	async def receive(self, layer, channel):
+		return await asyncio.wait_for(layer.receive(channel), 2)
+
+	async def test_group_send_reaches_local_and_remote_members_once(self):
+		(local, remote), (local_channel, remote_channel) = await self.make_layers()
+		try:
+			await local.group_send('room', {'type': 'game.message', 'text': 'hello'})
+
+			self.assertEqual(await self.receive(local, local_channel), {'type': 'game.message', 'text': 'hello'})
+			self.assertEqual(await self.receive(remote, remote_channel), {'type': 'game.message', 'text': 'hello'})
+			# Local members are not sent the message through Redis as well
+			await self.assert_nothing(local, local_channel)
+			await self.assert_nothing(remote, remote_channel, timeout=0)
+		finally:
+			await self.close_layers([local, remote])
+
+	async def test_reader_takes_every_message_in_order(self):
+		(local, remote), _ = await self.make_layers()
+		try:
+			# Several batches of the reader, all sent before it wakes up. A channel
+			# buffers up to the layer capacity, so they are spread over channels.
+			channels = [await local.new_channel() for _ in range(2 * HybridChannelLayer.READ_BATCH // local.capacity + 1)]
+			for index in range(local.capacity):
+				for channel in channels:
+					await remote.send(channel, {'type': 'game.message', 'index': index})
+
+			for channel in channels:
+				received = [(await self.receive(local, channel))['index'] for _ in range(local.capacity)]
+				self.assertEqual(received, list(range(local.capacity)))
+				await self.assert_nothing(local, channel, timeout=0)
+		finally:
+			await self.close_layers([local, remote])
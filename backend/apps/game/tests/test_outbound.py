@@ -0,0 +1,44 @@
+import asyncio
+from django.test import SimpleTestCase
+from apps.game.engine.outbound import OutboundQueue
+
+
+class OutboundQueueTests(SimpleTestCase):
+	async def write(self, queue):
+		"""Start a queue filled while its client was stalled and return what it writes"""
+		sent = []
+
+		async def send(text_data):
+			sent.append(text_data)
+
+		queue.send = send
+		queue.start()
+		while queue.reliable or queue.keyframe is not None or queue.latest is not None:
+			await asyncio.sleep(0)
+		await queue.close()
+		return sent
+
+	def frame(self, text):
+		return [{'text_data': text}]
+
+	async def test_stalled_client_keeps_events_and_newest_frames(self):
+		queue = OutboundQueue(None)
+		queue.put_event(text_data='started_game')
+		# Five minutes of a delta client at 1 keyframe per second, and one frame per tick in between
+		for tick in range(300 * 60):
+			keyframe = tick % 60 == 0
+			queue.put_frame(self.frame(f'{"key" if keyframe else "delta"}{tick}'), keyframe=keyframe)
+		queue.put_event(text_data='reset_round')
+
+		self.assertEqual(len(queue.reliable), 2)
+		self.assertEqual(await self.write(queue), ['started_game', 'reset_round', 'key17940', 'delta17999'])
+		self.assertEqual(queue.dropped, 300 * 60 - 2)
+
+	async def test_keyframe_goes_before_the_frames_after_it(self):
+		queue = OutboundQueue(None)
+		queue.put_frame(self.frame('delta1'))
+		queue.put_frame(self.frame('key2'), keyframe=True)
+		queue.put_frame(self.frame('delta3'))
+
+		self.assertEqual(await self.write(queue), ['key2', 'delta3'])
+		self.assertEqual(queue.dropped, 1)
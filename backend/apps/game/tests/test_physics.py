@@ -0,0 +1,249 @@
+import numpy as np
+from django.test import SimpleTestCase
+from apps.game.engine.physics import (
+	PhysicsWorld, SIDES, LEFT, RIGHT, BOTTOM, TOP, NO_SIDE, MULTI_SIDE_PUSH, SERVE_DELAY,
+)
+
+DT = 1 / 60
+
+
+def make_world(player_count=2, rooms=1):
+	world = PhysicsWorld(seed=0)
+	sides = SIDES if player_count == 4 else SIDES[:2]
+	slots = [world.add_room('classic', player_count, sides) for _ in range(rooms)]
+	return world, slots
+
+
+def launch(world, slot, pos, vel, last_contact=NO_SIDE):
+	"""Put a ball in play at a position, with a speed in units per frame"""
+	world.ball_pos[slot] = pos
+	world.ball_vel[slot] = vel
+	world.in_play[slot] = True
+	world.serve_timer[slot] = 0
+	world.last_contact[slot] = last_contact
+
+
+def run_until_point(world, dt=DT, steps=600):
+	"""Step until a point is scored, returns it and the steps it took"""
+	for step in range(1, steps + 1):
+		points = world.step(dt)
+		if points:
+			return points, step
+	return [], steps
+
+
+class ScoringTests(SimpleTestCase):
+	def test_two_player_point(self):
+		world, (slot,) = make_world()
+		world.set_paddle(slot, RIGHT, 20)
+		launch(world, slot, (0, 0), (0.5, 0))
+
+		points, _ = run_until_point(world)
+
+		self.assertEqual(points, [(slot, LEFT, RIGHT)])
+		# Back in the center, waiting for the next serve
+		self.assertEqual(world.ball_pos[slot].tolist(), [0, 0])
+		self.assertFalse(world.in_play[slot])
+		self.assertEqual(world.serve_timer[slot], SERVE_DELAY)
+
+	def test_two_player_ball_bounces_off_the_walls(self):
+		world, (slot,) = make_world()
+		launch(world, slot, (0, 29.8), (0, 0.5))
+
+		world.step(DT)
+
+		self.assertLess(world.ball_vel[slot, 1], 0)
+		self.assertLessEqual(world.ball_pos[slot, 1], 30)
+
+	def test_four_player_point_goes_to_the_last_paddle_touched(self):
+		world, (slot,) = make_world(player_count=4)
+		world.set_paddle(slot, BOTTOM, 40)
+		launch(world, slot, (0, 0), (0, 0.5), last_contact=TOP)
+
+		points, _ = run_until_point(world)
+
+		self.assertEqual(points, [(slot, TOP, BOTTOM)])
+
+	def test_four_player_point_without_touch_has_no_winner(self):
+		world, (slot,) = make_world(player_count=4)
+		world.set_paddle(slot, LEFT, 20)
+		launch(world, slot, (0, 0), (-0.5, 0))
+
+		points, _ = run_until_point(world)
+
+		self.assertEqual(points, [(slot, NO_SIDE, LEFT)])
+
+	def test_ball_is_served_after_the_delay(self):
+		world, (slot,) = make_world()
+		for _ in range(round(SERVE_DELAY / DT) - 1):
+			world.step(DT)
+		self.assertFalse(world.in_play[slot])
+
+		world.step(DT)
+		self.assertTrue(world.in_play[slot])
+		self.assertEqual(abs(world.ball_vel[slot, 0]), 0.5)
+
+
+class BounceTests(SimpleTestCase):
+	"""Speeds after a paddle hit, as Pong.handlePaddleCollision computes them in pong.js"""
+
+	def hit(self, player_count, side, paddle, pos, vel, steps):
+		"""Launch a ball that reaches the paddle's face at the end of the given step, returns its speed then"""
+		world, (slot,) = make_world(player_count)
+		world.set_paddle(slot, side, paddle)
+		launch(world, slot, pos, vel)
+		for _ in range(steps):
+			world.step(DT)
+		self.assertEqual(world.last_contact[slot], side)
+		return world.ball_vel[slot].tolist()
+
+	def test_left_paddle_sets_the_vertical_speed(self):
+		# Face at x = -39, reached after 8 frames at y = 4
+		vx, vy = self.hit(2, LEFT, 2, (-35, 4), (-0.5, 0.3), 8)
+		# The hit point is 4 + 8 * 0.3 = 6.4, 4.4 above the paddle center; the previous y speed is replaced
+		self.assertEqual(vx, 0.5)
+		self.assertAlmostEqual(vy, (6.4 - 2) * MULTI_SIDE_PUSH)
+
+	def test_right_paddle_adds_to_the_vertical_speed(self):
+		vx, vy = self.hit(2, RIGHT, 0, (35, 1.2), (0.5, 0.1), 8)
+		self.assertEqual(vx, -0.5)
+		self.assertAlmostEqual(vy, 0.1 + 2.0 * MULTI_SIDE_PUSH)
+
+	def test_bottom_and_top_paddles_add_to_the_horizontal_speed(self):
+		# Bottom and top faces at y = 23 and -23 on the classic map
+		vx, vy = self.hit(4, BOTTOM, 1, (1, 19), (0.2, 0.5), 8)
+		self.assertEqual(vy, -0.5)
+		self.assertAlmostEqual(vx, 0.2 + (2.6 - 1) * MULTI_SIDE_PUSH)
+
+		vx, vy = self.hit(4, TOP, 0, (0, -19), (-0.1, -0.5), 8)
+		self.assertEqual(vy, 0.5)
+		self.assertAlmostEqual(vx, -0.1 + -0.8 * MULTI_SIDE_PUSH)
+
+	def test_ball_beside_the_paddle_goes_through(self):
+		world, (slot,) = make_world()
+		world.set_paddle(slot, LEFT, 20)
+		launch(world, slot, (-35, 0), (-0.5, 0))
+
+		points, _ = run_until_point(world)
+
+		self.assertEqual(points, [(slot, RIGHT, LEFT)])
+
+
+class BatchTests(SimpleTestCase):
+	"""Rooms stepped together behave exactly as if each had the world to itself"""
+
+	SCENARIOS = (
+		# 2 players: a point, a paddle hit, a wall bounce
+		(2, {RIGHT: 20}, (30, 0), (0.5, 0)),
+		(2, {LEFT: 3}, (-30, 0), (-0.5, 0.2)),
+		(2, {}, (0, 25), (0.3, 0.5)),
+		# 4 players: a bottom paddle hit and a ball leaving by the top
+		(4, {BOTTOM: 1}, (0, 10), (0.1, 0.5)),
+		(4, {TOP: 20}, (0, -10), (0, -0.5)),
+		# Waiting for its serve
+		(2, {}, None, None),
+	)
+
+	def setup_room(self, world, scenario):
+		player_count, paddles, pos, vel = scenario
+		slot = world.add_room('classic', player_count, SIDES if player_count == 4 else SIDES[:2])
+		for side, position in paddles.items():
+			world.set_paddle(slot, side, position)
+		if pos is not None:
+			launch(world, slot, pos, vel)
+		return slot
+
+	def test_rooms_do_not_affect_each_other(self):
+		shared = PhysicsWorld(seed=0)
+		shared_slots = [self.setup_room(shared, scenario) for scenario in self.SCENARIOS]
+		alone = []
+		for scenario in self.SCENARIOS:
+			world = PhysicsWorld(seed=0)
+			alone.append((world, self.setup_room(world, scenario)))
+
+		# Long enough for every point, short of the random serves that follow them
+		for _ in range(90):
+			shared_points = shared.step(DT)
+			for index, (world, slot) in enumerate(alone):
+				points = [(winner, loser) for _, winner, loser in world.step(DT)]
+				shared_slot = shared_slots[index]
+				self.assertEqual(
+					[(winner, loser) for point_slot, winner, loser in shared_points if point_slot == shared_slot],
+					points,
+				)
+				# The serve direction is random, the waiting room is only compared on its points
+				if self.SCENARIOS[index][2] is not None:
+					np.testing.assert_allclose(shared.ball_pos[shared_slot], world.ball_pos[slot])
+					np.testing.assert_allclose(shared.ball_vel[shared_slot], world.ball_vel[slot])
+
+	def test_removed_room_slot_is_reused_clean(self):
+		world, (first, second) = make_world(rooms=2)
+		launch(world, first, (10, 5), (0.5, 0.5))
+		world.set_paddle(first, LEFT, 12)
+		world.remove_room(first)
+
+		slot = world.add_room('classic', 2, SIDES[:2])
+		self.assertEqual(slot, first)
+		self.assertEqual(world.ball_pos[slot].tolist(), [0, 0])
+		self.assertEqual(world.paddle_pos[slot].tolist(), [0, 0, 0, 0])
+		self.assertFalse(world.in_play[slot])
+
+
+class SweptCollisionTests(SimpleTestCase):
+	"""Collisions are found along the whole step, so the tick rate does not change the game"""
+
+	def test_fast_ball_bounces_off_a_paddle_it_would_cross_in_one_step(self):
+		world, (slot,) = make_world()
+		# 30 units per 20 Hz step, the paddle face at x = -39 is crossed between two positions
+		launch(world, slot, (-20, 0), (-10, 0))
+
+		points = world.step(1 / 20)
+
+		self.assertEqual(points, [])
+		self.assertEqual(world.last_contact[slot], LEFT)
+		self.assertEqual(world.ball_vel[slot, 0], 10)
+		# 19 units to the face, the 11 left are travelled back
+		self.assertAlmostEqual(world.ball_pos[slot, 0], -28)
+
+	def test_several_bounces_in_one_step(self):
+		world, (slot,) = make_world()
+		# 105 units in one step: off the bottom wall, the top wall and back down 15
+		launch(world, slot, (0, 0), (0, 35))
+
+		world.step(1 / 20)
+
+		self.assertAlmostEqual(world.ball_pos[slot, 1], -15)
+		self.assertEqual(world.ball_vel[slot, 1], 35)
+
+	def play(self, rate):
+		"""
+		A ball hitting the left paddle, then a wall, then leaving on the right.
+		Returns its position every second and when the point was scored.
+		"""
+		world, (slot,) = make_world()
+		world.set_paddle(slot, LEFT, 7)
+		world.set_paddle(slot, RIGHT, -26)
+		launch(world, slot, (0, 0), (-0.5, 0.1))
+
+		positions = []
+		for step in range(1, 10 * rate):
+			points = world.step(1 / rate)
+			if points:
+				self.assertEqual(points, [(slot, LEFT, RIGHT)])
+				return positions, step / rate
+			if step % rate == 0:
+				positions.append(world.ball_pos[slot].tolist())
+		self.fail(f"No point scored at {rate} Hz")
+
+	def test_same_trajectory_and_score_time_at_60_30_and_20_hz(self):
+		positions, scored = self.play(60)
+		# 78 frames to the left paddle, 178 back across the field
+		self.assertAlmostEqual(scored, 256 / 60)
+
+		for rate in (30, 20):
+			with self.subTest(rate=rate):
+				rate_positions, rate_scored = self.play(rate)
+				np.testing.assert_allclose(rate_positions, positions, atol=1e-9)
+				# Scored on the first tick at or after the ball left the field
+				self.assertGreaterEqual(rate_scored, scored - 1e-9)
+				self.assertLess(rate_scored, scored + 1 / rate)
@@ -0,0 +1,119 @@
+import copy
+import json
+import math
+from django.test import SimpleTestCase
+from apps.game.engine.protocol import (
+	INPUT, MSG_PADDLE_MOVE, STATE_HEADER, STATE_PADDLE, FLOAT32_MAX, FrameEncoder, encode_binary_state, decode_input,
+)
+from apps.game.engine.state import GameState, Paddle
+
+
+class BinaryStateTests(SimpleTestCase):
+	def test_out_of_range_rotation_is_clamped(self):
+		state = GameState()
+		state.paddles[0] = Paddle(position=3, rotation=1e300)
+		state.paddles[1] = Paddle(position=-1e300, rotation=-math.inf)
+
+		frame = encode_binary_state(state, 1, 0)
+
+		left, right = (
+			STATE_PADDLE.unpack_from(frame, STATE_HEADER.size + index * STATE_PADDLE.size) for index in range(2)
+		)
+		self.assertEqual(left[:2], (3, FLOAT32_MAX))
+		self.assertEqual(right[:2], (-FLOAT32_MAX, -FLOAT32_MAX))
+
+
+class DecodeInputTests(SimpleTestCase):
+	def test_paddle_move(self):
+		data = INPUT.pack(MSG_PADDLE_MOVE, 2.5, 0, 7)
+		self.assertEqual(decode_input(data), {'type': 'paddle_move', 'position': 2.5, 'rotation': 0, 'seq': 7})
+
+	def test_non_finite_values_are_rejected(self):
+		for position, rotation in ((math.nan, 0), (0, math.inf), (-math.inf, 0)):
+			with self.subTest(position=position, rotation=rotation):
+				self.assertIsNone(decode_input(INPUT.pack(MSG_PADDLE_MOVE, position, rotation, 1)))
+
+
+def apply_delta(target, delta):
+	"""Same as applyDelta in the frontend socket.js"""
+	for key, value in delta.items():
+		if isinstance(value, dict) and isinstance(target.get(key), dict):
+			apply_delta(target[key], value)
+		else:
+			target[key] = value
+
+
+class DeltaClient:
+	"""Rebuilds the state from delta frames, the way the frontend does"""
+
+	def __init__(self):
+		self.keyframe = None
+		self.state = None
+
+	def receive(self, frame):
+		message = json.loads(frame['text'])
+		if message['type'] == 'state_keyframe':
+			self.keyframe = message
+		self.state = copy.deepcopy(self.keyframe['state'])
+		if message['type'] == 'state_delta':
+			apply_delta(self.state, message['delta'])
+		return message
+
+
+class DeltaFrameTests(SimpleTestCase):
+	def setUp(self):
+		self.state = GameState()
+		for player_id, side in ((1, 'left'), (2, 'right'), (3, 'bottom')):
+			self.state.add_player(player_id, f'player{player_id}', side)
+		self.encoder = FrameEncoder()
+		self.client = DeltaClient()
+		self.tick = 0
+
+	def send(self, received=True):
+		"""Encode the next tick, and rebuild it on the client unless the frame is lost"""
+		self.tick += 1
+		frame = self.encoder.encode(self.state, self.tick, self.tick * 50, {'delta'})['delta']
+		if not received:
+			return None
+		message = self.client.receive(frame)
+		if message['type'] == 'state_delta':
+			self.assertEqual(message['keyframe'], self.client.keyframe['tick'])
+		self.assertEqual(self.client.state, json.loads(json.dumps(self.state.to_dict())))
+		return message['type']
+
+	def test_deltas_rebuild_the_state(self):
+		self.assertEqual(self.send(), 'state_keyframe')
+
+		self.state.paddles[0].position = 2.5
+		self.state.set_ball(3, -1, 0.5, 0.1)
+		self.assertEqual(self.send(), 'state_delta')
+
+		self.state.paddles[1].score = 1
+		self.state.last_winner, self.state.last_loser = 1, 0
+		self.assertEqual(self.send(), 'state_delta')
+
+		# Deltas hold everything since the keyframe, a lost one does not matter
+		self.state.paddles[2].rotation = 0.3
+		self.send(received=False)
+		self.state.set_ball(0, 0, 0, 0)
+		self.assertEqual(self.send(), 'state_delta')
+
+	def test_player_leaving_sends_a_keyframe(self):
+		self.send()
+		self.state.paddles[0].position = 1
+
+		self.state.remove_player(3)
+		self.assertEqual(self.send(), 'state_keyframe')
+		self.assertNotIn('bottom', self.client.state['settings']['paddleLoc'])
+
+		self.state.paddles[1].score = 2
+		self.assertEqual(self.send(), 'state_delta')
+
+	def test_keyframe_every_interval(self):
+		frame_types = []
+		for _ in range(2 * FrameEncoder.KEYFRAME_INTERVAL + 1):
+			self.state.set_ball(self.tick, 0, 1, 0)
+			frame_types.append(self.send())
+
+		keyframes = [tick for tick, frame_type in enumerate(frame_types, 1) if frame_type == 'state_keyframe']
+		self.assertEqual(keyframes, [1, 1 + FrameEncoder.KEYFRAME_INTERVAL, 1 + 2 * FrameEncoder.KEYFRAME_INTERVAL])
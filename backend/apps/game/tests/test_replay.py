@@ -0,0 +1,135 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.conf import settings
+from django.test import SimpleTestCase
+from apps.game.engine.replay import (
+	ReplayFile, ReplayRecorder, KEYFRAME_INTERVAL, RECORD_RATE, REC_KEYFRAME, read_replay,
+)
+from apps.game.engine.state import GameState
+from apps.game.tests.helpers import engine_settings
+
+TICK_RATE = 60
+
+
+def make_state():
+	state = GameState()
+	state.add_player(1, 'player1', 'left')
+	state.add_player(2, 'player2', 'right')
+	return state
+
+
+@engine_settings
+class ReplayTests(SimpleTestCase):
+	async def record(self, name, ticks, points=()):
+		"""
+		Record a ball moving one hundredth of a unit per tick, with the
+		given (tick, winner, loser) points, and return the file's path
+		"""
+		recorder = ReplayRecorder(name, {'room': 'replay', 'tick_rate': TICK_RATE}, TICK_RATE)
+		self.addCleanup(os.remove, recorder.path)
+		state = make_state()
+		points = {tick: (winner, loser) for tick, winner, loser in points}
+		for tick in range(ticks):
+			state.set_ball(tick / 100, 0, 0.5, 0)
+			if tick in points:
+				winner, loser = points[tick]
+				state.paddles[winner].score += 1
+				recorder.point(tick, winner, loser)
+			recorder.record(state, tick)
+		await recorder.close()
+		return recorder.path
+
+
+class ReplayRecorderTests(ReplayTests):
+	async def test_records_read_back(self):
+		path = await self.record('replays/recorded.pongreplay', 2 * KEYFRAME_INTERVAL * TICK_RATE + 100, [(500, 0, 1)])
+		with open(path, 'rb') as f:
+			header, records = read_replay(f.read())
+
+		self.assertEqual(header, {'room': 'replay', 'tick_rate': TICK_RATE})
+		self.assertEqual(
+			[record['tick'] for record in records if record['type'] == 'keyframe'],
+			[0, KEYFRAME_INTERVAL * TICK_RATE, 2 * KEYFRAME_INTERVAL * TICK_RATE],
+		)
+		self.assertEqual(
+			[record for record in records if record['type'] == 'point'],
+			[{'type': 'point', 'tick': 500, 'winner': 0, 'loser': 1}],
+		)
+
+		# A frame every 1 / RECORD_RATE second, each with the ball where it was
+		frames = [record for record in records if record['type'] == 'frame']
+		self.assertEqual(frames[1]['tick'] - frames[0]['tick'], TICK_RATE // RECORD_RATE)
+		for record in frames:
+			self.assertAlmostEqual(record['ballPos']['x'], record['tick'] / 100)
+			self.assertNotIn('ballSpeed', record)
+
+		# Ticks only go forward, and the score is in the keyframes after the point
+		ticks = [record['tick'] for record in records]
+		self.assertEqual(ticks, sorted(ticks))
+		keyframe = next(record for record in records if record['type'] == 'keyframe' and record['tick'] > 500)
+		self.assertEqual(keyframe['paddles'][0]['score'], 1)
+		self.assertEqual(keyframe['paddles'][1]['score'], 0)
+
+	async def test_resumed_recording_starts_with_a_keyframe(self):
+		name = 'replays/resumed.pongreplay'
+		await self.record(name, 100)
+		# Another worker carrying on the same game
+		recorder = ReplayRecorder(name, {'room': 'replay', 'tick_rate': TICK_RATE}, TICK_RATE)
+		recorder.record(make_state(), 103)
+		await recorder.close()
+
+		with open(os.path.join(settings.MEDIA_ROOT, name), 'rb') as f:
+			_, records = read_replay(f.read())
+		self.assertEqual(records[-1]['type'], 'keyframe')
+		self.assertEqual(records[-1]['tick'], 103)
+
+
+class ReplayFileTests(ReplayTests):
+	async def open(self, name):
+		path = await self.record(name, 2 * KEYFRAME_INTERVAL * TICK_RATE + 100)
+		self.addCleanup(ReplayFile.cache.pop, path, None)
+		return path
+
+	async def test_seek_starts_at_the_last_keyframe(self):
+		replay = ReplayFile.open(await self.open('replays/seek.pongreplay'))
+		interval = KEYFRAME_INTERVAL * TICK_RATE
+		self.assertEqual(replay.info()['keyframes'], [0, interval, 2 * interval])
+
+		for tick, keyframe in (
+			(-1, 0), (0, 0), (interval - 1, 0), (interval, interval),
+			(interval + 1, interval), (2 * interval + 50, 2 * interval), (10 ** 6, 2 * interval),
+		):
+			with self.subTest(tick=tick):
+				index = replay.seek(tick)
+				self.assertEqual(replay.chunk_ticks[index], keyframe)
+				self.assertEqual(replay.chunk(index)[0], REC_KEYFRAME)
+
+				# The chunks from there are a replay of their own, up to the end
+				chunks = (replay.chunk(current) for current in range(index, len(replay.chunk_ticks)))
+				_, records = read_replay(replay.prelude + b''.join(chunks))
+				self.assertEqual(records[0]['tick'], keyframe)
+				self.assertEqual(records[-1]['tick'], replay.end_tick)
+
+	async def test_chunks_span_chunk_seconds(self):
+		replay = ReplayFile.open(await self.open('replays/chunks.pongreplay'))
+		spans = [end - start for start, end in zip(replay.chunk_ticks, replay.chunk_ticks[1:])]
+		self.assertEqual(set(spans), {round(ReplayFile.CHUNK_SECONDS * TICK_RATE)})
+
+	async def test_open_shares_one_file_between_threads(self):
+		path = await self.open('replays/shared.pongreplay')
+		with ThreadPoolExecutor(8) as executor:
+			replays = list(executor.map(ReplayFile.open, [path] * 32))
+		self.assertTrue(all(replay is replays[0] for replay in replays))
+
+	async def test_open_keeps_the_most_recently_used(self):
+		paths = [await self.open(f'replays/cached{index}.pongreplay') for index in range(3)]
+		with mock.patch.object(ReplayFile, 'cache', OrderedDict()), \
+				mock.patch.object(ReplayFile, 'CACHE_SIZE', 2):
+			first = ReplayFile.open(paths[0])
+			ReplayFile.open(paths[1])
+			self.assertIs(ReplayFile.open(paths[0]), first)
+			ReplayFile.open(paths[2])
+
+			self.assertEqual(list(ReplayFile.cache), [paths[0], paths[2]])
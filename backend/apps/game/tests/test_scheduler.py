@@ -0,0 +1,30 @@
+from unittest.mock import AsyncMock, patch
+from django.test import SimpleTestCase
+from apps.game.engine.actor import RoomActor
+from apps.game.engine.scheduler import scheduler
+from apps.game.tests.helpers import engine_settings, make_room, receive_type, discard_room
+
+
+@engine_settings
+class SchedulerFailTests(SimpleTestCase):
+	async def test_failing_room_is_ended(self):
+		actor, channel = await make_room('scheduler-fail')
+		self.addCleanup(discard_room, actor)
+		result = {'players': [{'id': 1, 'is_winner': False}, {'id': 2, 'is_winner': False}]}
+
+		end_game_room = AsyncMock(return_value=(result, None))
+
+		with patch.object(actor, 'end_game_room', end_game_room), \
+				patch.object(actor, 'step', side_effect=RuntimeError('boom')), \
+				self.assertLogs('apps.game.engine.scheduler', 'ERROR'):
+			actor.start()
+			error = await receive_type(channel, 'game_error')
+			over = await receive_type(channel, 'game_over')
+			await actor.finish_task
+
+		self.assertIn('boom', error['message'])
+		self.assertEqual(over['result'], result)
+		self.assertTrue(actor.finished)
+		self.assertNotIn(actor.room_name, scheduler.rooms)
+		self.assertNotIn(actor.room_name, RoomActor.active_rooms)
+		end_game_room.assert_awaited_once()
@@ -0,0 +1,107 @@
+import tempfile
+from unittest.mock import AsyncMock, patch
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase
+from apps.game.engine.actor import RoomActor
+from apps.game.engine.checkpoint import FileCheckpointStore
+from apps.game.engine.registry import LocalRoomRegistry
+from apps.game.engine.scheduler import scheduler
+from apps.game.engine.worker import GameWorker, RemoteRoom
+from apps.game.tests.helpers import engine_settings, make_worker, receive_type, stop_room, wait_ticks
+
+PLAYERS = (
+	{'id': 1, 'username': 'player1', 'side': 'left'},
+	{'id': 2, 'username': 'player2', 'side': 'right'},
+)
+
+
+def room_config(room_name):
+	return {
+		'room_name': room_name,
+		'group_name': f'room_{room_name}',
+		'map_name': 'classic',
+		'player_count': 2,
+		'snapshot_rate': None,
+	}
+
+
+@engine_settings
+@patch.object(GameWorker, 'in_progress', AsyncMock(return_value=True))
+class HandOffTests(SimpleTestCase):
+	async def test_drained_room_rejoins_its_new_owner(self):
+		registry = LocalRoomRegistry()
+		checkpoints = FileCheckpointStore(tempfile.mkdtemp(prefix='game-checkpoints-'))
+		old = await make_worker(registry, checkpoints)
+		new = await make_worker(registry, checkpoints)
+		config = room_config('handoff-remote')
+		layer = get_channel_layer()
+
+		# Player 2's socket sits on the other worker and forwards to the owner
+		actor = await old.open_room(config)
+		remote = await new.open_room(config)
+		self.assertIsInstance(remote, RemoteRoom)
+		self.assertEqual(remote.owner, old.channel_name)
+		remote_socket = await layer.new_channel()
+		await layer.group_add(config['group_name'], remote_socket)
+
+		for player in PLAYERS:
+			await actor.join(player, 'json', False)
+		actor.start()
+		await old.hand_off()
+
+		self.assertTrue(actor.finished)
+		self.assertNotIn(config['room_name'], RoomActor.active_rooms)
+		await receive_type(remote_socket, 'server.restart')
+
+		# Its reconnect lands on the other worker, which restores the room and resumes once both are back
+		restored = await new.open_room(config)
+		try:
+			self.assertIsInstance(restored, RoomActor)
+			self.assertEqual(await registry.owner(config['room_name']), new.channel_name)
+			self.assertEqual(restored.awaiting, {'1', '2'})
+
+			for player in PLAYERS:
+				await restored.join(player, 'json', True)
+			self.assertTrue(restored.running)
+			self.assertIs(scheduler.rooms.get(config['room_name']), restored)
+		finally:
+			restored.abandon_task.cancel()
+			await stop_room(restored)
+
+
+	async def test_recovered_room_restarts_the_sockets_of_other_workers(self):
+		registry = LocalRoomRegistry()
+		checkpoints = FileCheckpointStore(tempfile.mkdtemp(prefix='game-checkpoints-'))
+		crashed = await make_worker(registry, checkpoints)
+		survivor = await make_worker(registry, checkpoints)
+		config = room_config('recover-remote')
+		layer = get_channel_layer()
+
+		actor = await crashed.open_room(config)
+		remote_socket = await layer.new_channel()
+		await layer.group_add(config['group_name'], remote_socket)
+		for player in PLAYERS:
+			await actor.join(player, 'json', False)
+		actor.start()
+		await wait_ticks(actor, 1)
+		await checkpoints.save({config['room_name']: actor.checkpoint()})
+
+		# The owner dies: its actor is gone without ending the game and its claim expires
+		await stop_room(actor)
+		await registry.release(config['room_name'], crashed.channel_name)
+
+		await survivor.recover()
+		restored = RoomActor.active_rooms[config['room_name']]
+		try:
+			restart = await receive_type(remote_socket, 'server.restart')
+			# Sockets that already talk to the new owner keep their connection
+			self.assertEqual(restart['owner'], survivor.channel_name)
+			self.assertEqual(await registry.owner(config['room_name']), survivor.channel_name)
+			self.assertIs(await survivor.open_room(config), restored)
+
+			for player in PLAYERS:
+				await restored.join(player, 'json', True)
+			self.assertTrue(restored.running)
+		finally:
+			restored.abandon_task.cancel()
+			await stop_room(restored)
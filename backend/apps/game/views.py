@@ -0,0 +1,18 @@
+from django.http import HttpResponse
+from apps.game.engine.worker import worker
+from apps.game.engine.metrics import render, CONTENT_TYPE
+
+
+async def metrics(request):
+	"""
+	Prometheus metrics of every live game worker, labelled host:pid. Workers
+	announce theirs in the room registry every heartbeat, the one serving
+	the request reports its current values. nginx does not route /metrics,
+	scrape the backend from inside the network.
+	"""
+	await worker.ensure_started()
+	statuses = await worker.registry.workers()
+	statuses[worker.channel_name] = worker.status()
+	return HttpResponse(render(
+		(f"{status['host']}:{status['pid']}", status.get('metrics', [])) for status in statuses.values()
+	), content_type=CONTENT_TYPE)
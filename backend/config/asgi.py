@@ -9,6 +9,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.dev')
 django.setup()
 
 from apps.game.routing import websocket_urlpatterns
+from apps.game.engine.worker import worker
 
 
 django_asgi_app = get_asgi_application()
@@ -20,3 +21,6 @@ application = ProtocolTypeRouter({
         )
     ),
 })
+
+# Recover the checkpointed rooms as soon as the server runs, not on the first socket
+worker.start_with_server()
@@ -58,15 +58,36 @@ ROOT_URLCONF = "config.urls"
 
 WSGI_APPLICATION = "config.wsgi.application"
 ASGI_APPLICATION = 'config.asgi.application'
+# Channel layer picked with the CHANNEL_LAYER env var:
+# hybrid - Redis lists, same-process group members served from memory (apps/game/layers.py)
+# redis  - plain channels_redis, every message through Redis lists
+# pubsub - Redis pub/sub, no polling but no delivery guarantee for absent receivers
+CHANNEL_LAYER_BACKENDS = {
+    'hybrid': 'apps.game.layers.HybridChannelLayer',
+    'redis': 'channels_redis.core.RedisChannelLayer',
+    'pubsub': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+}
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': CHANNEL_LAYER_BACKENDS[os.environ.get("CHANNEL_LAYER", "hybrid")],
         'CONFIG': {
             "hosts": [('redis', 6379)],
         },
     },
 }
 
+# Server side game simulation rate in Hz. Collisions are swept, so 20-30 Hz
+# plays the same as 60, with fewer frames sent to each client.
+GAME_TICK_RATE = int(os.environ.get("GAME_TICK_RATE", 60))
+
+# Which worker process owns each live game room: a Redis URL shared by all
+# workers, or 'local' when a single daphne process runs every room
+GAME_ROOM_REGISTRY = os.environ.get("GAME_ROOM_REGISTRY", "redis://redis:6379/1")
+
+# Where running rooms are checkpointed so a restarted worker can restore
+# them: a Redis URL, or a directory when a single daphne process runs
+GAME_CHECKPOINTS = os.environ.get("GAME_CHECKPOINTS", "redis://redis:6379/1")
+
 CSRF_USE_SESSIONS = False
 CSRF_COOKIE_HTTPONLY = False  # Important for JS access
 CSRF_COOKIE_SAMESITE = "Lax"  # Or 'Strict' depending on your needs
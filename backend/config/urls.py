@@ -17,9 +17,11 @@ Including another URLconf
 
 from django.urls import path, include
 from django.conf import settings
+from apps.game.views import metrics
 
 # this pattern to serve single page application
 urlpatterns = \
 [
     path("api/", include("apps.api.urls")),  # API endpoints
+    path("metrics", metrics, name="metrics"),  # Prometheus, internal only
 ]
@@ -14,12 +14,21 @@ python manage.py makemigrations api
 python manage.py makemigrations
 python manage.py migrate
 
+# Game rooms are sharded between the workers, one per core unless GAME_WORKERS says otherwise.
+# The sockets of a room land on any worker, only the hybrid channel layer keeps up with the
+# traffic between workers without dropping frames, so other layers run a single worker.
+if [ "${CHANNEL_LAYER:-hybrid}" = "hybrid" ]; then
+    GAME_WORKERS=${GAME_WORKERS:-$(nproc)}
+else
+    GAME_WORKERS=${GAME_WORKERS:-1}
+fi
+
 # Start server
 if [ "$PRODUCTION" = "True" ]; then
-    echo "Running in production mode"
-    exec daphne -b 0.0.0.0 -p 8000 config.asgi:application
+    echo "Running in production mode with $GAME_WORKERS workers"
+    exec python manage.py runworkers --workers "$GAME_WORKERS" --port 8000
 else
-    echo "Running in development mode"
+    echo "Running in development mode with $GAME_WORKERS workers"
     # exec python manage.py runserver 0.0.0.0:8000
-    exec daphne -b 0.0.0.0 -p 8000 config.asgi:application
+    exec python manage.py runworkers --workers "$GAME_WORKERS" --port 8000
 fi
\ No newline at end of file
@@ -1,10 +1,56 @@
+// Binary game protocol (pong.binary.v3), see apps/game/engine/protocol.py
+const BINARY_PROTOCOL = 'pong.binary.v3';
+const SIDES = ['left', 'right', 'bottom', 'top'];
+const MSG_STATE = 0x01;
+const STATE_HEADER_SIZE = 32;
+const STATE_PADDLE_SIZE = 13;
+const INPUT_SIZE = 13;
+const BINARY_INPUTS = {
+	paddle_move: [0x10, 'position', 'rotation', 'seq'],
+};
+// Close codes of a server restarting (1012) or draining (1013), the room lives on elsewhere
+const RETRY_CLOSE_CODES = [1012, 1013];
+const RETRY_DELAY = 1000;
+const MAX_RETRIES = 5;
+
+/**
+ * Apply a state delta in place, nested objects are merged and everything else replaced
+ * @param {Object} target - The state to update
+ * @param {Object} delta - The changed fields
+ */
+function applyDelta(target, delta) {
+	for (const [key, value] of Object.entries(delta)) {
+		const current = target[key];
+		if (value !== null && typeof value === 'object' && !Array.isArray(value)
+			&& current !== null && typeof current === 'object' && !Array.isArray(current)) {
+			applyDelta(current, value);
+		} else {
+			target[key] = value;
+		}
+	}
+}
+
 export default class WebSocketManager {
-	constructor(endpoint) {
+	constructor(endpoint, protocols = []) {
 		this.url = `${this.getWebsocketHost()}/ws/${endpoint}/`;
+		this.protocols = protocols;
 		this.socket = null;
 
+		// Last full state received with the delta protocol
+		this.keyframe = null;
+		// Last full state, binary frames only carry the fields that change every tick
+		this.state = null;
+
 		// Callback function
 		this.handleMessage = null;
+
+		// Reconnections left after a server restart, reset once connected
+		this.retries = MAX_RETRIES;
+		this.closing = false;
+
+		// Round trip time and clock offset (ours minus the server's) in ms, as measured by the server
+		this.rtt = null;
+		this.clockOffset = null;
 	}
 
 	/**
@@ -24,19 +70,36 @@ export default class WebSocketManager {
 	connect() {
 		try {
 			console.debug('Connecting to socket ', this.url);
-			this.socket = new WebSocket(this.url);
+			this.socket = new WebSocket(this.url, this.protocols);
+			this.socket.binaryType = 'arraybuffer';
 
 			this.socket.onopen = () => {
 				console.debug('Connected to socket ', this.url);
+				this.retries = MAX_RETRIES;
 			};
 
 			this.socket.onmessage = (event) => {
-				const data = JSON.parse(event.data);
-				this.handleMessage(data);
+				const message = event.data instanceof ArrayBuffer ? null : JSON.parse(event.data);
+				if (message?.type === 'ping') {
+					this.answerPing(message);
+					return;
+				}
+
+				const data = message ? this.expandFrame(message) : this.decodeBinaryFrame(event.data);
+				if (data) {
+					this.handleMessage(data);
+				}
 			};
 
 			this.socket.onclose = (event) => {
-				if (event.code === 1000) {
+				if (RETRY_CLOSE_CODES.includes(event.code) && !this.closing && this.retries > 0) {
+					console.debug('Server restarting, reconnecting to', this.url);
+					this.retries--;
+					this.keyframe = null;
+					this.state = null;
+					setTimeout(() => this.connect(), RETRY_DELAY);
+				}
+				else if (event.code === 1000) {
 					console.debug('Socket closed normally');
 				}
 				else if (event.code === 1006) {
@@ -54,13 +117,103 @@ export default class WebSocketManager {
 		}
 	}
 
+	/**
+	 * Answer a latency ping right away with our clock, and keep the server's latest estimates
+	 * @param {Object} message - The ping
+	 */
+	answerPing(message) {
+		this.rtt = message.rtt;
+		this.clockOffset = message.offset;
+		this.send({ type: 'pong', id: message.id, client_time: Date.now() });
+	}
+
+	/**
+	 * Turn delta protocol frames back into plain game_state_update messages
+	 * @param {Object} data - The decoded message
+	 * @returns {Object|null} The message to handle, null if it cannot be applied yet
+	 */
+	expandFrame(data) {
+		if (data.type === 'state_keyframe') {
+			this.keyframe = data;
+			this.state = structuredClone(data.state);
+			return { type: 'game_state_update', tick: data.tick, time: data.time, acks: data.acks, state: this.state };
+		}
+
+		if (data.type === 'state_delta') {
+			// Deltas are relative to a keyframe, wait for the one they refer to
+			if (!this.keyframe || this.keyframe.tick !== data.keyframe) {
+				return null;
+			}
+			this.state = structuredClone(this.keyframe.state);
+			applyDelta(this.state, data.delta);
+			return { type: 'game_state_update', tick: data.tick, time: data.time, acks: data.acks, state: this.state };
+		}
+
+		if (data.type === 'game_state_update') {
+			this.state = data.state;
+		}
+
+		return data;
+	}
+
+	/**
+	 * Decode a binary state frame on top of the last full state
+	 * @param {ArrayBuffer} buffer - The received frame
+	 * @returns {Object|null} A game_state_update message, null if it cannot be applied yet
+	 */
+	decodeBinaryFrame(buffer) {
+		const view = new DataView(buffer);
+		if (view.getUint8(0) !== MSG_STATE || !this.state) {
+			return null;
+		}
+
+		const state = structuredClone(this.state);
+		const mask = view.getUint8(13);
+		state.pongLogic.lastWinner = SIDES[view.getUint8(14)] ?? null;
+		state.pongLogic.lastLoser = SIDES[view.getUint8(15)] ?? null;
+		state.pongLogic.ballPos = { x: view.getFloat32(16, true), y: view.getFloat32(20, true) };
+		state.pongLogic.ballSpeed = { x: view.getFloat32(24, true), y: view.getFloat32(28, true) };
+
+		const acks = {};
+		let offset = STATE_HEADER_SIZE;
+		SIDES.forEach((side, index) => {
+			if (!(mask & (1 << index))) {
+				return;
+			}
+			state.settings.paddleLoc[side] = {
+				position: view.getFloat32(offset, true),
+				rotation: view.getFloat32(offset + 4, true),
+			};
+			state.score[side] = view.getUint8(offset + 8);
+			const ack = view.getUint32(offset + 9, true);
+			if (ack) {
+				acks[side] = ack;
+			}
+			offset += STATE_PADDLE_SIZE;
+		});
+
+		this.state = state;
+		return { type: 'game_state_update', tick: view.getUint32(1, true), time: view.getFloat64(5, true), acks, state };
+	}
+
 	/**
 	 * Send a message to the WebSocket
 	 * @param {Object} message - The message to send
 	 */
 	send(message) {
 		if (this.socket && this.socket.readyState === WebSocket.OPEN) {
-			this.socket.send(JSON.stringify(message));
+			const binary = this.socket.protocol === BINARY_PROTOCOL && BINARY_INPUTS[message.type];
+			if (binary) {
+				const [type, first, second, seq] = binary;
+				const view = new DataView(new ArrayBuffer(INPUT_SIZE));
+				view.setUint8(0, type);
+				view.setFloat32(1, message[first], true);
+				view.setFloat32(5, message[second], true);
+				view.setUint32(9, message[seq] ?? 0, true);
+				this.socket.send(view.buffer);
+			} else {
+				this.socket.send(JSON.stringify(message));
+			}
 		} else {
 			console.error('Socket is not open. Cannot send message:', message);
 		}
@@ -70,6 +223,7 @@ export default class WebSocketManager {
 	 * Disconnect from WebSocket
 	 */
 	disconnect() {
+		this.closing = true;
 		if (this.socket) {
 			this.socket.close();
 		}
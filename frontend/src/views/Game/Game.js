@@ -211,7 +211,7 @@ class Game {
 
 	// Setup WebSocket connection
 	setupWebSocket() {
-		this.socket = new Socket(`game/${this.roomName}`);
+		this.socket = new Socket(`game/${this.roomName}`, ['pong.binary.v3', 'pong.delta.v1']);
 
 		this.socket.connect();
 
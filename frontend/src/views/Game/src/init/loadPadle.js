@@ -62,13 +62,14 @@ export function getNewPosition(side, mapStyle, position) {
   }
 }
 
+// Paddles stay inside the play area, like paddle_limit() in the server's physics.py
 export function checkBounderyPadle(settings, name, pongLogic, speed) {
   if (name === PlayerSide.LEFT || name == PlayerSide.RIGHT) {
-    if ((Math.abs(settings.paddleLoc[name] + speed) - settings.paddleSize[name].y / 2) >= pongLogic.playArea.depth / 2) {
+    if (Math.abs(settings.paddleLoc[name] + speed) + settings.paddleSize[name].y / 2 > pongLogic.playArea.depth / 2) {
       return false;
     }
   } else {
-    if ((Math.abs(settings.paddleLoc[name] + speed) - settings.paddleSize[name].x / 2) >= pongLogic.playArea.width / 2) {
+    if (Math.abs(settings.paddleLoc[name] + speed) + settings.paddleSize[name].x / 2 > pongLogic.playArea.width / 2) {
       return false;
     }
   }
@@ -77,11 +78,11 @@ export function checkBounderyPadle(settings, name, pongLogic, speed) {
 
 export function checkBounderyPadlePos(position, settings, name, pongLogic, speed) {
   if (name === PlayerSide.LEFT || name == PlayerSide.RIGHT) {
-    if ((Math.abs(position.y + speed) - settings.paddleSize[name].y / 2) >= pongLogic.playArea.depth / 2) {
+    if (Math.abs(position.y + speed) + settings.paddleSize[name].y / 2 > pongLogic.playArea.depth / 2) {
       return false;
     }
   } else {
-    if ((Math.abs(position.x + speed) - settings.paddleSize[name].x / 2) >= pongLogic.playArea.width / 2) {
+    if (Math.abs(position.x + speed) + settings.paddleSize[name].x / 2 > pongLogic.playArea.width / 2) {
       return false;
     }
   }
@@ -76,14 +76,7 @@ export default class Game {
 			if (this.pongLogic.socket.didReset || this.init.settings.mode !== Mode.NETWORKED) {
 				this.pongLogic.update(input, this.gameScene);
 			}
-			if (this.pongLogic.isHost){
-				this.pongLogic.update(input, this.gameScene);
-				// if (this.pongLogic.resetBall && this.pongLogic.isHost) {
-				// 	this.pongLogic.resetBall = false
-				// 	this.pongLogic.reset(this.init)
-				// }
-			}
-			if ((this.init.settings.mode !== Mode.NETWORKED || (this.init.settings.mode === Mode.NETWORKED && this.pongLogic.isHost)) && this.pongLogic.resetBall){
+			if (this.init.settings.mode !== Mode.NETWORKED && this.pongLogic.resetBall){
 				console.log("this.pongLogic.lastContact", this.pongLogic.lastContact, this.pongLogic.settings.playerSide.length)
 				if (this.pongLogic.settings.playerSide.length == 4 && this.pongLogic.lastContact === "null"){
 					this.pongLogic.resetMatch(this.init, this.pongLogic.settings.playerSide.length == 4)	
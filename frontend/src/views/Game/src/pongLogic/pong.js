@@ -80,59 +80,12 @@ class Pong {
 	}
 
 	checkCollisions(ballPosition3D, gameScene) {
+		// Networked games are simulated by the server (apps/game/engine/physics.py)
 		if (this.mode === Mode.LOCAL) {
 			this.localCollisionDetection(ballPosition3D, gameScene);
-		} else if (this.mode === Mode.NETWORKED && this.isHost) {
-			this.networkedCollisionDetection(gameScene);
 		}
 	}
 
-	networkedCollisionDetection(gameScene) {
-		const activePaddles =
-			this.settings.playerSide.map(side => ({
-				side,
-				position: gameScene.getAssetPossition(side),
-				size: this.settings.paddleSize[side],
-			}));
-		const ballBox = this.createBoundingBox(this.ballPos, this.ballSize);
-		this.paddle_collided = false;
-		this.reset_ball = false;
-
-		// Check for paddle collisions
-		activePaddles.forEach(({ side, position, size }) => {
-			const paddleBox = this.createBoundingBox(position, size);
-
-			if (this.intersectsBox(ballBox, paddleBox)) {
-				this.handlePaddleCollision(side, this.ballPos, position);
-				this.socket.sendBallVelocity(this.ballSpeed);
-				return;
-			}
-		});
-
-		// Check for wall collisions (top & bottom bounds)
-		if (Math.abs(this.ballPos.y) >= this.playArea.depth / 2) {
-			if (this.settings.playercount === 2) {
-				if ((this.ballPos.y < 0 && this.ballSpeed.y < 0) || (this.ballPos.y > 0 && this.ballSpeed.y > 0)) {
-					this.ballSpeed.y = -this.ballSpeed.y;
-					this.socket.sendBallVelocity(this.ballSpeed);
-				}
-				// return;
-			} else {
-				this.handleBallOutOfBounds(this.ballPos);
-			}
-		}
-
-		// Check if ball is out of bounds (left & right bounds)
-		if (Math.abs(this.ballPos.x) >= this.playArea.width / 2) {
-			this.handleBallOutOfBounds(this.ballPos);
-		}
-		// Cap the Y speed
-		if (Math.abs(this.ballSpeed.y) > this.ySpeedCap) {
-			this.ballSpeed.y = this.ballSpeed.y < 0 ? -this.ySpeedCap : this.ySpeedCap;
-		}
-	}
-
-
 	localCollisionDetection(ballPosition3D, gameScene) {
 		if (this.mode !== Mode.NETWORKED) {
 			this.ballPos = { x: ballPosition3D.x, y: ballPosition3D.y };
@@ -285,28 +238,15 @@ class Pong {
 	resetMatch(init, four_player){
 		console.log("four_player", four_player)
 		this.settings.ballSpeed = this.initBallVelocity(!four_player);
-		if (this.settings.mode === Mode.NETWORKED) {
-			this.socket.resetRound(this);
-			this.socket.sendBallVelocity(this.settings.ballSpeed);
-			this.ballPos = { x: 0, y: 0 };
-		} else {
-			this.ballSpeed = this.settings.ballSpeed
-		}
+		this.ballSpeed = this.settings.ballSpeed
 		console.log(this.settings.ballSpeed)
 		init.gameScene.moveAsset('Ball', { x: 0, y: 0, z: 0 });
 	}
 
 	reset(init, four_player) {
 		this.settings.ballSpeed = this.initBallVelocity(!four_player);
-		if (this.settings.mode === Mode.NETWORKED) {
-			this.socket.resetRound(this);
-			this.socket.updateScore(this)
-			this.socket.sendBallVelocity(this.settings.ballSpeed);
-			this.ballPos = { x: 0, y: 0 };
-		} else {
-			this.scores[intToPlayerSide(this.lastWinner)] += 1;
-			this.ballSpeed = this.settings.ballSpeed
-		}
+		this.scores[intToPlayerSide(this.lastWinner)] += 1;
+		this.ballSpeed = this.settings.ballSpeed
 
 		init.gameScene.moveAsset('Ball', { x: 0, y: 0, z: 0 });
 	}
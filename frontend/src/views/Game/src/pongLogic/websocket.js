@@ -1,15 +1,32 @@
-import { intToPlayerSide } from './setting.js'
-
 import router from '../../../../router.js'
 
+// How far behind the newest snapshot the ball is drawn, in ms. The server
+// sends 20-30 snapshots per second, this leaves room for one late snapshot.
+const INTERPOLATION_DELAY = 100;
+const MAX_SNAPSHOTS = 8;
+// Differences to the server smaller than this are float rounding, not corrections
+const RECONCILE_EPSILON = 1e-3;
+
 export class MyWebSocket {
 	constructor() {
 		this.socket = null;
 		this.didReset = true;
 		this.serverState = null;
+		// Recent snapshots as { time, state }, oldest first
+		this.snapshots = [];
+		// Smallest local time minus server time seen, the server clock as seen from here
+		this.clockOffset = null;
 		this.mySide = null;
 		this.gameOver = false;
 		this.gameResult = null;
+
+		// Our paddle moves as soon as we send an input, the server acknowledges
+		// each one by sequence number in its snapshots
+		this.inputSeq = 0;
+		// Inputs sent and not acknowledged yet, as { seq, position }, oldest first
+		this.pendingInputs = [];
+		// Predicted { position, rotation } of our paddle, null when the server's is current
+		this.predicted = null;
 	}
 
 	init(socket, side) {
@@ -19,6 +36,8 @@ export class MyWebSocket {
 		this.socket.handleMessage = (data) => {
 			if (data.type === "game_state_update") {
 				this.serverState = data.state;
+				this.addSnapshot(data);
+				this.reconcile(data);
 			} else if (data.type === "reset_round") {
 				console.debug("Resetting round");
 				this.didReset = true;
@@ -43,6 +62,95 @@ export class MyWebSocket {
 		};
 	}
 
+	addSnapshot(data) {
+		if (data.time === undefined) {
+			return;
+		}
+
+		const offset = Date.now() - data.time;
+		if (this.clockOffset === null || offset < this.clockOffset) {
+			this.clockOffset = offset;
+		}
+
+		this.snapshots.push({ time: data.time, state: data.state });
+		if (this.snapshots.length > MAX_SNAPSHOTS) {
+			this.snapshots.shift();
+		}
+	}
+
+	/**
+	 * Drop the inputs the server applied and correct the prediction by how far
+	 * the server moved our paddle from where we predicted, for instance at the edges
+	 * @param {Object} data - A game_state_update message
+	 */
+	reconcile(data) {
+		const ack = data.acks?.[this.mySide];
+		const paddle = data.state.settings?.paddleLoc?.[this.mySide];
+		if (!ack || !paddle) {
+			return;
+		}
+
+		const acked = this.pendingInputs.find(input => input.seq === ack);
+		this.pendingInputs = this.pendingInputs.filter(input => input.seq > ack);
+
+		if (this.pendingInputs.length === 0) {
+			this.predicted = null;
+			return;
+		}
+
+		const correction = acked ? paddle.position - acked.position : 0;
+		if (Math.abs(correction) > RECONCILE_EPSILON) {
+			this.pendingInputs.forEach(input => input.position += correction);
+			this.predicted.position += correction;
+		}
+	}
+
+	/**
+	 * Ball and paddles at INTERPOLATION_DELAY in the past, between the two snapshots around it
+	 * @returns {Object|null} { ballPos, paddleLoc }, null when there is nothing to interpolate
+	 */
+	interpolate() {
+		const renderTime = Date.now() - this.clockOffset - INTERPOLATION_DELAY;
+		const index = this.snapshots.findIndex(snapshot => snapshot.time > renderTime);
+		if (index <= 0) {
+			return null;
+		}
+
+		const from = this.snapshots[index - 1].state;
+		const to = this.snapshots[index].state;
+		// Never slide the ball back to the center after a point
+		if (from.pongLogic.lastLoser !== to.pongLogic.lastLoser
+			|| JSON.stringify(from.score) !== JSON.stringify(to.score)) {
+			return null;
+		}
+
+		const fromTime = this.snapshots[index - 1].time;
+		const alpha = (renderTime - fromTime) / (this.snapshots[index].time - fromTime);
+		const lerp = (a, b) => a + (b - a) * alpha;
+
+		const paddleLoc = {};
+		for (const [side, paddle] of Object.entries(to.settings.paddleLoc)) {
+			const previous = from.settings.paddleLoc[side];
+			if (side === this.mySide) {
+				// Our own paddle must not lag behind the input, use the newest position
+				paddleLoc[side] = this.serverState.settings.paddleLoc[side] ?? paddle;
+				continue;
+			}
+			paddleLoc[side] = !previous ? paddle : {
+				position: lerp(previous.position, paddle.position),
+				rotation: lerp(previous.rotation, paddle.rotation),
+			};
+		}
+
+		return {
+			ballPos: {
+				x: lerp(from.pongLogic.ballPos.x, to.pongLogic.ballPos.x),
+				y: lerp(from.pongLogic.ballPos.y, to.pongLogic.ballPos.y),
+			},
+			paddleLoc,
+		};
+	}
+
 	startGame() {
 		this.socket.send({'type': 'start_game'});
 	}
@@ -59,10 +167,18 @@ export class MyWebSocket {
 			rotation = 0;
 		}
 
+		const current = this.predicted ?? settings.paddleLoc[this.mySide];
+		const position = current.position + paddleInput[this.mySide];
+
+		this.inputSeq++;
+		this.pendingInputs.push({ seq: this.inputSeq, position });
+		this.predicted = { position, rotation };
+
 		let paddleInfo = {
 			type: 'paddle_move',
-			position: settings.paddleLoc[this.mySide].position + paddleInput[this.mySide],
+			position: position,
 			rotation: rotation,
+			seq: this.inputSeq,
 		}
 
 		this.socket.send(paddleInfo)
@@ -75,31 +191,6 @@ export class MyWebSocket {
 		return this.serverState.settings.ballSize;
 	}
 
-	sendBallVelocity(ballPos) {
-		const ballVelocityRequest = {
-			type: "set_ball_velocity",
-			x: ballPos.x,
-			y: ballPos.y
-		}
-		this.socket.send(ballVelocityRequest);
-	}
-
-	resetRound(pongLogic) {
-		let request = {
-			type: "reset_round",
-			lastWinner: intToPlayerSide(pongLogic.lastWinner),
-			lastLoser: "",
-		}
-
-		if (!pongLogic.lastLoser) {
-			request.lastLoser = intToPlayerSide(3 - pongLogic.lastWinner);
-		} else {
-			request.lastLoser = intToPlayerSide(pongLogic.lastWinner);
-		}
-
-		this.socket.send(request);
-	}
-
 	update(pongLogic, settings) {
 		if (this.serverState) {
 			pongLogic.ballPos = this.serverState.pongLogic.ballPos;
@@ -120,15 +211,18 @@ export class MyWebSocket {
 			if (this.serverState.score) {
 				pongLogic.scores = this.serverState.score;
 			}
-		}
-	}
 
-	async updateScore(pongLogic) {
-		const request = {
-			type: 'update_score',
-			scoring_position: intToPlayerSide(pongLogic.lastWinner)
+			const interpolated = this.interpolate();
+			if (interpolated) {
+				pongLogic.ballPos = interpolated.ballPos;
+				settings.paddleLoc = interpolated.paddleLoc;
+			}
+
+			// Our paddle is drawn where our inputs put it, ahead of the server
+			if (this.predicted && settings.paddleLoc[this.mySide]) {
+				settings.paddleLoc = { ...settings.paddleLoc, [this.mySide]: this.predicted };
+			}
 		}
-		this.socket.send(request);
 	}
 
 	// Show game over screen when game ends